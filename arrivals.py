@@ -0,0 +1,100 @@
+import math
+import random
+
+import numpy as np
+
+# One row per arriving vehicle: time it is due, type and direction numbers, and distance behind the start of the lane
+arrivalType = np.dtype([('time', np.float64), ('vehicle_type', np.int8), ('direction', np.int8), ('gap', np.int16)])
+
+
+class ArrivalStream:
+    """
+    Class to represent the stream of vehicles arriving at an intersection, either drawn on the fly from a seeded
+    random generator or replayed from a schedule (see generate_arrivals). The same seed always draws the same stream,
+    whatever the traffic light policy, so policies can be compared on common random numbers.
+    """
+
+    def __init__(self, trafficDensity, direction_priority, seed=None, schedule=None):
+        """
+        Initialize the stream.
+
+        Parameters:
+        trafficDensity (float): Density of traffic, one vehicle arrives every 1 / (3 * trafficDensity) seconds.
+        direction_priority (list): Weight of each direction for the arriving vehicles. The list is read at each
+                                   arrival, so changing it changes the next directions.
+        seed: Seed of the random generator.
+        schedule (np.ndarray): Arrivals to replay (arrivalType rows), instead of drawing them.
+        """
+        self.trafficDensity = trafficDensity
+        self.direction_priority = direction_priority
+        self.random = random.Random(seed)
+        self.schedule = schedule
+        self.index = 0  # Number of vehicles arrived so far
+        self._next_time = 0
+
+    @property
+    def next_time(self):
+        """Time the next vehicle is due, infinite once the stream is exhausted."""
+        if self.schedule is not None:
+            return self.schedule['time'][self.index] if self.index < len(self.schedule) else math.inf
+        return self._next_time if any(self.direction_priority) else math.inf
+
+    @property
+    def exhausted(self):
+        return self.next_time == math.inf
+
+    def pop(self):
+        """
+        Return the next arriving vehicle.
+
+        Returns:
+        int: Number of its type.
+        int: Number of its direction.
+        int: Distance it spawns behind the start of its lane.
+        """
+        self.index += 1
+        if self.schedule is not None:
+            arrival = self.schedule[self.index - 1]
+            return int(arrival['vehicle_type']), int(arrival['direction']), int(arrival['gap'])
+
+        # Randomly select a vehicle type, and a direction based on the direction priority
+        type_number = self.random.randint(0, 3)
+        direction_number = self.random.choices(population=[0, 1, 2, 3], weights=self.direction_priority, k=1)[0]
+        gap = self.random.randint(100, 200)
+        # One vehicle every 1 / (3 * density) simulated seconds
+        self._next_time += 1 / (3 * self.trafficDensity)
+        return type_number, direction_number, gap
+
+
+def generate_arrivals(num_vehicles, trafficDensity, direction_priority, seed=None):
+    """
+    Draw the arrival schedule of num_vehicles vehicles. It holds exactly the vehicles a simulation with the same
+    parameters and seed would draw on the fly.
+
+    Returns:
+    np.ndarray: The schedule, one arrivalType row per vehicle.
+    """
+    stream = ArrivalStream(trafficDensity, direction_priority, seed=seed)
+    schedule = np.zeros(num_vehicles, dtype=arrivalType)
+    for arrival in schedule:
+        arrival['time'] = stream.next_time
+        arrival['vehicle_type'], arrival['direction'], arrival['gap'] = stream.pop()
+    return schedule
+
+
+def save_arrivals(filename, schedule):
+    """Save an arrival schedule to a .npy file."""
+    np.save(filename, schedule)
+
+
+def load_arrivals(filename):
+    """
+    Load an arrival schedule saved by save_arrivals.
+
+    Returns:
+    np.ndarray: The schedule.
+    """
+    schedule = np.load(filename)
+    if schedule.dtype != arrivalType:
+        raise ValueError(f"{filename} is not an arrival schedule")
+    return schedule
@@ -0,0 +1,143 @@
+import itertools
+import math
+import multiprocessing
+import statistics
+
+from metrics import CrossingMetrics
+from simulation import RunSimulation, TRAFFIC_DENSITY
+
+# Parameters of a run when a parameter set does not give them
+DEFAULT_PARAMETERS = {
+    'total_vehicles_to_cross': 20,
+    'simulation_speed': 10,
+    'traffic_density': TRAFFIC_DENSITY,
+    'direction_priority': [1, 1, 1, 1],
+    'traffic_light_policy': 'normal',
+    'seed': None,
+    'arrivals': None,  # Name of an arrival schedule .npy file to replay (see arrivals.py)
+    'model': None,  # Model controlling the signals instead of the traffic light policy (see RunSimulation)
+}
+
+# Two-sided 95% critical values of Student's t distribution by degrees of freedom (1.96 above 30)
+T_CRITICAL_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+                 10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101,
+                 19: 2.093, 20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052,
+                 28: 2.048, 29: 2.045, 30: 2.042}
+
+
+def make_sweep(num_runs, base_seed=0, **grid):
+    """
+    Build the parameter sets of a sweep: every combination of the values in grid, each run with the seeds
+    base_seed to base_seed + num_runs - 1 (the same seeds for every combination).
+
+    Example: make_sweep(10, traffic_light_policy=['normal', 'optimal'], traffic_density=[0.3, 0.6])
+
+    Returns:
+    list: The parameter sets.
+    """
+    names = list(grid)
+    parameter_sets = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        for seed in range(base_seed, base_seed + num_runs):
+            parameter_sets.append(dict(zip(names, values), seed=seed))
+    return parameter_sets
+
+
+def run_simulation(parameters):
+    """
+    Run one headless simulation. Every run starts from a freshly initialized simulation state, so runs done one
+    after the other in the same worker process don't affect each other.
+
+    Parameters:
+    parameters (dict): Parameters of the run, see DEFAULT_PARAMETERS.
+
+    Returns:
+    dict: The results of the simulation (RunSimulation.get_results()).
+    """
+    return _run_with_metrics(parameters)[0]
+
+
+def _run_with_metrics(parameters):
+    # Run one headless simulation, returning its results and its CrossingMetrics
+    parameters = {**DEFAULT_PARAMETERS, **parameters}
+    simulation_instance = RunSimulation(parameters['total_vehicles_to_cross'], parameters['simulation_speed'],
+                                        parameters['traffic_density'], parameters['direction_priority'],
+                                        parameters['traffic_light_policy'], headless=True, seed=parameters['seed'],
+                                        arrivals=parameters['arrivals'], model=parameters['model'])
+    return simulation_instance.get_results(), simulation_instance.metrics
+
+
+def summarize(results):
+    """
+    Compute the mean and the 95% confidence interval of each result over several runs.
+
+    Parameters:
+    results (list): get_results() dicts of the runs.
+
+    Returns:
+    dict: For each result, a dict with its 'mean' and its confidence interval 'ci' (low, high).
+    """
+    summary = {}
+    for key in results[0]:
+        values = [result[key] for result in results]
+        mean = statistics.mean(values)
+        if len(values) > 1:
+            t = T_CRITICAL_95.get(len(values) - 1, 1.96)
+            half_width = t * statistics.stdev(values) / math.sqrt(len(values))
+        else:
+            half_width = math.nan
+        summary[key] = {'mean': mean, 'ci': (mean - half_width, mean + half_width)}
+    return summary
+
+
+def summarize_differences(results, baseline_results):
+    """
+    Compute the mean and the 95% confidence interval of the difference of each result with a baseline, run by run.
+    When both were run on the same seeds (common random numbers), their noise mostly cancels out, so the interval is
+    much narrower than the difference of two independent summaries for the same number of runs.
+
+    Parameters:
+    results (list): get_results() dicts of the runs.
+    baseline_results (list): get_results() dicts of the baseline runs, on the same seeds in the same order.
+
+    Returns:
+    dict: For each result, the 'mean' and the confidence interval 'ci' of its difference (see summarize).
+    """
+    return summarize([{key: result[key] - baseline[key] for key in result}
+                      for result, baseline in zip(results, baseline_results)])
+
+
+def _configuration(parameters):
+    # Parameters of a run without its seed, as a hashable key
+    parameters = {**DEFAULT_PARAMETERS, **parameters}
+    return tuple((name, tuple(value) if isinstance(value, list) else repr(value) if isinstance(value, dict) else value)
+                 for name, value in sorted(parameters.items()) if name != 'seed')
+
+
+def run_batch(parameter_sets, processes=None):
+    """
+    Run a batch of headless simulations in parallel on a pool of processes.
+
+    Parameters:
+    parameter_sets (list): Parameters of each run (see DEFAULT_PARAMETERS and make_sweep).
+    processes (int): Number of worker processes, all the CPU cores by default.
+
+    Returns:
+    list: The results of each run, in the order of parameter_sets.
+    list: For each configuration (parameters other than the seed), a dict with its 'parameters', the number of
+          'runs', the 'summary' of its results (see summarize) and the 'metrics' of all the vehicles of its runs
+          (CrossingMetrics.results of the merged metrics of the runs).
+    """
+    with multiprocessing.Pool(processes) as pool:
+        outputs = pool.map(_run_with_metrics, parameter_sets, chunksize=1)
+    results = [result for result, _ in outputs]
+
+    configurations = {}
+    for parameters, (result, metrics) in zip(parameter_sets, outputs):
+        runs, merged_metrics = configurations.setdefault(_configuration(parameters), ([], CrossingMetrics()))
+        runs.append(result)
+        merged_metrics.merge(metrics)
+    summaries = [{'parameters': dict(configuration), 'runs': len(runs), 'summary': summarize(runs),
+                  'metrics': metrics.results()}
+                 for configuration, (runs, metrics) in configurations.items()]
+    return results, summaries
@@ -0,0 +1,184 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from batch import DEFAULT_PARAMETERS
+from simulation import RunSimulation
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+# Configurations measured by default: every combination of these values
+VEHICLE_COUNTS = [10, 100, 1000, 10000]
+TRAFFIC_DENSITIES = [0.1, 0.3, 0.6, 1.0]
+POLICIES = ['normal', 'optimal']
+RENDERING = [False, True]
+REPEATS = 3  # Runs of each configuration, the fastest one being kept (the others were slowed down by the machine)
+BASELINE_FILE = 'benchmark_baseline.json'
+REGRESSION_THRESHOLD = 0.2  # Relative loss of throughput of a configuration, from the baseline, failing the benchmark
+THROUGHPUT = 'sim_seconds_per_second'  # Result compared with the baseline
+
+
+def benchmark_run(configuration):
+    """
+    Run one simulation and measure its speed. The window is drawn without waiting between frames, so that with
+    rendering the benchmark measures the cost of drawing, not the frame rate.
+
+    Parameters:
+    configuration (dict): 'total_vehicles_to_cross', 'traffic_density', 'traffic_light_policy' and 'render', and
+                          optionally the other parameters of batch.DEFAULT_PARAMETERS.
+
+    Returns:
+    dict: The configuration, with the 'wall_seconds' and the 'sim_seconds' of the run, the simulated seconds per
+          wall-clock second ('sim_seconds_per_second'), the 'ticks_per_second' and the 'peak_memory_mb' of the
+          process.
+    """
+    parameters = {**DEFAULT_PARAMETERS, 'seed': 0, **configuration}
+    if parameters['render']:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # Draw without a screen
+    start = time.perf_counter()
+    simulation_instance = RunSimulation(parameters['total_vehicles_to_cross'], parameters['simulation_speed'],
+                                        parameters['traffic_density'], parameters['direction_priority'],
+                                        parameters['traffic_light_policy'], headless=not parameters['render'],
+                                        seed=parameters['seed'], paced=False)
+    wall_seconds = time.perf_counter() - start
+    ticks = simulation_instance.intersection.ticks
+    return {**configuration, 'wall_seconds': wall_seconds, 'sim_seconds': simulation_instance.total_time,
+            'sim_seconds_per_second': simulation_instance.total_time / wall_seconds,
+            'ticks_per_second': ticks / wall_seconds,
+            # Peak resident memory of the process, in kilobytes on Linux
+            'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def run_benchmark(vehicle_counts=VEHICLE_COUNTS, traffic_densities=TRAFFIC_DENSITIES, policies=POLICIES,
+                  rendering=RENDERING, repeats=REPEATS):
+    """
+    Measure every combination of the given values, one run after the other so that they don't compete for the CPU,
+    each in a new process so that its peak memory is its own.
+
+    Returns:
+    list: The result of the fastest of the repeats runs of each configuration (see benchmark_run).
+    """
+    configurations = [{'total_vehicles_to_cross': vehicles, 'traffic_density': density,
+                       'traffic_light_policy': policy, 'render': render}
+                      for render in rendering for policy in policies for density in traffic_densities
+                      for vehicles in vehicle_counts]
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        runs = pool.map(benchmark_run, [configuration for configuration in configurations for _ in range(repeats)],
+                        chunksize=1)
+    return [max(runs[i * repeats:(i + 1) * repeats], key=lambda result: result[THROUGHPUT])
+            for i in range(len(configurations))]
+
+
+def configuration_key(result):
+    """Return the configuration of a result, as a hashable key."""
+    return (result['total_vehicles_to_cross'], result['traffic_density'], result['traffic_light_policy'],
+            result['render'])
+
+
+def save_results(results, filename):
+    with open(filename, 'w') as file:
+        json.dump({'results': results}, file, indent=4)
+
+
+def load_results(filename):
+    with open(filename) as file:
+        return json.load(file)['results']
+
+
+def find_regressions(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare the throughput of each configuration with the baseline.
+
+    Parameters:
+    results (list): The results of the runs.
+    baseline (list): The results of a previous benchmark, on the same machine.
+    threshold (float): Relative loss of throughput counted as a regression.
+
+    Returns:
+    list: For each configuration that regressed, its result with the 'baseline' throughput and its relative
+          'change'.
+    """
+    baseline = {configuration_key(result): result[THROUGHPUT] for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline.get(configuration_key(result))
+        if reference:
+            change = result[THROUGHPUT] / reference - 1
+            if change < -threshold:
+                regressions.append({**result, 'baseline': reference, 'change': change})
+    return regressions
+
+
+def plot_scaling(results, filename):
+    """
+    Plot the throughput against the number of vehicles, for each policy and rendering (one line per traffic
+    density). Needs matplotlib.
+    """
+    if plt is None:
+        raise ImportError("Plotting the benchmark needs matplotlib")
+    panels = sorted({(result['traffic_light_policy'], result['render']) for result in results})
+    figure, axes = plt.subplots(2, len(panels), figsize=(5 * len(panels), 8), squeeze=False)
+    for column, (policy, render) in enumerate(panels):
+        for row, (name, label) in enumerate([(THROUGHPUT, 'simulated seconds per second'),
+                                             ('ticks_per_second', 'ticks per second')]):
+            ax = axes[row][column]
+            for density in sorted({result['traffic_density'] for result in results}):
+                points = sorted((result['total_vehicles_to_cross'], result[name]) for result in results
+                                if (result['traffic_light_policy'], result['render'], result['traffic_density'])
+                                == (policy, render, density))
+                ax.plot(*zip(*points), marker='o', label=f"density {density}")
+            ax.set_xscale('log')
+            ax.set_xlabel('vehicles')
+            ax.set_ylabel(label)
+            ax.set_title(f"{policy}, {'with' if render else 'without'} rendering")
+            ax.legend()
+    figure.tight_layout()
+    figure.savefig(filename)
+    plt.close(figure)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the speed of the simulation and compare it with a baseline.")
+    parser.add_argument('--vehicles', type=int, nargs='+', default=VEHICLE_COUNTS, help="vehicles to cross")
+    parser.add_argument('--densities', type=float, nargs='+', default=TRAFFIC_DENSITIES, help="traffic densities")
+    parser.add_argument('--policies', nargs='+', default=POLICIES, help="traffic light policies")
+    parser.add_argument('--render', choices=['off', 'on', 'both'], default='both', help="draw the window")
+    parser.add_argument('--repeats', type=int, default=REPEATS, help="runs of each configuration")
+    parser.add_argument('--output', default='benchmark_results.json', help="file to write the results to")
+    parser.add_argument('--plot', help="image file to plot the scaling curves to (needs matplotlib)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="results to compare the throughput with")
+    parser.add_argument('--save-baseline', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="regression threshold")
+    args = parser.parse_args()
+
+    rendering = {'off': [False], 'on': [True], 'both': RENDERING}[args.render]
+    results = run_benchmark(args.vehicles, args.densities, args.policies, rendering, args.repeats)
+    for result in results:
+        print(f"{result['total_vehicles_to_cross']} vehicles, density {result['traffic_density']}, "
+              f"{result['traffic_light_policy']}, {'with' if result['render'] else 'without'} rendering: "
+              f"{result['sim_seconds_per_second']:.0f} simulated seconds and {result['ticks_per_second']:.0f} ticks "
+              f"per second, {result['peak_memory_mb']:.0f} MB")
+    save_results(results, args.output)
+    if args.plot is not None:
+        plot_scaling(results, args.plot)
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+    elif os.path.exists(args.baseline):
+        regressions = find_regressions(results, load_results(args.baseline), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression['total_vehicles_to_cross']} vehicles, density "
+                  f"{regression['traffic_density']}, {regression['traffic_light_policy']}, "
+                  f"{'with' if regression['render'] else 'without'} rendering: {regression['change']:.0%} "
+                  f"({regression[THROUGHPUT]:.0f} instead of {regression['baseline']:.0f})")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import threading
+import time
+
+from controllers import QueueState, make_controller
+from metrics import StreamingStats
+from server.server import PORT, CounterServer
+from simulation import TrafficSignal, noOfSignals, repeat
+
+CONTROL_PERIOD = 0.1  # Simulated seconds between two steps of the signal cycles
+TRAFFIC_LIGHT_POLICY = 'actuated'  # Controller of the live intersections (see controllers.py)
+
+
+class LiveIntersection:
+    """
+    Class to run the signal controller of a real intersection on the counts of its cameras, received by a
+    server.CounterServer: the last count of each approach is the number of vehicles in front of its signal, and the
+    signal cycle is advanced with the clock (see run_live), speedup times faster than real time when replaying
+    recorded counts (see replay_counts).
+
+    The counts received since the last step are used by the decisions of the next one, so the decision latency, from
+    the arrival of a count at the server to the controller deciding on it, is at most one step. It is measured for
+    every count, as well as the time a step takes.
+    """
+
+    def __init__(self, server, intersection, traffic_light_policy=TRAFFIC_LIGHT_POLICY, speedup=1):
+        """
+        Initialize the intersection, with its first signal green.
+
+        Parameters:
+        server (server.CounterServer): Server receiving the counts of the cameras.
+        intersection (str): Name of the intersection in the camera ids ("intersection:direction").
+        traffic_light_policy (str or Controller): Name of a controller of the signals, or a controller.
+        speedup (float): Simulated seconds per wall-clock second.
+        """
+        self.server = server
+        self.intersection = intersection
+        self.speedup = speedup
+        self.signals = [TrafficSignal(10, 3, 5) for _ in range(noOfSignals)]
+        self.controller = make_controller(traffic_light_policy)
+        self.queue_state = QueueState()
+        self.currentGreen = 0  # Index indicating which signal is currently green
+        self.nextGreen = 0  # Index indicating which signal will turn green next
+        self.currentYellow = 0  # Indicates whether yellow signal is on or off
+        self.remainingAllRedTime = 0  # Remaining all-red time before nextGreen turns green (currentGreen is -1)
+        self.sim_time = 0  # Simulated clock, in simulated seconds
+        self.last_step = None  # Wall-clock time of the last step
+        self.received = [0.0] * noOfSignals  # Time the count in use of each approach was received at
+        self.phases = []  # (simulated time, signal number) of each signal turning green
+        self.decision_latency = StreamingStats()  # Wall-clock seconds from the arrival of a count to its use
+        self.step_time = StreamingStats()  # Wall-clock seconds taken by a step
+        self.steps = 0
+
+    def apply_counts(self, now):
+        """Use the counts received since the last step as the queues of the signals."""
+        received = self.server.approach_received.get(self.intersection)
+        if received is None:
+            return
+        # The server stores a count before its reception time, so reading the times first never pairs a new time
+        # with an old count
+        received = list(received)
+        counts = self.server.approach_counts(self.intersection)
+        new = [i for i in range(noOfSignals) if received[i] > self.received[i]]
+        for direction_number in new:
+            self.received[direction_number] = received[direction_number]
+            self.queue_state.queues[direction_number] = counts[direction_number]
+            self.signals[direction_number].vehicles_in_front = counts[direction_number]
+        if new:
+            self.decision_latency.add([now - received[i] for i in new])
+
+    def step(self, now=None):
+        """Advance the signal cycle to the wall-clock time now, deciding on the last counts."""
+        now = time.time() if now is None else now
+        if self.last_step is None:
+            self.last_step = now
+        self.apply_counts(now)
+        dt = (now - self.last_step) * self.speedup
+        self.last_step = now
+        self.sim_time += dt
+        green = self.currentGreen
+        repeat(self, dt)
+        if self.currentGreen != green and self.currentGreen != -1:
+            self.phases.append((self.sim_time, self.currentGreen))
+        self.steps += 1
+        self.step_time.add([time.time() - now])
+
+    def results(self):
+        """Return the number of 'steps' and 'phases', and the summaries of the 'decision_latency' and 'step_time'."""
+        return {'steps': self.steps, 'phases': len(self.phases), 'decision_latency': self.decision_latency.summary(),
+                'step_time': self.step_time.summary()}
+
+
+def run_live(intersections, stop, period=CONTROL_PERIOD, speedup=1, callback=None):
+    """
+    Step the live intersections every period simulated seconds until stop is set.
+
+    Parameters:
+    intersections (list): The LiveIntersection to step.
+    stop (threading.Event): Set to stop.
+    period (float): Simulated seconds between two steps, period / speedup wall-clock seconds.
+    speedup (float): Simulated seconds per wall-clock second.
+    callback (callable): Called with each intersection whose signal turned green, after the step.
+    """
+    next_time = time.time()
+    while not stop.is_set():
+        for intersection in intersections:
+            phases = len(intersection.phases)
+            intersection.step()
+            if callback is not None and len(intersection.phases) > phases:
+                callback(intersection)
+        next_time += period / speedup
+        stop.wait(max(0.0, next_time - time.time()))
+
+
+def load_counts(filename):
+    """
+    Load counts recorded by a CounterServer (see its record parameter).
+
+    Returns:
+    list: The (camera id, timestamp, count) of each message, by timestamp.
+    """
+    messages = []
+    with open(filename) as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) == 3:
+                messages.append((fields[0], float(fields[1]), int(fields[2])))
+    messages.sort(key=lambda message: message[1])
+    return messages
+
+
+async def send_counts(port, messages, speedup):
+    """Send the messages to a local server, speedup times faster than they were recorded."""
+    _, writer = await asyncio.open_connection('127.0.0.1', port)
+    start = time.time()
+    first = messages[0][1]
+    for camera_id, timestamp, count in messages:
+        # Counted at the time of the replay, so that their order is kept
+        replay_time = start + (timestamp - first) / speedup
+        delay = replay_time - time.time()
+        if delay > 0:
+            await writer.drain()
+            await asyncio.sleep(delay)
+        writer.write(f"{camera_id} {replay_time:.6f} {count}\n".encode())
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+def replay_counts(filename, speedup=10, traffic_light_policy=TRAFFIC_LIGHT_POLICY, period=CONTROL_PERIOD):
+    """
+    Replay recorded counts to a CounterServer on a local port, speedup times faster than real time, with a
+    LiveIntersection controlling each intersection of the recording, to measure the decision latency and the
+    throughput of the bridge offline.
+
+    Parameters:
+    filename (str): Counts recorded by a CounterServer.
+    speedup (float): Simulated seconds per wall-clock second.
+    traffic_light_policy (str): Name of the controller of the intersections.
+    period (float): Simulated seconds between two steps of the controllers.
+
+    Returns:
+    dict: The number of 'messages' received by the server, the 'seconds' the replay took, the 'messages_per_second',
+          the 'steps_per_second' of the controllers, and the results of each intersection in 'intersections'.
+    """
+    messages = load_counts(filename)
+    server = CounterServer('127.0.0.1', 0)
+    server.start()
+    names = sorted({approach[0] for approach in map(server.approach_of, {message[0] for message in messages})
+                    if approach is not None})
+    intersections = [LiveIntersection(server, name, traffic_light_policy, speedup) for name in names]
+    stop = threading.Event()
+    control = threading.Thread(target=run_live, args=(intersections, stop, period, speedup), daemon=True)
+
+    start = time.perf_counter()
+    control.start()
+    asyncio.run(send_counts(server.port, messages, speedup))
+    while server.messages < len(messages) and server.connections > 0:
+        time.sleep(0.001)
+    # Let the controllers use the last counts
+    time.sleep(2 * period / speedup)
+    stop.set()
+    control.join()
+    seconds = time.perf_counter() - start
+    server.stop()
+    steps = sum(intersection.steps for intersection in intersections)
+    return {'messages': server.messages, 'seconds': seconds, 'messages_per_second': server.messages / seconds,
+            'steps_per_second': steps / seconds,
+            'intersections': {intersection.intersection: intersection.results() for intersection in intersections}}
+
+
+def print_phase(intersection):
+    print(f"{intersection.intersection}: signal {intersection.currentGreen} green at {intersection.sim_time:.1f} s "
+          f"(queues {intersection.queue_state.queues.tolist()})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Control intersections with the counts of their cameras.")
+    parser.add_argument('--intersection', action='append', default=[],
+                        help="name of an intersection to control, in the camera ids (repeatable)")
+    parser.add_argument('--port', type=int, default=PORT, help="port of the counter server")
+    parser.add_argument('--policy', default=TRAFFIC_LIGHT_POLICY, help="controller of the signals")
+    parser.add_argument('--record', help="file to record the received counts to")
+    parser.add_argument('--replay', help="file of recorded counts to replay, instead of listening to the cameras")
+    parser.add_argument('--speedup', type=float, default=10, help="speed of the replay")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        results = replay_counts(args.replay, args.speedup, args.policy)
+        print(f"{results['messages']} messages in {results['seconds']:.2f} seconds: "
+              f"{results['messages_per_second']:.0f} messages and {results['steps_per_second']:.0f} steps per second")
+        for name, result in results['intersections'].items():
+            latency = result['decision_latency']
+            print(f"{name}: {result['phases']} phases, decision latency {1000 * latency['mean']:.2f} ms "
+                  f"(p99 {1000 * latency['p99']:.2f} ms, max {1000 * latency['max']:.2f} ms)")
+    else:
+        server = CounterServer(port=args.port, record=args.record)
+        server.start()
+        print(f'Server is now running on port {server.port}...')
+        intersections = [LiveIntersection(server, name, args.policy) for name in args.intersection]
+        try:
+            run_live(intersections, threading.Event(), callback=print_phase)
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,156 @@
+from collections import deque
+
+import numpy as np
+
+NEAR_MISS_DISTANCE = 20  # Gap between two vehicles of crossing flows under which they count as a near-miss
+MAX_EVENTS = 1000  # Number of the most recent events kept by a detector
+CELL_KEY_BASE = 1 << 20  # Range of the cell coordinates packed in a cell key
+NEIGHBOUR_OFFSETS = np.array([dx * CELL_KEY_BASE + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])  # Between cell keys
+
+
+class ConflictDetector:
+    """
+    Class to detect the conflicts between vehicles of crossing flows inside the junction boxes: two vehicles whose
+    boxes overlap are a conflict, two vehicles closer than near_miss_distance without overlapping are a near-miss.
+
+    Vehicles of the same lane are already kept apart by the car-following model, so only the vehicles moving along x
+    are compared with those moving along y. The vehicles inside the junction box are bucketed in a uniform grid whose
+    cells are larger than a vehicle plus the near-miss distance, so each of them is only compared with those of the
+    3x3 cells around it, and the cost of a tick stays near-linear in the number of vehicles. The buckets are only
+    built again when a vehicle changed cell or entered or left a junction box. When no vehicles are close, the check
+    is skipped on the next ticks, until a vehicle entered or left a junction box or moved by half the smallest gap
+    beyond the near-miss distance, or enough to change cell.
+    """
+
+    def __init__(self, lane_axes, max_length, near_miss_distance=NEAR_MISS_DISTANCE, max_events=MAX_EVENTS):
+        """
+        Initialize the detector.
+
+        Parameters:
+        lane_axes (np.ndarray): For each direction number, 0 when its lanes run along x, 1 along y.
+        max_length (float): Length of the longest vehicle.
+        near_miss_distance (float): Gap under which two vehicles count as a near-miss.
+        max_events (int): Number of the most recent events kept in events, the older ones being only counted.
+        """
+        self.lane_axes = lane_axes
+        self.near_miss_distance = near_miss_distance
+        self.cell_size = max_length + near_miss_distance
+        self.conflicts = 0  # Number of pairs of vehicles that overlapped
+        self.near_misses = 0  # Number of pairs of vehicles that came close without overlapping
+        # (time, vehicle id, vehicle id, 'conflict' or 'near_miss') of the most recent conflicts and near-misses
+        self.events = deque(maxlen=max_events)
+        self._active = {}  # Worst event so far of the pairs of vehicle ids close to each other on the last tick
+        self._buckets = None  # (vehicle ids, cell keys, candidate pairs) of the vehicles in the junction on the last check
+        # (vehicle ids, positions, distance) of the vehicles in the junction on the last check, when none of them can
+        # be close to another one before moving by that distance
+        self._quiet = None
+
+    def cell_keys(self, left, top, groups):
+        """Return the key of the grid cell of the top-left corner of each box, unique across intersections."""
+        cell_x = np.floor(left / self.cell_size).astype(np.int64)
+        cell_y = np.floor(top / self.cell_size).astype(np.int64)
+        return (groups.astype(np.int64) * CELL_KEY_BASE + cell_x) * CELL_KEY_BASE + cell_y
+
+    def candidate_pairs(self, keys_a, keys_b):
+        """
+        Return the pairs of boxes of two sets whose cells are neighbours, i.e. the only ones close enough to each
+        other to be in conflict or near-miss.
+
+        Parameters:
+        keys_a, keys_b (np.ndarray): Cell keys of the boxes of each set (see cell_keys).
+
+        Returns:
+        np.ndarray: Indices of the boxes of the pairs in the first set.
+        np.ndarray: Indices of the boxes of the pairs in the second set.
+        """
+        order = np.argsort(keys_b, kind='stable')
+        sorted_keys = keys_b[order]
+        # Keys of the 3x3 cells around each box of the first set, searched all at once in the sorted second set
+        neighbours = (keys_a[:, None] + NEIGHBOUR_OFFSETS).ravel()
+        low = np.searchsorted(sorted_keys, neighbours, side='left')
+        counts = np.searchsorted(sorted_keys, neighbours, side='right') - low
+        total = counts.sum()
+        # Each neighbour cell k gives counts[k] pairs, with the boxes from low[k] on in the second set
+        indices_a = np.repeat(np.arange(len(neighbours)) // len(NEIGHBOUR_OFFSETS), counts)
+        starts = np.repeat(low - np.cumsum(counts) + counts, counts)
+        return indices_a, order[starts + np.arange(total)]
+
+    def update(self, vehicles, sim_time):
+        """
+        Record the new conflicts and near-misses between the vehicles of a store.
+
+        Parameters:
+        vehicles (VehicleStore): The vehicles (see VehicleStore.in_junction and VehicleStore.boxes).
+        sim_time (float): Current simulated time, recorded with the events.
+        """
+        rows = vehicles.in_junction()
+        vehicle_ids = vehicles.vehicle_id[rows]
+        position = vehicles.position[rows]
+        quiet = self._quiet
+        if (quiet is not None and np.array_equal(vehicle_ids, quiet[0])
+                and np.abs(position - quiet[1]).max(initial=0) < quiet[2]):
+            # No vehicle moved enough since the last check to change cell or come close to a vehicle
+            return
+        self._quiet = None
+        along_x = self.lane_axes[vehicles.direction[rows]] == 0
+        horizontal = np.flatnonzero(along_x)
+        vertical = np.flatnonzero(~along_x)
+        if len(horizontal) == 0 or len(vertical) == 0:
+            # Only a vehicle entering or leaving a junction box can change that
+            self._active = {}
+            self._quiet = (vehicle_ids, position, np.inf)
+            return
+        left, top, right, bottom = vehicles.boxes(rows)
+        keys = self.cell_keys(left, top, vehicles.lane[rows] // len(self.lane_axes))
+        buckets = self._buckets
+        if buckets is not None and np.array_equal(vehicle_ids, buckets[0]) and np.array_equal(keys, buckets[1]):
+            # No vehicle changed cell: same pairs as on the last check
+            first, second = buckets[2]
+        else:
+            first, second = self.candidate_pairs(keys[horizontal], keys[vertical])
+            first, second = horizontal[first], vertical[second]
+            self._buckets = (vehicle_ids, keys, (first, second))
+        # Distance a vehicle can move along its lane without changing cell
+        corner = np.where(along_x, left, top) / self.cell_size
+        fraction = corner - np.floor(corner)
+        allowance = np.minimum(fraction, 1 - fraction).min() * self.cell_size
+        if len(first) == 0:
+            # No cell near vehicles of both crossing flows
+            self._active = {}
+            self._quiet = (vehicle_ids, position, allowance)
+            return
+
+        # Largest gap between the boxes along x or y, negative when they overlap
+        gap = np.maximum.reduce([left[second] - right[first], left[first] - right[second],
+                                 top[second] - bottom[first], top[first] - bottom[second]])
+        close = gap < self.near_miss_distance
+        if not close.any():
+            # No vehicles of crossing flows close to each other, as on most ticks: none can be until two of them
+            # moved towards each other by the smallest margin
+            self._active = {}
+            self._quiet = (vehicle_ids, position, min(allowance, (gap.min() - self.near_miss_distance) / 2))
+            return
+
+        active = {}
+        for i, j, pair_gap in zip(first[close].tolist(), second[close].tolist(), gap[close].tolist()):
+            pair = (min(vehicle_ids[i], vehicle_ids[j]), max(vehicle_ids[i], vehicle_ids[j]))
+            pair = (int(pair[0]), int(pair[1]))
+            kind = 'conflict' if pair_gap < 0 else 'near_miss'
+            previous = self._active.get(pair)
+            if previous == 'conflict' or previous == kind:
+                kind = previous
+            elif kind == 'conflict':
+                # A near-miss that ends in a conflict only counts as a conflict
+                self.conflicts += 1
+                if previous == 'near_miss':
+                    self.near_misses -= 1
+                self.events.append((sim_time, *pair, kind))
+            elif previous is None:
+                self.near_misses += 1
+                self.events.append((sim_time, *pair, kind))
+            active[pair] = kind
+        self._active = active
+
+    def get_results(self):
+        """Return the number of conflicts and near-misses."""
+        return {'conflicts': self.conflicts, 'near_misses': self.near_misses}
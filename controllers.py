@@ -0,0 +1,172 @@
+import ast
+
+import numpy as np
+
+from simulation import MIN_GREEN_TIME, noOfSignals
+
+
+class QueueState:
+    """
+    Class to represent the state of the queues of an intersection, as seen by its controller. The intersection
+    updates it incrementally as vehicles arrive and cross, so reading it never recounts the vehicles.
+    """
+
+    def __init__(self):
+        """Initialize the state of an empty intersection."""
+        self.queues = np.zeros(noOfSignals, dtype=np.int64)  # Vehicles in front of the stop line of each signal
+        self.current_green = 0  # Signal that is green, or was green last during the all-red time
+        self.green_time = 0  # Time the current signal has been green, in simulated seconds
+        self.sim_time = 0
+        self.downstream = [None] * noOfSignals  # QueueState of the next intersection in each direction, if any
+
+    def downstream_queues(self):
+        """Return the queue of the next intersection that each signal sends its vehicles to (0 if none)."""
+        return np.array([0 if state is None else state.queues[direction]
+                         for direction, state in enumerate(self.downstream)])
+
+
+class Controller:
+    """
+    Base class of the signal controllers. The signal cycle (green, yellow, all red, next green) is run by the
+    intersection, which asks its controller for the decisions:
+    - green_time, when a signal turns green: how long it stays green,
+    - extend_green, when its green time ran out: for how much longer it stays green (0 to turn yellow),
+    - next_green, when its yellow time ran out: which signal turns green after the all-red time.
+    The default decisions are those of a fixed-time controller.
+    """
+
+    def __init__(self, green_time=MIN_GREEN_TIME + 1):
+        self.default_green_time = green_time
+
+    def green_time(self, state, signal_number):
+        return self.default_green_time
+
+    def extend_green(self, state):
+        return 0
+
+    def next_green(self, state):
+        return (state.current_green + 1) % noOfSignals
+
+
+class FixedTimeController(Controller):
+    """Controller turning the signals green one after the other for a fixed time ("normal" policy)."""
+
+
+class LongestQueueController(Controller):
+    """
+    Controller turning green the signal with the longest queue, for a time growing with its queue ("optimal"
+    policy).
+    """
+
+    def green_time(self, state, signal_number):
+        return max(self.default_green_time, state.queues[signal_number] / 2)
+
+    def next_green(self, state):
+        return int(np.argmax(state.queues))
+
+
+class MaxPressureController(Controller):
+    """
+    Controller turning green the signal with the highest pressure: its queue minus the queue of the intersection its
+    vehicles go to next. On an isolated intersection, it is the longest queue.
+    """
+
+    def next_green(self, state):
+        return int(np.argmax(state.queues - state.downstream_queues()))
+
+
+class ActuatedController(Controller):
+    """
+    Controller keeping a signal green by steps of extension seconds while vehicles wait in front of it, up to
+    max_green_time, and skipping the signals with no vehicle waiting.
+    """
+
+    def __init__(self, green_time=MIN_GREEN_TIME, extension=2, max_green_time=30):
+        super().__init__(green_time)
+        self.extension = extension
+        self.max_green_time = max_green_time
+
+    def extend_green(self, state):
+        if state.queues[state.current_green] > 0 and state.green_time < self.max_green_time:
+            return min(self.extension, self.max_green_time - state.green_time)
+        return 0
+
+    def next_green(self, state):
+        for offset in range(1, noOfSignals + 1):
+            signal_number = (state.current_green + offset) % noOfSignals
+            if state.queues[signal_number] > 0:
+                return signal_number
+        return (state.current_green + 1) % noOfSignals
+
+
+class ModelController(LongestQueueController):
+    """
+    Controller of a model of the 'modele ML' folder (see load_model): the signal with the longest queue turns green
+    for min_green_time seconds when its queue is at most traffic_thresholds['low'] vehicles, max_green_time when it
+    is at least traffic_thresholds['high'], and in proportion in between.
+    """
+
+    def __init__(self, model):
+        super().__init__(model['min_green_time'])
+        self.max_green_time = model['max_green_time']
+        self.low = model['traffic_thresholds']['low']
+        self.high = model['traffic_thresholds']['high']
+
+    def green_time(self, state, signal_number):
+        queue = state.queues[signal_number]
+        if queue <= self.low:
+            return self.default_green_time
+        if queue >= self.high:
+            return self.max_green_time
+        return self.default_green_time + (queue - self.low) / (self.high - self.low) * (
+            self.max_green_time - self.default_green_time)
+
+
+def load_model(filename):
+    """
+    Load a model of the 'modele ML' folder: a Python dict literal with 'min_green_time', 'max_green_time',
+    'traffic_thresholds', 'learning_rate' and 'reward_parameters'. The file is parsed as a literal, never executed.
+
+    Returns:
+    dict: The model.
+    """
+    with open(filename, 'r') as file:
+        model = ast.literal_eval(file.read())
+    if not isinstance(model, dict):
+        raise ValueError(f"{filename} does not hold a model")
+    return model
+
+
+# Controllers by name of traffic light policy, register_controller adds new ones
+controllers = {
+    'normal': FixedTimeController,
+    'random': FixedTimeController,
+    'fixed': FixedTimeController,
+    'optimal': LongestQueueController,
+    'longest_queue': LongestQueueController,
+    'max_pressure': MaxPressureController,
+    'actuated': ActuatedController,
+}
+
+
+def register_controller(name, controller_class):
+    """Make a controller class available as the traffic light policy name."""
+    controllers[name] = controller_class
+
+
+def make_controller(traffic_light_policy):
+    """
+    Return the controller of a traffic light policy.
+
+    Parameters:
+    traffic_light_policy (str or Controller): Name of a registered controller, or a controller.
+
+    Returns:
+    Controller: A new controller of that name, or the given controller.
+    """
+    if isinstance(traffic_light_policy, Controller):
+        return traffic_light_policy
+    if traffic_light_policy not in controllers:
+        raise ValueError(f"Unknown traffic light policy: {traffic_light_policy} (expected one of "
+                         f"{', '.join(controllers)})")
+    return controllers[traffic_light_policy]()
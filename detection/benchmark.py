@@ -0,0 +1,273 @@
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import detect
+from detect import (DETECTION_INTERVAL, HEIGHT, VIDEO_SOURCE, WIDTH, CounterSender, availableTrackers, carCounters,
+                    detectCars, inROI, loadStreams, openVideo, roiMask, roiRegion, select_ROI)
+
+SYNTHETIC_SIZE = (1920, 1080)  # Size of the frames of the synthetic clip, as a camera would send them
+SYNTHETIC_FRAMES = 150
+SYNTHETIC_CARS = 6
+# ROI of the synthetic clip, in the frames resized to WIDTH x HEIGHT
+SYNTHETIC_ROI = np.array([[200, 150], [1080, 150], [1080, 600], [200, 600]], np.int32)
+STAGES = ['decode', 'resize', 'blob', 'forward', 'decoding', 'tracking', 'roi', 'send']
+PERCENTILES = [50, 95, 99]
+
+
+def benchmarkTrackers(source, SELECTION_POINTS, trackers=tuple(availableTrackers),
+                      detection_interval=DETECTION_INTERVAL, detect=detectCars):
+    """
+    Compares the speed and the counts of the trackers on the same clip. The cars are detected once every
+    detection_interval frames and the same detections are given to every tracker, so only the tracking differs.
+
+    The reference count of a detection frame is the number of cars detected within the ROI, and the error of a
+    tracker is the mean absolute difference between its count and the reference on the detection frames.
+
+    Parameters:
+    source (str or int): The clip (see openVideo).
+    SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+    trackers (tuple): Names of the trackers to compare (see carCounters), those that can be used by default.
+    detection_interval (int): Frames between two detections.
+    detect (callable): Detection of the cars of an image, detectCars by default.
+
+    Returns:
+    dict: For each tracker, its tracking time per frame in 'ms_per_frame', its final 'count' and its count 'error'.
+    """
+    counters = {name: carCounters[name](SELECTION_POINTS) for name in trackers}
+    mask = roiMask(SELECTION_POINTS)
+    seconds = dict.fromkeys(trackers, 0.0)
+    errors = dict.fromkeys(trackers, 0)
+    detectionFrames = 0
+    frameCounter = 0
+    video = openVideo(source)
+    while True:
+        rc, image = video.read()
+        if not rc:
+            break
+        image = cv2.resize(image, (WIDTH, HEIGHT))
+        frameCounter += 1
+        cars = detect(image) if frameCounter % detection_interval == 0 else None
+        for name, counter in counters.items():
+            start = time.perf_counter()
+            counter.updateTrackers(image)
+            if cars is not None:
+                counter.addDetections(image, cars)
+            counter.count()
+            seconds[name] += time.perf_counter() - start
+        if cars is not None:
+            detectionFrames += 1
+            cars = np.array(cars, dtype=int).reshape(-1, 4)
+            reference = int(inROI(mask, cars[:, :2] + cars[:, 2:] // 2).sum())
+            for name, counter in counters.items():
+                errors[name] += abs(counter.carCounter - reference)
+    video.release()
+    return {name: {'ms_per_frame': 1000 * seconds[name] / max(frameCounter, 1),
+                   'count': counters[name].carCounter,
+                   'error': errors[name] / detectionFrames if detectionFrames else np.nan}
+            for name in trackers}
+
+
+def writeSyntheticClip(filename, num_frames=SYNTHETIC_FRAMES, size=SYNTHETIC_SIZE, num_cars=SYNTHETIC_CARS, seed=0):
+    """
+    Writes a clip of rectangles ("cars") of random sizes and colors driving across a noisy road, in lanes, at
+    constant speeds, to measure the detection without a camera.
+
+    Parameters:
+    filename (str): The clip, an MJPG .avi file.
+    num_frames (int): Number of frames.
+    size (tuple): Width and height of the frames.
+    num_cars (int): Number of cars in a frame.
+    seed (int): Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    background = rng.integers(40, 70, (height, width, 3), dtype=np.uint8)
+    lanes = np.linspace(0.15 * height, 0.8 * height, num_cars).astype(int)
+    carWidths = rng.integers(width // 16, width // 9, num_cars)
+    carHeights = rng.integers(height // 14, height // 9, num_cars)
+    speeds = rng.choice([-1, 1], num_cars) * rng.uniform(width / 600, width / 200, num_cars)
+    starts = rng.uniform(0, width, num_cars)
+    colors = rng.integers(120, 255, (num_cars, 3))
+    video = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'MJPG'), 30, size)
+    for frameNumber in range(num_frames):
+        image = background.copy()
+        positions = (starts + speeds * frameNumber) % (width + carWidths) - carWidths
+        for x, y, w, h, color in zip(positions.astype(int), lanes, carWidths, carHeights, colors.tolist()):
+            cv2.rectangle(image, (int(x), int(y)), (int(x + w), int(y + h)), color, -1)
+        video.write(image)
+    video.release()
+
+
+class StubNetwork:
+    """
+    Stand-in for the YOLOv4 network, to measure the rest of the detection without the weights: it "detects" the
+    bright rectangles of the input images as cars, in the output format of yolov4-tiny (rows of center x, center y,
+    width, height, objectness and class scores, relative to the image size, for 507 and 2028 anchors).
+    """
+
+    outputRows = (507, 2028)
+
+    def setInput(self, blob):
+        self.blob = blob
+
+    def forward(self, names):
+        images = len(self.blob)
+        outputs = [np.zeros((images * rows, 85), np.float32) for rows in self.outputRows]
+        size = self.blob.shape[3], self.blob.shape[2]
+        for i, image in enumerate(self.blob):
+            bright = (image.max(axis=0) > 110 / 255).astype(np.uint8)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(bright)
+            stats = stats[1:][stats[1:, 4] > 100][:self.outputRows[0]]
+            rows = outputs[0][i * self.outputRows[0]:i * self.outputRows[0] + len(stats)]
+            rows[:, 0] = (stats[:, 0] + stats[:, 2] / 2) / size[0]
+            rows[:, 1] = (stats[:, 1] + stats[:, 3] / 2) / size[1]
+            rows[:, 2] = stats[:, 2] / size[0]
+            rows[:, 3] = stats[:, 3] / size[1]
+            rows[:, 4] = 0.9
+            rows[:, 5 + 2] = 0.9  # Class 2, a car
+        return outputs
+
+
+def useStubNetwork():
+    """Makes detect.py use a StubNetwork instead of loading YOLOv4."""
+    detect.net = StubNetwork()
+    detect.output_layers_names = ['yolo_30', 'yolo_37']
+
+
+class StageTimes:
+    """Seconds taken by a stage each time it ran, to compute its percentiles."""
+
+    def __init__(self):
+        self.seconds = []
+
+    def add(self, seconds):
+        self.seconds.append(seconds)
+
+    def summary(self):
+        seconds = np.array(self.seconds) * 1000
+        if len(seconds) == 0:
+            return {'count': 0}
+        summary = {'count': len(seconds), 'mean_ms': float(seconds.mean()), 'per_second': 1000 / seconds.mean()}
+        for percentile in PERCENTILES:
+            summary[f'p{percentile}_ms'] = float(np.percentile(seconds, percentile))
+        return summary
+
+
+def countingSink():
+    """Starts a local server reading and dropping the counts, to send them to. Returns its address."""
+    listener = socket.create_server(('127.0.0.1', 0))
+
+    def drain(connection):
+        while connection.recv(4096):
+            pass
+
+    def accept():
+        while True:
+            connection, _ = listener.accept()
+            threading.Thread(target=drain, args=(connection,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()
+
+
+def benchmarkPipeline(source, SELECTION_POINTS, detection_interval=1, tracker='kalman', max_frames=None):
+    """
+    Measures each stage of the detection of a clip separately, one after the other on each frame: decoding and
+    resizing the frame, creating the blob, the forward pass and decoding the outputs of YOLO (on the region of the
+    ROI, every detection_interval frames), updating the trackers with the frame and the detections, testing the
+    tracked cars against the ROI to count them, and sending the counter.
+
+    Parameters:
+    source (str or int): The clip (see openVideo).
+    SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+    detection_interval (int): Frames between two detections.
+    tracker (str): Tracking of the cars between detections, 'dlib' or 'kalman'.
+    max_frames (int): Maximum number of frames to measure, the whole clip by default.
+
+    Returns:
+    dict: The number of 'frames', the 'frames_per_second' of the whole detection, its final 'count', and the
+          summary of each stage in 'stages' (number of runs, mean and percentiles in milliseconds, and runs per
+          second).
+    """
+    times = {stage: StageTimes() for stage in STAGES}
+    counter = carCounters[tracker](SELECTION_POINTS)
+    region = roiRegion(SELECTION_POINTS)
+    sender = CounterSender(countingSink(), 'benchmark')
+    video = openVideo(source)
+    frameCounter = 0
+    start = time.perf_counter()
+    while max_frames is None or frameCounter < max_frames:
+        stageStart = time.perf_counter()
+        rc, image = video.read()
+        if not rc:
+            break
+        times['decode'].add(time.perf_counter() - stageStart)
+        stageStart = time.perf_counter()
+        image = cv2.resize(image, (WIDTH, HEIGHT))
+        times['resize'].add(time.perf_counter() - stageStart)
+
+        cars = detectCars(image, region, times) if frameCounter % detection_interval == 0 else None
+        stageStart = time.perf_counter()
+        counter.updateTrackers(image)
+        if cars is not None:
+            counter.addDetections(image, cars)
+        times['tracking'].add(time.perf_counter() - stageStart)
+        stageStart = time.perf_counter()
+        counter.count()
+        times['roi'].add(time.perf_counter() - stageStart)
+        stageStart = time.perf_counter()
+        sender.send(counter.carCounter)
+        times['send'].add(time.perf_counter() - stageStart)
+        frameCounter += 1
+    seconds = time.perf_counter() - start
+    video.release()
+    sender.close()
+    return {'frames': frameCounter, 'frames_per_second': frameCounter / seconds, 'count': counter.carCounter,
+            'stages': {stage: stageTimes.summary() for stage, stageTimes in times.items()}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the trackers of detect.py on a clip, or measure each stage "
+                                                 "of the detection with --pipeline.")
+    parser.add_argument('--source', default=VIDEO_SOURCE, help="video file, stream URL or webcam number")
+    parser.add_argument('--config', help="JSON file of streams (see detect.loadStreams), to use the ROI of the first")
+    parser.add_argument('--pipeline', action='store_true', help="measure each stage of the detection")
+    parser.add_argument('--synthetic', action='store_true', help="use a synthetic clip of moving rectangles")
+    parser.add_argument('--stub', action='store_true', help="use a stub network instead of the YOLOv4 weights")
+    parser.add_argument('--interval', type=int, default=1, help="frames between two detections, with --pipeline")
+    parser.add_argument('--tracker', default='kalman', choices=availableTrackers,
+                        help="tracking of the cars, with --pipeline")
+    args = parser.parse_args()
+
+    if args.stub:
+        useStubNetwork()
+    if args.synthetic:
+        source = os.path.join(tempfile.mkdtemp(), 'synthetic.avi')
+        writeSyntheticClip(source)
+        SELECTION_POINTS = SYNTHETIC_ROI
+    elif args.config is None:
+        source, SELECTION_POINTS = args.source, select_ROI(openVideo(args.source))
+    else:
+        stream = loadStreams(args.config)[0]
+        source, SELECTION_POINTS = stream['source'], stream['roi']
+
+    if args.pipeline:
+        results = benchmarkPipeline(source, SELECTION_POINTS, args.interval, args.tracker)
+        print(f"{results['frames']} frames at {results['frames_per_second']:.1f} frames per second, "
+              f"count {results['count']}")
+        for stage, summary in results['stages'].items():
+            if summary['count']:
+                print(f"{stage}: {summary['mean_ms']:.2f} ms (" + ", ".join(
+                    f"p{percentile} {summary[f'p{percentile}_ms']:.2f} ms" for percentile in PERCENTILES)
+                      + f"), {summary['per_second']:.0f} per second")
+    else:
+        for name, result in benchmarkTrackers(source, SELECTION_POINTS).items():
+            print(f"{name}: {result['ms_per_frame']:.2f} ms per frame, count {result['count']}, "
+                  f"error {result['error']:.2f} cars")
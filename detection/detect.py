@@ -1,23 +1,60 @@
+import argparse
 import cv2
-import dlib
+import json
 import numpy as np
+import os
+import queue
 import socket
+import threading
 import time
-from threading import Timer
 
+from tracker import KalmanBoxTracker, boxIoU
 
-# Load YOLOv4 model
-net = cv2.dnn.readNet('yolov4-tiny.weights', 'yolov4-tiny.cfg')
-classes = []  # List to store the class names for detected objects
-with open('classes.txt', 'r') as f:
-    classes = f.read().splitlines()  # Read class names from file and store them in the list 
+try:
+    import dlib
+except ImportError:
+    dlib = None  # Only the 'kalman' tracker can be used
 
-video = cv2.VideoCapture('videos/1.mp4')  # Video feed (change with file name)
 
+# YOLOv4 model, loaded by loadNetwork the first time it is needed
+net = None
+classes = []  # List to store the class names for detected objects
+output_layers_names = None  # Output layers of the model, queried once
 
+VIDEO_SOURCE = 'videos/1.mp4'  # Video feed (change with file name, or 0 for a webcam)
 WIDTH = 1280  # Width of the video frame
 HEIGHT = 720  # Height of the video frame
 SELECTION_POINTS = []  # List to store the selected points for region of interest
+SERVER_ADDRESS = ("10.0.0.9", 5000)  # Change with your own server's Ip address
+CAMERA_ID = "A:right"  # Name of the camera for the server: intersection and direction it counts
+VEHICLE_CLASSES = [0, 1, 2, 3, 5]  # 0 for person, 1 for bicycle, 2 for car, 3 for motorbike, and 5 for bus
+CONFIDENCE_THRESHOLD = 0.5  # Minimum score of a detection
+NMS_THRESHOLD = 0.4  # Maximum overlap (IoU) of two detections of the same class
+DETECTION_INTERVAL = 30  # Frames between two detections of the headless mode (see countStreams)
+# Tracking of the cars between detections: 'dlib' or 'kalman' (see carCounters), 'kalman' if dlib is not installed
+TRACKER = 'kalman' if dlib is None else 'dlib'
+ROI_MARGIN = 0.15  # Margin around the ROI in the region given to YOLO, as a fraction of its size
+MOTION_GATE = True  # Whether to skip the detections when nothing moved within the ROI (see MotionGate)
+MOTION_SCALE = 0.25  # Scale of the images compared by the motion gate
+MOTION_THRESHOLD = 0.002  # Fraction of the ROI that must have changed since the last detection to detect again
+MOTION_TRIGGER = 0.05  # Fraction of the ROI whose change triggers a detection before detection_interval frames
+MIN_DETECTION_INTERVAL = 5  # Minimum frames between two detections of the headless mode
+
+
+def loadNetwork(weights='yolov4-tiny.weights', config='yolov4-tiny.cfg', classes_file='classes.txt'):
+    """
+    Loads the YOLOv4 model and the class names, the first time it is called.
+
+    Returns:
+    cv2.dnn.Net: The model.
+    """
+    global net, classes, output_layers_names
+    if net is None:
+        net = cv2.dnn.readNet(weights, config)
+        with open(classes_file, 'r') as f:
+            classes = f.read().splitlines()  # Read class names from file and store them in the list 
+        output_layers_names = net.getUnconnectedOutLayersNames()
+    return net
 
 
 def mouse_callback(event, x, y, flags, params):
@@ -35,9 +72,12 @@ def mouse_callback(event, x, y, flags, params):
             cv2.imshow('selection', params['selection_image'])
 
 
-def select_ROI():
+def select_ROI(video):
     """
     Selects a Region of Interest (ROI) by allowing the user to click points on the image.
+
+    Parameters:
+    video (cv2.VideoCapture): The video feed, whose first frame is shown.
     
     Returns:
     np.array: The array containing the selected points defining the ROI.
@@ -57,182 +97,848 @@ def select_ROI():
     return np.array(points, np.int32)
 
 
-def sendCounter(counter):
+def putDroppingOldest(items, item):
     """
-    Sends the counter value to a specified IP address and port using a TCP socket connection.
-    
+    Puts an item in a bounded queue without waiting, dropping the oldest items while it is full.
+
+    Parameters:
+    items (queue.Queue): The queue.
+    item: The item.
+
+    Returns:
+    int: The number of items dropped.
+    """
+    dropped = 0
+    while True:
+        try:
+            items.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                items.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class StageLatency:
+    """Latency of a stage of the detection pipeline: number of items, mean and maximum seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def __str__(self):
+        mean = self.total / self.count if self.count else 0
+        return f"{mean * 1000:.1f} ms (max {self.max * 1000:.1f} ms, {self.count} items)"
+
+
+class CounterSender:
+    """
+    Class to send the counter to the server from a background thread, over one persistent TCP connection that is
+    opened again when it breaks. Only the changes of the counter are sent, as "camera_id timestamp count" lines.
+
+    send never blocks: the changes wait in a bounded queue, the oldest one being dropped when it is full, and only the
+    newest of the waiting changes is sent (the server only keeps the last count), so a slow or unreachable server
+    never slows the detection down. close never blocks for long either, even if the server can't be reached.
+    """
+
+    def __init__(self, address=SERVER_ADDRESS, camera_id=CAMERA_ID, max_pending=64, reconnect_delay=1):
+        """
+        Start the sender thread.
+
+        Parameters:
+        address (tuple): The server (host, port).
+        camera_id (str): Name of the camera.
+        max_pending (int): Number of changes kept while they can't be sent.
+        reconnect_delay (float): Seconds to wait before connecting again after a failure, doubled after each
+                                 failure up to 30 seconds.
+        """
+        self.address = address
+        self.camera_id = camera_id
+        self.reconnect_delay = reconnect_delay
+        self.pending = queue.Queue(max_pending)
+        self.stopping = threading.Event()  # Set by close, to give up connecting
+        self.last_counter = None
+        self.connection = None
+        self.dropped = 0  # Number of changes dropped because the queue was full, or because a newer one was sent
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, counter):
+        """
+        Queue the counter to be sent, if it changed since the last call.
+
+        Parameters:
+        counter (int): The counter value to be sent.
+        """
+        if counter == self.last_counter:
+            return
+        self.last_counter = counter
+        self.dropped += putDroppingOldest(self.pending, f"{self.camera_id} {time.time():.3f} {counter}\n")
+
+    def connect(self):
+        """
+        Connects to the server, waiting longer after each failure.
+
+        Returns:
+        bool: True once connected, False if the sender was closed in the meantime.
+        """
+        delay = self.reconnect_delay
+        while True:
+            try:
+                self.connection = socket.create_connection(self.address, timeout=5)
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return True
+            except OSError:
+                if self.stopping.wait(delay):
+                    return False
+                delay = min(2 * delay, 30)
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            message = self.pending.get()
+            if message is None:
+                break
+            # Only the newest of the changes queued in the meantime is sent
+            while not self.pending.empty():
+                newer = self.pending.get_nowait()
+                if newer is None:
+                    stopped = True
+                    break
+                message = newer
+                self.dropped += 1
+            while True:
+                if self.connection is None and not self.connect():
+                    stopped = True
+                    break
+                try:
+                    self.connection.sendall(message.encode("utf-8"))
+                    break
+                except OSError:
+                    self.connection.close()
+                    self.connection = None
+        if self.connection is not None:
+            self.connection.close()
+
+    def close(self):
+        """Send the last change, unless the server can't be reached, and stop the sender thread."""
+        self.stopping.set()
+        putDroppingOldest(self.pending, None)
+        self.thread.join(5)
+
+
+def decodeDetections(layerOutputs, width=WIDTH, height=HEIGHT):
+    """
+    Decodes the outputs of the YOLOv4 model into the boxes of the detected vehicles, all the detections at once,
+    and removes the overlapping boxes of the same vehicle with a non-maximum suppression by class.
+
+    Parameters:
+    layerOutputs (list): The outputs of the model, arrays of rows (center x, center y, width, height, objectness,
+                         class scores...) relative to the image size.
+    width, height (int): Size of the image.
+
+    Returns:
+    list: A list of bounding boxes containing the coordinates (x, y, width, height) of the detected cars.
+    """
+    detections = np.concatenate([output.reshape(-1, output.shape[-1]) for output in layerOutputs])
+    scores = detections[:, 5:]
+    class_ids = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(scores)), class_ids]
+    keep = (confidences > CONFIDENCE_THRESHOLD) & np.isin(class_ids, VEHICLE_CLASSES)
+    detections, confidences, class_ids = detections[keep], confidences[keep], class_ids[keep]
+    if len(detections) == 0:
+        return []
+
+    center_x = (detections[:, 0] * width).astype(int)
+    center_y = (detections[:, 1] * height).astype(int)
+    w = (detections[:, 2] * width).astype(int)
+    h = (detections[:, 3] * height).astype(int)
+    boxes = np.stack([(center_x - w / 2).astype(int), (center_y - h / 2).astype(int), w, h], axis=1)
+    # Shift the boxes of each class apart, by more than the extent of all the boxes (which can start left of or above
+    # the image), so that a single suppression never mixes two classes
+    shifted = boxes.copy()
+    shifted[:, :2] += class_ids[:, None] * ((boxes[:, :2] + boxes[:, 2:]).max() - boxes[:, :2].min() + 1)
+    kept = cv2.dnn.NMSBoxes(shifted.tolist(), confidences.tolist(), CONFIDENCE_THRESHOLD, NMS_THRESHOLD)
+    return boxes[np.asarray(kept, dtype=int).reshape(-1)].tolist()
+
+
+def roiRegion(SELECTION_POINTS, margin=ROI_MARGIN, width=WIDTH, height=HEIGHT):
+    """
+    Computes the region of the frame given to YOLO for a ROI: its bounding box, with a margin so that the cars
+    whose center is within the ROI are seen whole.
+
     Parameters:
-    counter (int): The counter value to be sent.
+    SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+    margin (float): Margin on each side, as a fraction of the size of the bounding box.
+    width, height (int): Size of the frame.
+
+    Returns:
+    tuple: The region (x, y, width, height), within the frame.
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect(("10.0.0.9", 5000))  # Change with your own server's Ip address
-    message = str(counter)
-    s.send(bytes(message, "utf-8"))
-    time.sleep(1)
-    s.close()
+    x, y, w, h = cv2.boundingRect(np.asarray(SELECTION_POINTS, np.int32))
+    left, top = max(0, int(x - margin * w)), max(0, int(y - margin * h))
+    right, bottom = min(width, int(x + w + margin * w)), min(height, int(y + h + margin * h))
+    return left, top, max(1, right - left), max(1, bottom - top)
+
+
+def detectCarsBatch(images, regions=None, latencies=None):
+    """
+    Detects cars (and other vehicles) in several images at once, in one pass of the YOLOv4 model.
+
+    Parameters:
+    images (list): The input images.
+    regions (list): Region (x, y, width, height) of each image to detect cars in (see roiRegion), the whole
+                    images by default. A smaller region is faster to process than the whole image at the same
+                    resolution, and gives YOLO a closer view of the cars.
+    latencies (dict): If given, the seconds taken by the 'blob' creation, the 'forward' pass and the output
+                      'decoding' are added to its items (e.g. StageLatency).
+
+    Returns:
+    list: For each image, the bounding boxes (x, y, width, height) of the detected cars, in the whole image.
+    """
+    loadNetwork()
+    if regions is None:
+        regions = [(0, 0, image.shape[1], image.shape[0]) for image in images]
+    start = time.perf_counter()
+    crops = [image[y:y + h, x:x + w] for image, (x, y, w, h) in zip(images, regions)]
+    blob = cv2.dnn.blobFromImages(crops, 1/255, (416, 416), (0, 0, 0), swapRB=True, crop=False)
+    blobTime = time.perf_counter()
+    net.setInput(blob)
+    layerOutputs = net.forward(output_layers_names)
+    forwardTime = time.perf_counter()
+    # The outputs hold the detections of each image one after the other
+    layerOutputs = [output.reshape(len(images), -1, output.shape[-1]) for output in layerOutputs]
+    cars = []
+    for i, (x, y, w, h) in enumerate(regions):
+        boxes = decodeDetections([output[i] for output in layerOutputs], w, h)
+        cars.append([[box_x + x, box_y + y, box_w, box_h] for box_x, box_y, box_w, box_h in boxes])
+    if latencies is not None:
+        latencies['blob'].add(blobTime - start)
+        latencies['forward'].add(forwardTime - blobTime)
+        latencies['decoding'].add(time.perf_counter() - forwardTime)
+    return cars
 
 
-def detectCars(img):
+def detectCars(img, region=None, latencies=None):
     """
     Detects cars (and other vehicles) in the input image using the YOLOv4 model. 
      
     Parameters:
     img (numpy.ndarray): The input image.
+    region (tuple): Region (x, y, width, height) of the image to detect cars in, the whole image by default.
+    latencies (dict): If given, the seconds taken by each step are added to its items (see detectCarsBatch).
     
     Returns:
     list: A list of bounding boxes containing the coordinates (x, y, width, height) of the detected cars.
     """
-    blob = cv2.dnn.blobFromImage(img, 1/255, (416, 416), (0, 0, 0), swapRB=True, crop=False)
-    net.setInput(blob)
-    output_layers_names = net.getUnconnectedOutLayersNames()
-    layerOutputs = net.forward(output_layers_names)
-    boxes = []
-    for output in layerOutputs:
-        for detection in output:
-            scores = detection[5:]
-            class_id = np.argmax(scores)
-            confidence = scores[class_id]
-            # 0 for person, 1 for bicycle, 2 for car, 3 for motorbike, and 5 for bus
-            if confidence > 0.5 and class_id in [0, 1, 2, 3, 5]:
-                center_x = int(detection[0] * WIDTH)
-                center_y = int(detection[1] * HEIGHT)
-                w = int(detection[2] * WIDTH)
-                h = int(detection[3] * HEIGHT)
-                x = int(center_x - w / 2)
-                y = int(center_y - h / 2)
-                boxes.append([x, y, w, h])
-    return boxes
-
-
-def calculateCenter(carTracker, car):
-    """
-    Calculate the center coordinates of a tracked car's bounding box.
+    return detectCarsBatch([img], None if region is None else [region], latencies)[0]
+
+
+class MotionGate:
+    """
+    Class to decide on which frames of a video to detect the cars, from the motion within its ROI: the frame is
+    compared with the last frame the cars were detected in, at a small scale. Nothing needs to be detected while
+    nothing moved, as the tracked cars stay where they are, and a large motion is detected without waiting.
+
+    A detection is done after interval frames if at least MOTION_THRESHOLD of the ROI changed, or after
+    min_interval frames if at least MOTION_TRIGGER of it changed.
+    """
+
+    def __init__(self, SELECTION_POINTS, interval=DETECTION_INTERVAL, min_interval=MIN_DETECTION_INTERVAL,
+                 gated=MOTION_GATE):
+        """
+        Parameters:
+        SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+        interval (int): Frames between two detections while the ROI changes.
+        min_interval (int): Minimum frames between two detections.
+        gated (bool): Whether to use the motion, or detect every interval frames.
+        """
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.gated = gated
+        self.region = roiRegion(SELECTION_POINTS, 0)
+        x, y, w, h = self.region
+        self.size = (max(1, int(w * MOTION_SCALE)), max(1, int(h * MOTION_SCALE)))
+        self.mask = np.zeros(self.size[::-1], np.uint8)
+        points = (np.asarray(SELECTION_POINTS, np.float64) - (x, y)) * MOTION_SCALE
+        cv2.fillPoly(self.mask, [points.astype(np.int32)], 1)
+        self.maskArea = max(1, int(self.mask.sum()))
+        self.reference = None  # Small grayscale ROI of the last frame the cars were detected in
+        self.framesSinceDetection = interval  # So that the cars of the first frame are detected
+
+    def small(self, image):
+        x, y, w, h = self.region
+        gray = cv2.cvtColor(image[y:y + h, x:x + w], cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+
+    def motion(self, image):
+        """Returns the fraction of the ROI that changed since the last detection."""
+        changed = cv2.absdiff(self.small(image), self.reference) > 25
+        return int(np.count_nonzero(changed & (self.mask > 0))) / self.maskArea
+
+    def shouldDetect(self, image):
+        """
+        Returns whether to detect the cars of a frame, to be called on every frame.
+        """
+        self.framesSinceDetection += 1
+        if not self.gated or self.reference is None:
+            return self.framesSinceDetection >= self.interval
+        if self.framesSinceDetection < self.min_interval:
+            return False
+        motion = self.motion(image)
+        return motion >= MOTION_TRIGGER or (self.framesSinceDetection >= self.interval and motion >= MOTION_THRESHOLD)
+
+    def detected(self, image):
+        """Records that the cars of a frame are being detected."""
+        self.framesSinceDetection = 0
+        if self.gated:
+            self.reference = self.small(image)
+
+
+def roiMask(SELECTION_POINTS, width=WIDTH, height=HEIGHT):
+    """
+    Rasterizes the ROI once, so that many points can be tested against it at once (see inROI).
+
+    Parameters:
+    SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+    width, height (int): Size of the frames.
+
+    Returns:
+    numpy.ndarray: Whether each pixel of a frame is within the ROI, of shape (height, width).
+    """
+    mask = np.zeros((height, width), np.uint8)
+    cv2.fillPoly(mask, [np.asarray(SELECTION_POINTS, np.int32).reshape(-1, 1, 2)], 1)
+    return mask.astype(bool)
+
+
+def inROI(mask, points):
+    """
+    Tests whether points are within the ROI.
+
+    Parameters:
+    mask (numpy.ndarray): The rasterized ROI (see roiMask).
+    points (numpy.ndarray): Points (x, y), of shape (N, 2).
+
+    Returns:
+    numpy.ndarray: Whether each point is within the ROI, of shape (N,).
+    """
+    points = np.floor(np.asarray(points, dtype=float).reshape(-1, 2)).astype(int)
+    x, y = points[:, 0], points[:, 1]
+    inside = (x >= 0) & (x < mask.shape[1]) & (y >= 0) & (y < mask.shape[0])
+    inside[inside] = mask[y[inside], x[inside]]
+    return inside
+
+
+def calculateCenter(boxes):
+    """
+    Calculate the center coordinates of bounding boxes.
     
     Parameters:
-        carTracker (dict): Dictionary containing trackers for each car.
-        car: Car information containing the tracker and its bounding box.
+        boxes (numpy.ndarray): Boxes (x, y, width, height), of shape (N, 4).
     
     Returns:
-        tuple: A tuple containing the x and y coordinates of the center.
+        numpy.ndarray: The x and y coordinates of the centers, of shape (N, 2).
     """
-    trackedPosition = car['tracker'].get_position()
-    t_x = int(trackedPosition.left())
-    t_y = int(trackedPosition.top())
-    t_w = int(trackedPosition.width())
-    t_h = int(trackedPosition.height())
-    t_x_bar = t_x + 0.5 * t_w
-    t_y_bar = t_y + 0.5 * t_h
-    return t_x_bar, t_y_bar, t_x, t_y, t_w, t_h
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    return boxes[:, :2] + 0.5 * boxes[:, 2:]
 
 
-def trackCarsInROI(SELECTION_POINTS, image, carTracker, carLoc1, currentCar):
+def pointsInBoxes(points, boxes):
     """
-    Track cars within the region of interest (ROI) defined by SELECTION_POINTS.
+    Tests whether each point is within each box, edges included.
 
     Parameters:
-    SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
-    image (numpy.ndarray): The input image.
-    carTracker (dict): Dictionary to store trackers for each car.
-    carLoc1 (dict): Dictionary to store initial locations of tracked cars.
-    currentCar (int): Current ID to assign to new cars.
-
-    Returns:
-    dict: Updated carTracker.
-    dict: Updated carLoc1.
-    int: Updated currentCar.
-    """
-    cars = detectCars(image)
-    for (x, y, w, h) in cars:
-        # Calculate center of the car
-        center_x = x + w // 2
-        center_y = y + h // 2
-        # Check if center of the car lies inside the area
-        if cv2.pointPolygonTest(SELECTION_POINTS, (center_x, center_y), False) >= 0:
-            matchCar = None
-            # Track known car
-            for carID, carData in carTracker.items():
-                t_x_bar, t_y_bar, t_x, t_y, t_w, t_h = calculateCenter(carTracker, carData)
-                if ((t_x <= center_x <= (t_x + t_w)) and (t_y <= center_y <= (t_y + t_h)) and (
-                        x <= t_x_bar <= (x + w)) and (y <= t_y_bar <= (y + h))): 
-                    matchCar = carID
-                    break
-            # Track new car
-            if matchCar is None:
-                tracker = dlib.correlation_tracker()
-                tracker.start_track(image, dlib.rectangle(x, y, x + w, y + h))
-                carTracker[currentCar] = {'tracker': tracker, 'location': [x, y, w, h]}
-                carLoc1[currentCar] = [x, y, w, h]
-                currentCar += 1
-    return carTracker, carLoc1, currentCar
+    points (numpy.ndarray): Points (x, y), of shape (N, 2).
+    boxes (numpy.ndarray): Boxes (x, y, width, height), of shape (M, 4).
+
+    Returns:
+    numpy.ndarray: Whether each point is within each box, of shape (N, M).
+    """
+    x, y = points[:, None, 0], points[:, None, 1]
+    return ((boxes[None, :, 0] <= x) & (x <= boxes[None, :, 0] + boxes[None, :, 2])
+            & (boxes[None, :, 1] <= y) & (y <= boxes[None, :, 1] + boxes[None, :, 3]))
 
 
-def trackMultipleCars(SELECTION_POINTS):
+def trackCarsInROI(mask, boxes, cars):
     """
-    Tracks for each video frame multiple cars within ROI using YOLOv4 and tracking them with dlib.
-    
+    Selects the detected cars within the region of interest (ROI) that are not tracked yet: a detection matches a
+    tracked car when the center of each box is within the other.
+
     Parameters:
-    SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+    mask (numpy.ndarray): The rasterized ROI (see roiMask).
+    boxes (numpy.ndarray): Boxes (x, y, width, height) of the tracked cars, of shape (N, 4).
+    cars (list): Boxes of the cars detected in the image.
+
+    Returns:
+    numpy.ndarray: Boxes of the new cars to track, of shape (M, 4).
     """
-    frameCounter = 0
-    currentCar = 0
-    countedCars = set()  # Set to keep track of cars that have already been counted
-    carCounter = 0  # Counter for cars within the ROI
-    carTracker = {}  # Dictionary to store trackers for each car
-    carLoc1 = {}  # Dictionary to store initial locations of tracked cars
-    carLoc2 = {}  # Dictionary to store updated locations of tracked cars
+    cars = np.array(cars, dtype=int).reshape(-1, 4)
+    # Center of the cars, as pixels
+    centers = cars[:, :2] + cars[:, 2:] // 2
+    cars, centers = cars[inROI(mask, centers)], centers[inROI(mask, centers)]
+    if len(boxes) == 0:
+        return cars
+    # Whether the center of each car is within each tracked box, and the other way round
+    matches = pointsInBoxes(centers, boxes) & pointsInBoxes(calculateCenter(boxes), cars).T
+    return cars[~matches.any(axis=1)]
 
-    while True:
+
+class CarCounter:
+    """
+    Class to count the cars within the ROI of a video: the cars detected by YOLOv4 are tracked from frame to frame
+    with dlib, and counted while they are tracked once they entered the ROI.
+
+    The boxes of the tracked cars are kept in one array, and tested against the rasterized ROI all at once.
+    """
+
+    usesDlib = True
+
+    def __init__(self, SELECTION_POINTS):
+        """
+        Parameters:
+        SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+        """
+        if self.usesDlib and dlib is None:
+            raise ImportError("The 'dlib' tracker needs dlib, use the 'kalman' tracker instead")
+        self.SELECTION_POINTS = SELECTION_POINTS
+        self.mask = roiMask(SELECTION_POINTS)
+        self.currentCar = 0
+        self.countedCars = np.zeros(0, dtype=int)  # Ids of the cars that have already been counted
+        self.carCounter = 0  # Counter for cars within the ROI
+        self.carIDs = np.zeros(0, dtype=int)  # Id of each tracked car
+        self.carTrackers = []  # dlib tracker of each tracked car
+        self.carBoxes = np.zeros((0, 4))  # Box (x, y, width, height) of each tracked car
+        self.frame = 0  # Number of frames the trackers were updated with
+
+    def trackedCars(self):
+        """Returns the ids of the tracked cars, and their boxes (x, y, width, height) of shape (N, 4)."""
+        return self.carIDs, self.carBoxes
+
+    def forgetCars(self, carIDs):
+        """Stops counting the cars that are not tracked anymore."""
+        counted = np.isin(self.countedCars, carIDs)
+        self.carCounter -= int(counted.sum())
+        self.countedCars = self.countedCars[~counted]
+
+    def updateTrackers(self, image):
+        """
+        Updates the trackers with a new frame, and stops tracking the cars that were lost.
+
+        Parameters:
+        image (numpy.ndarray): The frame.
+        """
+        # Update tracking for existing cars
+        self.frame += 1
+        keep = np.ones(len(self.carIDs), dtype=bool)
+        for i, tracker in enumerate(self.carTrackers):
+            if tracker.update(image) < 9:
+                keep[i] = False
+            else:
+                position = tracker.get_position()
+                self.carBoxes[i] = (position.left(), position.top(), position.width(), position.height())
+
+        # Remove cars from tracking
+        if not keep.all():
+            self.forgetCars(self.carIDs[~keep])
+            self.carIDs, self.carBoxes = self.carIDs[keep], self.carBoxes[keep]
+            self.carTrackers = [tracker for tracker, kept in zip(self.carTrackers, keep) if kept]
+
+    def snapshot(self):
+        """
+        Returns the number of the current frame, and the ids and the boxes of the tracked cars in it, for detections of
+        this frame that will only be added frames later (see addDetections).
+        """
+        carIDs, boxes = self.trackedCars()
+        return self.frame, carIDs.copy(), np.array(boxes, dtype=float)
+
+    def catchUp(self, cars, snapshot):
+        """
+        Moves cars detected in the frame of a snapshot by the motion of the tracked car they overlap most since then,
+        so that they match its current box.
+
+        Parameters:
+        cars (list): Boxes of the detected cars.
+        snapshot (tuple): The snapshot of the frame they were detected in.
+
+        Returns:
+        numpy.ndarray: The boxes of the cars in the current frame, of shape (N, 4).
+        """
+        cars = np.array(cars, dtype=float).reshape(-1, 4)
+        _, snapshotIDs, snapshotBoxes = snapshot
+        carIDs, boxes = self.trackedCars()
+        # Tracked cars still tracked since the snapshot
+        _, snapshotIndexes, currentIndexes = np.intersect1d(snapshotIDs, carIDs, return_indices=True)
+        if len(cars) and len(snapshotIndexes):
+            iou = boxIoU(cars, snapshotBoxes[snapshotIndexes])
+            nearest = iou.argmax(axis=1)
+            overlapping = iou[np.arange(len(cars)), nearest] > 0
+            motion = boxes[currentIndexes[nearest], :2] - snapshotBoxes[snapshotIndexes[nearest], :2]
+            cars[overlapping, :2] += motion[overlapping]
+        return np.round(cars).astype(int)
+
+    def addDetections(self, image, cars, snapshot=None):
+        """
+        Tracks the detected cars within the ROI that are not tracked yet.
+
+        Parameters:
+        image (numpy.ndarray): The frame the cars were detected in.
+        cars (list): Boxes of the detected cars.
+        snapshot (tuple): The snapshot of the frame the cars were detected in, when the trackers moved on since then
+                          (see snapshot): the tracked cars are then matched after moving them forward (see catchUp).
+        """
+        if snapshot is not None:
+            cars = self.catchUp(cars, snapshot)
+        newCars = trackCarsInROI(self.mask, self.carBoxes, cars)
+        for x, y, w, h in newCars.tolist():
+            tracker = dlib.correlation_tracker()
+            tracker.start_track(image, dlib.rectangle(x, y, x + w, y + h))
+            self.carTrackers.append(tracker)
+        self.carIDs = np.concatenate([self.carIDs, np.arange(self.currentCar, self.currentCar + len(newCars))])
+        self.carBoxes = np.concatenate([self.carBoxes, newCars])
+        self.currentCar += len(newCars)
+
+    def count(self):
+        """
+        Counts the tracked cars that entered the ROI.
+
+        Returns:
+        list: The position (x, y, width, height) of each tracked car.
+        """
+        carIDs, boxes = self.trackedCars()
+        boxes = boxes.astype(int)
+        # Check which cars are inside the area and not counted yet
+        entered = carIDs[inROI(self.mask, calculateCenter(boxes)) & ~np.isin(carIDs, self.countedCars)]
+        self.carCounter += len(entered)
+        self.countedCars = np.concatenate([self.countedCars, entered])
+        return boxes.tolist()
+
+
+class KalmanCarCounter(CarCounter):
+    """
+    CarCounter tracking the cars with constant velocity Kalman filters on their boxes, matched with the detections
+    by IoU (see tracker.KalmanBoxTracker), instead of dlib correlation trackers. The frames are not read between
+    two detections, so tracking costs almost nothing whatever the number of cars.
+    """
+
+    usesDlib = False
+
+    def __init__(self, SELECTION_POINTS, assignment='greedy'):
+        super().__init__(SELECTION_POINTS)
+        self.tracker = KalmanBoxTracker(assignment=assignment)
+
+    def trackedCars(self):
+        return self.tracker.ids, self.tracker.boxes()
+
+    def updateTrackers(self, image):
+        self.frame += 1
+        self.tracker.predict()
+
+    def addDetections(self, image, cars, snapshot=None):
+        cars = np.array(cars, dtype=int).reshape(-1, 4)
+        # Only the cars detected within the ROI start new tracks, as with dlib
+        accept = inROI(self.mask, cars[:, :2] + cars[:, 2:] // 2)
+        # The tracks are corrected in the frame of the detections, and moved forward again (see KalmanBoxTracker)
+        age = 0 if snapshot is None else self.frame - snapshot[0]
+        self.forgetCars(self.tracker.update(cars, accept=accept, age=age))
+
+
+# Car counters by name of tracker
+carCounters = {'dlib': CarCounter, 'kalman': KalmanCarCounter}
+# Names of the trackers that can be used, with the installed packages
+availableTrackers = [name for name, counter in carCounters.items() if dlib is not None or not counter.usesDlib]
+
+
+def captureFrames(video, frames, stop, latencies):
+    """
+    Capture stage of the pipeline: reads and resizes the frames of the video, at its frame rate, and queues them
+    for tracking, the oldest ones being dropped when the tracking lags behind. Queues None at the end of the video.
+
+    Parameters:
+    video (cv2.VideoCapture): The video feed.
+    frames (queue.Queue): Queue of the (frame number, capture time, image) of the frames.
+    stop (threading.Event): Set to stop capturing.
+    latencies (dict): StageLatency of each stage.
+    """
+    fps = video.get(cv2.CAP_PROP_FPS)
+    period = 1 / fps if fps > 0 else 0
+    frameNumber = 0
+    nextTime = time.perf_counter()
+    while not stop.is_set():
+        start = time.perf_counter()
         rc, image = video.read()
         if not rc:
             break
         image = cv2.resize(image, (WIDTH, HEIGHT))
-        resultImage = image.copy()
-        frameCounter += 1
-        carToDelete = []
+        frameNumber += 1
+        latencies['capture'].add(time.perf_counter() - start)
+        latencies['dropped frames'] += putDroppingOldest(frames, (frameNumber, start, image))
+        # A video file is read at its frame rate, a camera already delivers its frames at that rate
+        nextTime += period
+        time.sleep(max(0, nextTime - time.perf_counter()))
+    putDroppingOldest(frames, None)
 
-        # Update tracking for existing cars
-        for carID, carData in carTracker.items():
-            if carData['tracker'].update(image) < 9:
-                carToDelete.append(carID)
 
-        # Remove cars from tracking
-        for carID in carToDelete:
-            carTracker.pop(carID, None)
-            carLoc1.pop(carID, None)
-            carLoc2.pop(carID, None)
-            if carID in countedCars:
-                carCounter -= 1
-                countedCars.remove(carID)
-
-        # Track every 30 frames
-        if frameCounter % 30 == 0:
-            carTracker, carLoc1, currentCar = trackCarsInROI(SELECTION_POINTS, image, carTracker, carLoc1, currentCar)
-
-        # Draw area outline
-        cv2.polylines(resultImage, [SELECTION_POINTS.reshape((-1, 1, 2))], True, (0, 0, 255), 2)
-
-        # Extract the position from the tracker for each car
-        for carID, carData in carTracker.items():
-            t_x_bar, t_y_bar, t_x, t_y, t_w, t_h = calculateCenter(carTracker, carData)
-
-            # Check if car is inside the area and display rectangle
-            if cv2.pointPolygonTest(SELECTION_POINTS, (t_x + t_w/2, t_y + t_h/2), False) >= 0 and carID not in countedCars:
-                carCounter += 1
-                countedCars.add(carID)
-            cv2.rectangle(resultImage, (t_x, t_y), (t_x + t_w, t_y + t_h), (0, 255, 0), 4)
-
-        # Display counter
-        cv2.putText(resultImage, f'Cars in line: {carCounter}', (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
-        # Send it to server
-        Timer(1, sendCounter, args=(carCounter,)).start()
-        cv2.imshow('result', resultImage)
-        
-        if cv2.waitKey(33) == 27:
+def inferFrames(requests, detections, latencies, region=None):
+    """
+    Inference stage of the pipeline: detects the cars of the frames sent by the tracking stage, as fast as the
+    hardware allows, and queues the detections. Stops when it receives None.
+
+    Parameters:
+    requests (queue.Queue): Queue of the ((frame number, capture time, image), snapshot) of the frames to detect cars
+                            in, with the snapshot of the trackers in the frame (see CarCounter.snapshot).
+    detections (queue.Queue): Queue of the (image, boxes, snapshot) of the detected cars.
+    latencies (dict): StageLatency of each stage.
+    region (tuple): Region of the frames to detect cars in (see roiRegion), the whole frames by default.
+    """
+    while True:
+        request = requests.get()
+        if request is None:
             break
-    cv2.destroyAllWindows()
+        (_, _, image), snapshot = request
+        start = time.perf_counter()
+        cars = detectCars(image, region)
+        latencies['inference'].add(time.perf_counter() - start)
+        putDroppingOldest(detections, (image, cars, snapshot))
+
+
+def trackMultipleCars(SELECTION_POINTS, video, display=True, tracker=TRACKER, motion_gate=MOTION_GATE):
+    """
+    Tracks for each video frame multiple cars within ROI using YOLOv4 and tracking them with dlib.
+
+    The frames go through a pipeline: a capture thread reads them, the tracking stage (this thread) updates the
+    trackers and the counter on every frame, and sends the latest frame to an inference thread running YOLO
+    whenever it is done with the previous one, with a snapshot of the tracked cars. The cars it detects are tracked as
+    soon as they come back, frames later, matched with the tracked cars as they were in the snapshot (see
+    CarCounter.addDetections), so that a car already tracked is not counted again. The stages are connected by
+    bounded queues dropping the oldest frames, so the counter keeps up with the camera whatever the speed of YOLO.
+    YOLO only sees the region of the ROI (see roiRegion), and with the motion gate, only the frames where something
+    moved within the ROI since the last frame it saw.
+
+    Parameters:
+    SELECTION_POINTS (numpy.ndarray): The points defining the ROI.
+    video (cv2.VideoCapture): The video feed.
+    display (bool): Whether to show the frames with the tracked cars and the counter.
+    tracker (str): Tracking of the cars between detections, 'dlib' or 'kalman'.
+    motion_gate (bool): Whether to skip the frames where nothing moved within the ROI (see MotionGate).
+
+    Returns:
+    dict: StageLatency of each stage ('capture', 'inference', 'tracking', and 'frame' from capture to count), and
+          the number of 'dropped frames'.
+    """
+    sender = CounterSender()
+    counter = carCounters[tracker](SELECTION_POINTS)
+    gate = MotionGate(SELECTION_POINTS, interval=1, min_interval=1, gated=motion_gate)
+
+    latencies = {'capture': StageLatency(), 'inference': StageLatency(), 'tracking': StageLatency(),
+                 'frame': StageLatency(), 'dropped frames': 0}
+    frames = queue.Queue(2)
+    requests = queue.Queue(1)
+    detections = queue.Queue(1)
+    stop = threading.Event()
+    capture = threading.Thread(target=captureFrames, args=(video, frames, stop, latencies), daemon=True)
+    inference = threading.Thread(target=inferFrames, args=(requests, detections, latencies,
+                                                          roiRegion(SELECTION_POINTS)), daemon=True)
+    capture.start()
+    inference.start()
+
+    inferring = False  # Whether the inference thread is detecting cars in a frame sent to it
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        _, captured, image = frame
+        start = time.perf_counter()
+
+        # Track the cars detected by the inference thread, before updating the trackers so that the new ones catch
+        # up with this frame, and send it the latest frame when it is done
+        try:
+            counter.addDetections(*detections.get_nowait())
+            inferring = False
+        except queue.Empty:
+            pass
+        counter.updateTrackers(image)
+        if not inferring and gate.shouldDetect(image):
+            gate.detected(image)
+            putDroppingOldest(requests, (frame, counter.snapshot()))
+            inferring = True
+
+        positions = counter.count()
+        # Send it to server, when it changed
+        sender.send(counter.carCounter)
+        now = time.perf_counter()
+        latencies['tracking'].add(now - start)
+        latencies['frame'].add(now - captured)
+
+        if display:
+            resultImage = image.copy()
+            # Draw area outline
+            cv2.polylines(resultImage, [SELECTION_POINTS.reshape((-1, 1, 2))], True, (0, 0, 255), 2)
+            for t_x, t_y, t_w, t_h in positions:
+                cv2.rectangle(resultImage, (t_x, t_y), (t_x + t_w, t_y + t_h), (0, 255, 0), 4)
+            # Display counter
+            cv2.putText(resultImage, f'Cars in line: {counter.carCounter}', (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            cv2.imshow('result', resultImage)
+            if cv2.waitKey(1) == 27:
+                break
+
+    stop.set()
+    putDroppingOldest(requests, None)
+    capture.join()
+    inference.join()
+    sender.close()
+    if display:
+        cv2.destroyAllWindows()
+    return latencies
+
+
+def openVideo(source):
+    """
+    Opens a video feed.
+
+    Parameters:
+    source (str or int): A video file, a stream URL, or the number of a webcam.
+
+    Returns:
+    cv2.VideoCapture: The video feed.
+    """
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    return cv2.VideoCapture(source)
+
+
+def loadStreams(filename):
+    """
+    Loads the streams of a JSON config file:
+        {"streams": [{"camera_id": "A:right", "source": "videos/1.mp4", "roi": [[x, y], [x, y], [x, y], [x, y]]}]}
+    each with the name of its camera for the server, its video feed (see openVideo) and the points of its ROI.
+
+    Returns:
+    list: The streams, with their ROI as a numpy.ndarray.
+    """
+    with open(filename, 'r') as f:
+        streams = json.load(f)['streams']
+    for stream in streams:
+        stream['roi'] = np.array(stream['roi'], np.int32)
+    return streams
+
+
+def saveStream(filename, camera_id, source, SELECTION_POINTS):
+    """
+    Adds a stream to a JSON config file (see loadStreams), replacing the stream of the same camera if any.
+    """
+    streams = []
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            streams = json.load(f)['streams']
+    streams = [stream for stream in streams if stream['camera_id'] != camera_id]
+    streams.append({'camera_id': camera_id, 'source': source, 'roi': np.asarray(SELECTION_POINTS).tolist()})
+    with open(filename, 'w') as f:
+        json.dump({'streams': streams}, f, indent=4)
+
+
+def countStreams(streams, server=None, detection_interval=DETECTION_INTERVAL, callback=None, tracker=TRACKER,
+                 motion_gate=MOTION_GATE):
+    """
+    Counts the cars within the ROI of several streams, without display, until all of them ended.
+
+    A frame of each stream is read in turn and updates its trackers, and the frames of the streams whose cars need
+    to be detected (every detection_interval frames, or as decided by their MotionGate) go through YOLOv4 together,
+    in one batch, cropped to the region of their ROI.
+
+    Parameters:
+    streams (list): The streams (see loadStreams).
+    server (tuple): (host, port) of the server to send the counts to, None not to send them.
+    detection_interval (int): Frames between two detections.
+    callback (callable): Called after each frame with the counts, a dict by camera id of the streams still running.
+    tracker (str): Tracking of the cars between detections, 'dlib' or 'kalman'.
+    motion_gate (bool): Whether to skip the detections when nothing moved within the ROI (see MotionGate).
+
+    Returns:
+    dict: The last count of each stream, by camera id.
+    """
+    videos = [openVideo(stream['source']) for stream in streams]
+    counters = [carCounters[tracker](stream['roi']) for stream in streams]
+    senders = [None if server is None else CounterSender(server, stream['camera_id']) for stream in streams]
+    gates = [MotionGate(stream['roi'], detection_interval, gated=motion_gate) for stream in streams]
+    regions = [roiRegion(stream['roi']) for stream in streams]
+    running = list(range(len(streams)))
+    while running:
+        images = {}
+        for i in running:
+            rc, image = videos[i].read()
+            if rc:
+                images[i] = cv2.resize(image, (WIDTH, HEIGHT))
+        running = list(images)
+
+        for i, image in images.items():
+            counters[i].updateTrackers(image)
+        detected = [i for i in running if gates[i].shouldDetect(images[i])]
+        if detected:
+            for i in detected:
+                gates[i].detected(images[i])
+            batch = detectCarsBatch([images[i] for i in detected], [regions[i] for i in detected])
+            for i, cars in zip(detected, batch):
+                counters[i].addDetections(images[i], cars)
+
+        counts = {}
+        for i in running:
+            counters[i].count()
+            counts[streams[i]['camera_id']] = counters[i].carCounter
+            if senders[i] is not None:
+                senders[i].send(counters[i].carCounter)
+        if callback is not None and counts:
+            callback(counts)
+
+    for video, sender in zip(videos, senders):
+        video.release()
+        if sender is not None:
+            sender.close()
+    return {stream['camera_id']: counter.carCounter for stream, counter in zip(streams, counters)}
 
 
 if __name__ == '__main__':
-    SELECTION_POINTS = select_ROI()
-    trackMultipleCars(SELECTION_POINTS)
+    parser = argparse.ArgumentParser(description="Count the cars within the region of interest of videos.")
+    parser.add_argument('--source', default=VIDEO_SOURCE, help="video file, stream URL or webcam number")
+    parser.add_argument('--config', help="JSON file of the streams to count without display (see loadStreams)")
+    parser.add_argument('--save-roi', metavar='CAMERA_ID',
+                        help="select the ROI of --source and save it to --config as the stream of this camera")
+    parser.add_argument('--server', help="host:port to send the counts of --config to")
+    parser.add_argument('--tracker', default=TRACKER, choices=availableTrackers,
+                        help="tracking of the cars between detections")
+    parser.add_argument('--no-motion-gate', action='store_true',
+                        help="detect the cars at a fixed rate, even when nothing moves within the ROI")
+    args = parser.parse_args()
+
+    if args.config is None:
+        # Count the cars of one video, with a window
+        video = openVideo(args.source)
+        SELECTION_POINTS = select_ROI(video)
+        latencies = trackMultipleCars(SELECTION_POINTS, video, tracker=args.tracker,
+                                      motion_gate=not args.no_motion_gate)
+        for stage, latency in latencies.items():
+            print(f"{stage}: {latency}")
+    elif args.save_roi is not None:
+        saveStream(args.config, args.save_roi, args.source, select_ROI(openVideo(args.source)))
+    else:
+        server = None
+        if args.server is not None:
+            host, port = args.server.rsplit(':', 1)
+            server = (host, int(port))
+        lastCounts = {}
+
+        def printChanges(counts):
+            for camera_id, count in counts.items():
+                if lastCounts.get(camera_id) != count:
+                    print(f"{camera_id}: {count}")
+            lastCounts.update(counts)
+
+        countStreams(loadStreams(args.config), server, callback=printChanges, tracker=args.tracker,
+                     motion_gate=not args.no_motion_gate)
@@ -0,0 +1,185 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+IOU_THRESHOLD = 0.3  # Minimum overlap of a detection with the predicted box of a track to update it
+MAX_MISSES = 2  # Detections in a row a track can miss before it is dropped
+POSITION_NOISE = 1.0  # Standard deviation of the motion of a box per frame, beyond its velocity (pixels)
+VELOCITY_NOISE = 0.5  # Standard deviation of the change of velocity per frame (pixels per frame)
+MEASUREMENT_NOISE = 5.0  # Standard deviation of the error of a detected box (pixels)
+VELOCITY_PRIOR = 10.0  # Standard deviation of the velocity of a new track (pixels per frame)
+GATE_DISTANCE = 9.21  # Maximum squared Mahalanobis distance of a detection from a track (99% for 2 dimensions)
+
+
+def boxIoU(boxes1, boxes2):
+    """
+    Computes the intersection over union of every pair of boxes.
+
+    Parameters:
+    boxes1 (numpy.ndarray): Boxes (x, y, width, height), of shape (N, 4).
+    boxes2 (numpy.ndarray): Boxes (x, y, width, height), of shape (M, 4).
+
+    Returns:
+    numpy.ndarray: The IoU of each pair, of shape (N, M).
+    """
+    x1, y1 = boxes1[:, None, 0], boxes1[:, None, 1]
+    x2, y2 = boxes2[None, :, 0], boxes2[None, :, 1]
+    width = np.minimum(x1 + boxes1[:, None, 2], x2 + boxes2[None, :, 2]) - np.maximum(x1, x2)
+    height = np.minimum(y1 + boxes1[:, None, 3], y2 + boxes2[None, :, 3]) - np.maximum(y1, y2)
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    union = (boxes1[:, None, 2] * boxes1[:, None, 3] + boxes2[None, :, 2] * boxes2[None, :, 3]) - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+def greedyAssignment(costs, valid):
+    """
+    Assigns the pairs of lowest cost first, each row and each column at most once.
+
+    Parameters:
+    costs (numpy.ndarray): Cost of each (row, column) pair.
+    valid (numpy.ndarray): Whether each pair can be assigned.
+
+    Returns:
+    numpy.ndarray: The assigned (row, column) pairs, of shape (K, 2).
+    """
+    rows, columns = np.nonzero(valid)
+    order = np.argsort(costs[rows, columns], kind='stable')
+    pairs = []
+    usedRows, usedColumns = set(), set()
+    for row, column in zip(rows[order].tolist(), columns[order].tolist()):
+        if row not in usedRows and column not in usedColumns:
+            usedRows.add(row)
+            usedColumns.add(column)
+            pairs.append((row, column))
+    return np.array(pairs, dtype=int).reshape(-1, 2)
+
+
+def assignBoxes(iou, threshold=IOU_THRESHOLD, method='greedy'):
+    """
+    Assigns detections to tracks by overlap.
+
+    Parameters:
+    iou (numpy.ndarray): IoU of each (track, detection) pair.
+    threshold (float): Minimum IoU of an assigned pair.
+    method (str): 'greedy' to assign the pairs by decreasing IoU, 'hungarian' to maximize the total IoU (needs
+                  scipy).
+
+    Returns:
+    numpy.ndarray: The assigned (track, detection) pairs, of shape (K, 2).
+    """
+    if iou.size == 0:
+        return np.zeros((0, 2), dtype=int)
+    if method == 'hungarian':
+        if linear_sum_assignment is None:
+            raise ImportError("The hungarian assignment needs scipy")
+        tracks, detections = linear_sum_assignment(-iou)
+        keep = iou[tracks, detections] >= threshold
+        return np.stack([tracks[keep], detections[keep]], axis=1)
+    return greedyAssignment(-iou, iou >= threshold)
+
+
+class KalmanBoxTracker:
+    """
+    Class to track many boxes at once with constant velocity Kalman filters, on their state only (no pixels).
+
+    The state of a track is its box center, width and height, and their velocities per frame. predict moves all the
+    tracks by one frame, and update matches the detected boxes with the predicted ones by IoU, corrects the matched
+    tracks, starts tracks for the other detections (see update) and drops the tracks that missed too many
+    detections in a row. As detections can be many frames apart, the tracks that overlap no detection (e.g. new
+    tracks, whose velocity is not known yet) are then matched with the nearest detection within their uncertainty.
+    """
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, max_misses=MAX_MISSES, assignment='greedy'):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.assignment = assignment
+        self.ids = np.zeros(0, dtype=int)
+        self.state = np.zeros((0, 8))  # Center x, center y, width, height, and their velocities
+        self.covariance = np.zeros((0, 8, 8))
+        self.misses = np.zeros(0, dtype=int)
+        self.nextID = 0
+
+        self.transition = np.eye(8)
+        self.transition[:4, 4:] = np.eye(4)
+        self.processNoise = np.diag([POSITION_NOISE ** 2] * 4 + [VELOCITY_NOISE ** 2] * 4)
+        self.measurementNoise = np.eye(4) * MEASUREMENT_NOISE ** 2
+
+    def boxes(self):
+        """Returns the boxes (x, y, width, height) of the tracks, of shape (N, 4)."""
+        centers, sizes = self.state[:, :2], np.maximum(self.state[:, 2:4], 1)
+        return np.concatenate([centers - sizes / 2, sizes], axis=1)
+
+    def predict(self):
+        """Moves all the tracks by one frame."""
+        self.state = self.state @ self.transition.T
+        self.covariance = self.transition @ self.covariance @ self.transition.T + self.processNoise
+
+    def update(self, detections, accept=None, age=0):
+        """
+        Corrects the tracks with the detected boxes of a frame.
+
+        Parameters:
+        detections (numpy.ndarray): Detected boxes (x, y, width, height), of shape (M, 4).
+        accept (numpy.ndarray): Whether a detection not matching any track starts a new one (all by default).
+        age (int): Number of frames the tracks were moved by since the frame of the detections: the tracks are moved
+                   back to it to be matched and corrected, then forward again.
+
+        Returns:
+        numpy.ndarray: The ids of the tracks dropped because they missed too many detections.
+        """
+        detections = np.asarray(detections, dtype=float).reshape(-1, 4)
+        if age:
+            back = np.linalg.matrix_power(self.transition, -age)
+            self.state = self.state @ back.T
+            self.covariance = back @ self.covariance @ back.T
+        measurements = np.concatenate([detections[:, :2] + detections[:, 2:] / 2, detections[:, 2:]], axis=1)
+        pairs = assignBoxes(boxIoU(self.boxes(), detections), self.iou_threshold, self.assignment)
+
+        # Match the other tracks and detections by Mahalanobis distance of the centers
+        otherTracks = np.setdiff1d(np.arange(len(self.ids)), pairs[:, 0])
+        otherDetections = np.setdiff1d(np.arange(len(detections)), pairs[:, 1])
+        if len(otherTracks) and len(otherDetections):
+            covariance = self.covariance[otherTracks, :2, :2] + self.measurementNoise[:2, :2]
+            differences = measurements[None, otherDetections, :2] - self.state[otherTracks, None, :2]
+            distances = np.einsum('tdi,tij,tdj->td', differences, np.linalg.inv(covariance), differences)
+            nearest = greedyAssignment(distances, distances < GATE_DISTANCE)
+            pairs = np.concatenate([pairs, np.stack([otherTracks[nearest[:, 0]], otherDetections[nearest[:, 1]]],
+                                                    axis=1)])
+        tracks, matched = pairs[:, 0], pairs[:, 1]
+
+        # Kalman correction of the matched tracks, all at once
+        if len(tracks):
+            covariance = self.covariance[tracks]
+            innovation = measurements[matched] - self.state[tracks, :4]
+            gain = covariance[:, :, :4] @ np.linalg.inv(covariance[:, :4, :4] + self.measurementNoise)
+            self.state[tracks] += (gain @ innovation[:, :, None])[:, :, 0]
+            self.covariance[tracks] = covariance - gain @ covariance[:, :4, :]
+        self.misses += 1
+        self.misses[tracks] = 0
+
+        dropped = self.misses > self.max_misses
+        droppedIDs = self.ids[dropped]
+        self.ids, self.state = self.ids[~dropped], self.state[~dropped]
+        self.covariance, self.misses = self.covariance[~dropped], self.misses[~dropped]
+
+        # New tracks, at rest, for the other detections
+        new = np.ones(len(detections), dtype=bool)
+        new[matched] = False
+        if accept is not None:
+            new &= accept
+        count = int(new.sum())
+        if count:
+            state = np.zeros((count, 8))
+            state[:, :4] = measurements[new]
+            covariance = np.tile(np.diag([MEASUREMENT_NOISE ** 2] * 4 + [VELOCITY_PRIOR ** 2] * 4), (count, 1, 1))
+            self.ids = np.concatenate([self.ids, np.arange(self.nextID, self.nextID + count)])
+            self.state = np.concatenate([self.state, state])
+            self.covariance = np.concatenate([self.covariance, covariance])
+            self.misses = np.concatenate([self.misses, np.zeros(count, dtype=int)])
+            self.nextID += count
+        for _ in range(age):
+            self.predict()
+        return droppedIDs
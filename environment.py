@@ -0,0 +1,183 @@
+import numpy as np
+
+from controllers import Controller, load_model
+from network import Network
+from simulation import DT, MIN_GREEN_TIME, TRAFFIC_DENSITY, noOfSignals
+
+# Reward parameters of 'modele ML/bestModel.txt', used when no model is given
+DEFAULT_REWARD_PARAMETERS = {'vehicle_passed': 1, 'waiting_time_penalty': -0.5}
+OBSERVATION_SIZE = 3 * noOfSignals  # Queue, mean wait and green light of each approach
+
+
+class AgentController(Controller):
+    """
+    Controller applying the action of an agent: the signal that should be green. The current signal stays green by
+    steps of decision_time while it is the action, otherwise the action's signal turns green after the yellow and
+    all-red times.
+    """
+
+    def __init__(self, decision_time, min_green_time=MIN_GREEN_TIME):
+        super().__init__(min_green_time)
+        self.decision_time = decision_time
+        self.action = 0
+
+    def extend_green(self, state):
+        return self.decision_time if self.action == state.current_green else 0
+
+    def next_green(self, state):
+        return self.action
+
+
+class VecTrafficEnv:
+    """
+    Reinforcement learning environment of num_envs independent intersections stepped in lockstep, with the
+    reset() / step(actions) interface of Gymnasium's vector environments.
+
+    All the intersections run in one network without links, so every tick moves the vehicles of all of them in a
+    single batch. An action is the signal that should be green at an intersection. An observation holds, for each
+    approach, its queue (vehicles that did not cross yet), their mean time since they arrived, and whether its
+    light is green. The reward of a step is vehicle_passed per vehicle that crossed, plus waiting_time_penalty per
+    second waited by the vehicles in the queues.
+    """
+
+    def __init__(self, num_envs, trafficDensity=TRAFFIC_DENSITY, direction_priority=(1, 1, 1, 1), simulation_speed=10,
+                 decision_time=1, episode_time=300, model=None, dt=DT, seed=None):
+        """
+        Initialize the environments.
+
+        Parameters:
+        num_envs (int): Number of intersections.
+        trafficDensity, direction_priority, simulation_speed, dt: Parameters of the intersections (see Intersection).
+        decision_time (float): Simulated seconds between two actions.
+        episode_time (float): Simulated seconds of an episode, after which the environments are truncated and reset.
+        model (dict or str): Model (or name of a model file of 'modele ML') giving the 'reward_parameters'.
+        seed: Seed of the first episode, environment i using seed + i.
+        """
+        if isinstance(model, str):
+            model = load_model(model)
+        reward_parameters = DEFAULT_REWARD_PARAMETERS if model is None else model['reward_parameters']
+        self.vehicle_passed = reward_parameters['vehicle_passed']
+        self.waiting_time_penalty = reward_parameters['waiting_time_penalty']
+        self.num_envs = num_envs
+        self.trafficDensity = trafficDensity
+        self.direction_priority = list(direction_priority)
+        self.simulation_speed = simulation_speed
+        self.decision_time = decision_time
+        self.episode_time = episode_time
+        self.dt = dt
+        self.ticks_per_step = max(1, round(decision_time / (dt * simulation_speed)))
+        self.num_actions = noOfSignals
+        self.observation_size = OBSERVATION_SIZE
+        self.seed = seed
+        self.network = None
+
+    def reset(self, seed=None):
+        """
+        Start new episodes.
+
+        Returns:
+        np.ndarray: The observations, of shape (num_envs, OBSERVATION_SIZE).
+        dict: Infos.
+        """
+        if seed is not None:
+            self.seed = seed
+        self.network = Network(self.simulation_speed, self.trafficDensity, self.direction_priority, 'normal',
+                               dt=self.dt)
+        self.controllers = []
+        for i in range(self.num_envs):
+            controller = AgentController(self.decision_time)
+            self.network.add_intersection(str(i), seed=None if self.seed is None else self.seed + i,
+                                          traffic_light_policy=controller)
+            self.controllers.append(controller)
+        self.intersections = list(self.network.intersections.values())
+        # Next episodes draw other vehicles
+        if self.seed is not None:
+            self.seed += self.num_envs
+        self.crossed = np.zeros(self.num_envs)
+        self.waited = self.total_waiting_time()
+        return self.observe(), {}
+
+    def total_waiting_time(self):
+        """Return, for each intersection, the seconds waited so far by all its vehicles before crossing."""
+        vehicles = self.network.vehicles
+        n = vehicles.size
+        queued = vehicles.alive[:n] & ~vehicles.crossed[:n]
+        waiting = np.bincount(vehicles.lane[:n][queued] // noOfSignals,
+                              weights=self.network.sim_time - vehicles.spawn_time[:n][queued],
+                              minlength=self.num_envs)
+        crossed = np.array([intersection.total_crossing_time for intersection in self.intersections])
+        return waiting + crossed
+
+    def observe(self):
+        """Return the observations of the intersections, of shape (num_envs, OBSERVATION_SIZE)."""
+        vehicles = self.network.vehicles
+        n = vehicles.size
+        queued = vehicles.alive[:n] & ~vehicles.crossed[:n]
+        waits = np.bincount(vehicles.lane[:n][queued],
+                            weights=self.network.sim_time - vehicles.spawn_time[:n][queued],
+                            minlength=vehicles.lanes).reshape(self.num_envs, noOfSignals)
+        queues = np.array([intersection.queue_state.queues for intersection in self.intersections])
+        green = np.array([intersection.currentGreen for intersection in self.intersections])
+        observations = np.zeros((self.num_envs, OBSERVATION_SIZE), dtype=np.float32)
+        observations[:, :noOfSignals] = queues
+        observations[:, noOfSignals:2 * noOfSignals] = waits / np.maximum(queues, 1)
+        observations[:, 2 * noOfSignals:] = np.arange(noOfSignals) == green[:, None]
+        return observations
+
+    def step(self, actions):
+        """
+        Apply an action to each intersection and run them for decision_time simulated seconds. Environments are
+        reset at the end of an episode, their last observation being in the infos.
+
+        Parameters:
+        actions (array-like): Signal that should be green at each intersection.
+
+        Returns:
+        np.ndarray: The observations, of shape (num_envs, OBSERVATION_SIZE).
+        np.ndarray: The rewards.
+        np.ndarray: Whether each episode terminated (never, the traffic does not end).
+        np.ndarray: Whether each episode was truncated (episode_time reached).
+        dict: Infos, with the 'crossed' vehicles of each intersection during the step.
+        """
+        for controller, action in zip(self.controllers, np.asarray(actions).tolist()):
+            controller.action = action
+        for _ in range(self.ticks_per_step):
+            self.network.step()
+
+        crossed = np.array([intersection.total_crossed_vehicles for intersection in self.intersections])
+        waited = self.total_waiting_time()
+        new_crossings = crossed - self.crossed
+        rewards = self.vehicle_passed * new_crossings + self.waiting_time_penalty * (waited - self.waited)
+        self.crossed = crossed
+        self.waited = waited
+
+        observations = self.observe()
+        infos = {'crossed': new_crossings}
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        truncated = np.full(self.num_envs, self.network.sim_time >= self.episode_time)
+        if truncated[0]:
+            infos['final_observation'] = observations
+            observations, _ = self.reset()
+        return observations, rewards, terminated, truncated, infos
+
+
+class TrafficEnv:
+    """
+    Reinforcement learning environment of one intersection, with the reset() / step(action) interface of Gymnasium
+    environments. See VecTrafficEnv for the actions, observations and rewards.
+    """
+
+    def __init__(self, **kwargs):
+        """Initialize the environment, with the parameters of VecTrafficEnv other than num_envs."""
+        self.env = VecTrafficEnv(1, **kwargs)
+        self.num_actions = noOfSignals
+        self.observation_size = OBSERVATION_SIZE
+
+    def reset(self, seed=None):
+        observations, infos = self.env.reset(seed)
+        return observations[0], infos
+
+    def step(self, action):
+        observations, rewards, terminated, truncated, infos = self.env.step([action])
+        infos = {key: value[0] for key, value in infos.items()}
+        return observations[0], float(rewards[0]), bool(terminated[0]), bool(truncated[0]), infos
@@ -0,0 +1,175 @@
+import math
+
+import numpy as np
+
+QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}  # Quantiles reported by StreamingStats.summary
+RELATIVE_ACCURACY = 0.01  # Relative error of the quantiles of a QuantileSketch
+noOfApproaches = 4
+noOfVehicleTypes = 4
+
+
+class QuantileSketch:
+    """
+    Class to estimate the quantiles of a stream of values in constant memory, within a relative error (DDSketch):
+    each value is counted in a bucket of values within relative_accuracy of each other, the buckets growing
+    geometrically. Merging two sketches adds their counts, which gives exactly the sketch of both streams.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.counts = {}  # Number of values by bucket index
+        self.zero_count = 0  # Number of values <= 0, estimated as 0
+        self.count = 0
+
+    def add(self, values):
+        """Add an array of values to the sketch."""
+        values = np.asarray(values, dtype=np.float64)
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        indexes, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        """Add the values of another sketch, of the same relative accuracy, to this one."""
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def quantile(self, q):
+        """Return the estimated q-quantile (0 <= q <= 1) of the values, nan if there is none."""
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                # Middle of the bucket, in relative terms
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.counts) / (self.gamma + 1)
+
+
+class StreamingStats:
+    """
+    Class to compute statistics of a stream of values in constant memory: count, mean and variance (Welford's
+    algorithm, updated by batches with Chan's formula), min, max, and quantiles (QuantileSketch). Two StreamingStats
+    merge into the statistics of both streams, e.g. of runs done in parallel.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of the squared differences to the mean
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = QuantileSketch()
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def add(self, values):
+        """Add an array of values."""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self._combine(len(values), mean, ((values - mean) ** 2).sum(), values.min(), values.max())
+        self.sketch.add(values)
+
+    def merge(self, other):
+        """Add the values of another StreamingStats to this one."""
+        if other.count == 0:
+            return
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        self.sketch.merge(other.sketch)
+
+    @property
+    def variance(self):
+        """Sample variance of the values, nan if there are less than two."""
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def summary(self):
+        """Return the count, mean, std, min, max and QUANTILES of the values as a dict."""
+        empty = self.count == 0
+        summary = {'count': self.count, 'mean': math.nan if empty else float(self.mean),
+                   'std': math.sqrt(self.variance) if self.count > 1 else math.nan,
+                   'min': math.nan if empty else float(self.min), 'max': math.nan if empty else float(self.max)}
+        for name, q in QUANTILES.items():
+            summary[name] = self.quantile(q)
+        return summary
+
+
+class CrossingMetrics:
+    """
+    Class to collect the metrics of an intersection as the simulation runs, in constant memory: the statistics of
+    the spawn to cross times of its vehicles, overall, by approach and by vehicle type, and the time average of the
+    queue of each approach. The metrics of several intersections or runs merge into their overall metrics.
+    """
+
+    def __init__(self):
+        self.crossing = StreamingStats()
+        self.approaches = [StreamingStats() for _ in range(noOfApproaches)]
+        self.vehicle_types = [StreamingStats() for _ in range(noOfVehicleTypes)]
+        self.queue_area = np.zeros(noOfApproaches)  # Integral of each queue over the simulated time
+        self.queue_time = 0  # Simulated time the queues were integrated over
+
+    def add_crossings(self, crossing_times, direction_numbers, type_numbers):
+        """
+        Add the crossing times of vehicles that just crossed.
+
+        Parameters:
+        crossing_times (np.ndarray): Spawn to cross time of each vehicle.
+        direction_numbers (np.ndarray): Approach of each vehicle.
+        type_numbers (np.ndarray): Type of each vehicle.
+        """
+        self.crossing.add(crossing_times)
+        for groups, numbers in ((self.approaches, direction_numbers), (self.vehicle_types, type_numbers)):
+            for number in np.unique(numbers).tolist():
+                groups[number].add(crossing_times[numbers == number])
+
+    def update_queues(self, queues, sim_time):
+        """Integrate the queues up to sim_time, called before they change with the queues they had so far."""
+        self.queue_area += queues * (sim_time - self.queue_time)
+        self.queue_time = sim_time
+
+    def average_queues(self):
+        """Return the time average of the queue of each approach."""
+        return self.queue_area / self.queue_time if self.queue_time else np.zeros(noOfApproaches)
+
+    def merge(self, other):
+        """
+        Add the metrics of another intersection or run to these ones. The average queues become the averages over
+        the time of both, e.g. the mean of the intersections of a network.
+        """
+        for stats, other_stats in zip([self.crossing] + self.approaches + self.vehicle_types,
+                                      [other.crossing] + other.approaches + other.vehicle_types):
+            stats.merge(other_stats)
+        self.queue_area = self.queue_area + other.queue_area
+        self.queue_time += other.queue_time
+
+    def results(self):
+        """
+        Return the metrics as a dict: 'crossing' (StreamingStats.summary of the crossing times), 'approaches' and
+        'vehicle_types' (their summaries by approach and type number), and 'average_queues'.
+        """
+        return {
+            'crossing': self.crossing.summary(),
+            'approaches': [stats.summary() for stats in self.approaches],
+            'vehicle_types': [stats.summary() for stats in self.vehicle_types],
+            'average_queues': self.average_queues().tolist(),
+        }
@@ -0,0 +1,211 @@
+import json
+import random
+
+import numpy as np
+
+from collisions import ConflictDetector
+from metrics import QUANTILES, CrossingMetrics, StreamingStats
+from simulation import (DT, FPS, Intersection, VehicleStore, directionNumbers, laneAxes, noOfSignals,
+                        startPositions, typeLengths)
+
+ID_STRIDE = 10 ** 9  # Range of vehicle ids of each intersection, to keep them unique across the network
+gridOffsets = {0: (1, 0), 1: (0, -1), 2: (-1, 0), 3: (0, 1)}  # (row, column) offset of the next intersection
+directionNames = {name: number for number, name in directionNumbers.items()}
+
+
+class Network:
+    """
+    Class to represent a network of intersections. A link sends the vehicles leaving an intersection in one
+    direction to the lane of the same direction of the next intersection, instead of killing them.
+
+    New vehicles only enter the network on the approaches that no link feeds, and leave it through the exits that
+    have no link. The vehicles of all the intersections share one VehicleStore, so every tick moves all of them in a
+    single batch while each intersection only steps its own signals.
+    """
+
+    def __init__(self, simulation_speed, trafficDensity, direction_priority, traffic_light_policy, dt=DT, seed=None):
+        """
+        Initialize an empty network. The parameters are those of its intersections (see Intersection), each
+        intersection getting its own seed drawn from seed.
+        """
+        self.simulation_speed = simulation_speed
+        self.trafficDensity = trafficDensity
+        self.direction_priority = direction_priority
+        self.traffic_light_policy = traffic_light_policy
+        self.dt = dt
+        self.step_factor = 2 * simulation_speed * dt * FPS  # As in Intersection
+        self.braking_factor = 0.99 ** (dt * FPS)
+        self.random = random.Random(seed)
+        self.vehicles = VehicleStore(lanes=0)
+        self.intersections = {}  # Intersections by name, in the order they were added
+        self.links = {}  # Name of the next intersection, by (name of the intersection, direction number)
+        self.ticks = 0
+        self.sim_time = 0
+        self.next_destroy_time = 0
+        self.exited_vehicles = 0  # Number of vehicles that left the network
+        self.network_delays = StreamingStats()  # Time spent in the network by each vehicle that left it
+        self.conflict_detector = ConflictDetector(laneAxes, typeLengths.max())
+        self.recorder = None  # recorder.EventRecorder of the vehicles' events, if any
+
+    def add_intersection(self, name, seed=None, traffic_light_policy=None):
+        """
+        Add an intersection to the network and return it. Its seed is drawn from the network's seed and its traffic
+        light policy is the network's, unless they are given.
+        """
+        index = len(self.intersections)
+        if seed is None:
+            seed = self.random.getrandbits(64)
+        self.vehicles.lanes += noOfSignals
+        self.vehicles.lane_front = np.append(self.vehicles.lane_front, [-1] * noOfSignals)
+        self.vehicles.lane_rear = np.append(self.vehicles.lane_rear, [-1] * noOfSignals)
+        intersection = Intersection(self.simulation_speed, self.trafficDensity, list(self.direction_priority),
+                                    traffic_light_policy or self.traffic_light_policy, dt=self.dt, seed=seed,
+                                    vehicles=self.vehicles, lane_base=index * noOfSignals)
+        intersection.name = name
+        intersection.id_base = index * ID_STRIDE
+        self.intersections[name] = intersection
+        self._intersection_list = list(self.intersections.values())
+        return intersection
+
+    def add_link(self, upstream, direction, downstream):
+        """
+        Link an exit of an intersection to the approach of the same direction of another one.
+
+        Parameters:
+        upstream (str): Name of the intersection the vehicles leave.
+        direction (str or int): Direction of the vehicles ('down', 'left', 'up', 'right' or their number).
+        downstream (str): Name of the intersection the vehicles enter.
+        """
+        direction_number = directionNames.get(direction, direction)
+        self.links[(upstream, direction_number)] = downstream
+        # The approach is fed by the link, so no new vehicle enters the network there
+        self.intersections[downstream].direction_priority[direction_number] = 0
+        # The controller of the upstream intersection sees the queue its vehicles join
+        self.intersections[upstream].queue_state.downstream[direction_number] = \
+            self.intersections[downstream].queue_state
+
+    @classmethod
+    def grid(cls, rows, columns, *args, **kwargs):
+        """
+        Build a grid of rows x columns intersections named "row,column", each linked to its neighbours.
+        The other parameters are those of Network.
+        """
+        network = cls(*args, **kwargs)
+        for row in range(rows):
+            for column in range(columns):
+                network.add_intersection(f"{row},{column}")
+        for row in range(rows):
+            for column in range(columns):
+                for direction_number, (row_offset, column_offset) in gridOffsets.items():
+                    next_row, next_column = row + row_offset, column + column_offset
+                    if 0 <= next_row < rows and 0 <= next_column < columns:
+                        network.add_link(f"{row},{column}", direction_number, f"{next_row},{next_column}")
+        return network
+
+    def destroy_vehicles(self):
+        """Once per simulated second, move the vehicles that left an intersection to the next one, or out of the
+        network."""
+        if self.sim_time < self.next_destroy_time:
+            return
+        self.next_destroy_time += 1
+        vehicles = self.vehicles
+        rows = vehicles.out_of_bounds()
+        if len(rows) == 0:
+            return
+        # Copy the leaving vehicles before their rows are reused
+        leaving = [(int(vehicles.lane[row]), int(vehicles.vehicle_id[row]), int(vehicles.vehicle_type[row]),
+                    vehicles.position[row] - vehicles.limit_position[row] - vehicles.length[row],
+                    vehicles.origin_time[row], vehicles.speed[row]) for row in rows.tolist()]
+        vehicles.remove(rows)
+        delays = []
+        for lane, vehicle_id, type_number, overshoot, origin_time, speed in leaving:
+            intersection = self._intersection_list[lane // noOfSignals]
+            intersection.vehicle_kill_counter += 1
+            direction_number = lane % noOfSignals
+            downstream = self.links.get((intersection.name, direction_number))
+            if downstream is None:
+                self.exited_vehicles += 1
+                delays.append(self.sim_time - origin_time)
+                continue
+            # Keep the distance travelled past the limit, the vehicle enters at the start of the lane
+            downstream = self.intersections[downstream]
+            vehicles.add(vehicle_id, type_number, downstream.lane_base + direction_number,
+                         startPositions[direction_number] + overshoot, self.sim_time, origin_time=origin_time,
+                         speed=speed)
+            downstream.vehicle_arrived(direction_number)
+        self.network_delays.add(delays)
+
+    def step(self):
+        """Advance every intersection of the network by one tick."""
+        intersections = self._intersection_list
+        for intersection in intersections:
+            intersection.step_signals()
+        self.destroy_vehicles()
+
+        green_lanes = np.zeros(self.vehicles.lanes, dtype=bool)
+        for intersection in intersections:
+            if intersection.currentGreen != -1:
+                green_lanes[intersection.lane_base + intersection.currentGreen] = True
+
+        crossed_rows = self.vehicles.update(green_lanes, self.sim_time, self.step_factor, self.braking_factor)
+        if len(crossed_rows) > 0:
+            owners = self.vehicles.lane[crossed_rows] // noOfSignals
+            for index in np.unique(owners).tolist():
+                intersections[index].record_crossings(crossed_rows[owners == index])
+        self.conflict_detector.update(self.vehicles, self.sim_time)
+        if self.recorder is not None:
+            self.recorder.observe(self.vehicles, self.sim_time)
+
+        for intersection in intersections:
+            intersection.advance_clock()
+        self.ticks += 1
+        self.sim_time = self.ticks * self.dt * self.simulation_speed
+
+    @property
+    def drained(self):
+        """Whether no vehicle will enter the network anymore: never, its arrivals are drawn without end."""
+        return False
+
+    @property
+    def metrics(self):
+        """Metrics of all the intersections (see CrossingMetrics), their queues integrated up to now."""
+        metrics = CrossingMetrics()
+        for intersection in self._intersection_list:
+            intersection.metrics.update_queues(intersection.queue_state.queues, intersection.sim_time)
+            metrics.merge(intersection.metrics)
+        return metrics
+
+    def get_results(self):
+        """Return the network-level throughput (vehicles leaving the network per simulated second) and delays."""
+        delays = self.network_delays
+        return {
+            'network_throughput': self.exited_vehicles / self.sim_time if self.sim_time else 0,
+            'average_network_delay': float(delays.mean),
+            'max_network_delay': float(max(delays.max, 0)),
+            'p95_network_delay': delays.quantile(QUANTILES['p95']) if delays.count else 0,
+        }
+
+
+def load_network(filename, simulation_speed, trafficDensity, direction_priority, traffic_light_policy, dt=DT,
+                 seed=None):
+    """
+    Load a network from a JSON file, either a grid:
+        {"grid": [10, 10]}
+    or a list of intersections and links (upstream intersection, direction, downstream intersection):
+        {"intersections": ["A", "B"], "links": [["A", "right", "B"], ["B", "left", "A"]]}
+
+    Returns:
+    Network: The network, with the given intersection parameters.
+    """
+    with open(filename, 'r') as file:
+        description = json.load(file)
+    if 'grid' in description:
+        rows, columns = description['grid']
+        return Network.grid(rows, columns, simulation_speed, trafficDensity, direction_priority,
+                            traffic_light_policy, dt=dt, seed=seed)
+    network = Network(simulation_speed, trafficDensity, direction_priority, traffic_light_policy, dt=dt, seed=seed)
+    for name in description['intersections']:
+        network.add_intersection(name)
+    for upstream, direction, downstream in description['links']:
+        network.add_link(upstream, direction, downstream)
+    return network
@@ -0,0 +1,131 @@
+import numpy as np
+
+# One record per event: time, vehicle, kind of event, and the lane, position and speed of the vehicle at that time
+recordType = np.dtype([('time', np.float64), ('vehicle_id', np.int64), ('event', np.int8), ('lane', np.int32),
+                       ('position', np.float32), ('speed', np.float32)])
+eventNumbers = {'spawn': 0, 'stop_line': 1, 'stop': 2, 'start': 3, 'cross': 4, 'kill': 5, 'position': 6}
+eventNames = {number: name for name, number in eventNumbers.items()}
+STOP_SPEED = 0.01  # Speed under which a vehicle counts as stopped
+
+
+class EventRecorder:
+    """
+    Class to record the events of the vehicles of a simulation to an append-only binary file of recordType
+    records: spawn, arrival at the stop line, stop, start, cross and kill, plus the position of every vehicle every
+    sample_interval simulated seconds.
+
+    Records go to a preallocated buffer, written to the file each time it is full, so a long run is recorded with a
+    bounded memory. The file can be read back without loading it with load_events.
+    """
+
+    def __init__(self, filename, sample_interval=None, buffer_size=1 << 16):
+        """
+        Create the file (or empty it) and initialize the recorder.
+
+        Parameters:
+        filename (str): Name of the file.
+        sample_interval (float): Simulated seconds between two samples of the positions, None not to sample them.
+        buffer_size (int): Number of records buffered before being written.
+        """
+        self.filename = filename
+        self.sample_interval = sample_interval
+        self.next_sample_time = 0
+        self.buffer = np.zeros(buffer_size, dtype=recordType)
+        self.buffered = 0
+        self.written = 0  # Number of records written to the file
+        open(filename, 'wb').close()
+        # State of each row of the store on the previous tick, to detect the events
+        self.capacity = 0
+        self.previous = {}
+        self._grow(64)
+
+    def _grow(self, capacity):
+        previous = {'alive': bool, 'vehicle_id': np.int64, 'lane': np.int32, 'position': np.float64,
+                    'speed': np.float64, 'crossed': bool, 'at_stop_line': bool}
+        for name, dtype in previous.items():
+            array = np.zeros(capacity, dtype=dtype)
+            if name in self.previous:
+                array[:self.capacity] = self.previous[name]
+            self.previous[name] = array
+        self.capacity = capacity
+
+    def record(self, time, event, vehicle_ids, lanes, positions, speeds):
+        """Add records of the same event for several vehicles."""
+        count = len(vehicle_ids)
+        start = 0
+        while start < count:
+            if self.buffered == len(self.buffer):
+                self.flush()
+            end = min(count, start + len(self.buffer) - self.buffered)
+            records = self.buffer[self.buffered:self.buffered + end - start]
+            records['time'] = time
+            records['event'] = eventNumbers[event]
+            records['vehicle_id'] = vehicle_ids[start:end]
+            records['lane'] = lanes[start:end]
+            records['position'] = positions[start:end]
+            records['speed'] = speeds[start:end]
+            self.buffered += end - start
+            start = end
+
+    def observe(self, vehicles, sim_time):
+        """
+        Record the events of the vehicles of a store since the previous call, once per tick after they moved.
+
+        Parameters:
+        vehicles (VehicleStore): The vehicles.
+        sim_time (float): Current simulated time.
+        """
+        n = vehicles.size
+        if n > self.capacity:
+            self._grow(max(n, 2 * self.capacity))
+        previous = {name: array[:n] for name, array in self.previous.items()}
+        alive = vehicles.alive[:n]
+        vehicle_id = vehicles.vehicle_id[:n]
+        lane = vehicles.lane[:n]
+        position = vehicles.position[:n]
+        speed = vehicles.speed[:n]
+        crossed = vehicles.crossed[:n]
+        at_stop_line = alive & ~crossed & (position + vehicles.front_offset[:n] >= vehicles.stop_position[:n])
+        moving = speed > STOP_SPEED
+        was_moving = previous['speed'] > STOP_SPEED
+
+        # A row holds the same vehicle as on the previous tick, or a new one if it was killed and reused (or handed
+        # off to the next intersection of a network, with the same id on another lane)
+        same = previous['alive'] & alive & (previous['vehicle_id'] == vehicle_id) & (previous['lane'] == lane)
+        killed = np.flatnonzero(previous['alive'] & ~same)
+        self.record(sim_time, 'kill', previous['vehicle_id'][killed], previous['lane'][killed],
+                    previous['position'][killed], previous['speed'][killed])
+        for event, mask in (('spawn', alive & ~same), ('stop_line', same & at_stop_line & ~previous['at_stop_line']),
+                            ('stop', same & ~moving & was_moving), ('start', same & moving & ~was_moving),
+                            ('cross', same & crossed & ~previous['crossed'])):
+            rows = np.flatnonzero(mask)
+            self.record(sim_time, event, vehicle_id[rows], lane[rows], position[rows], speed[rows])
+
+        if self.sample_interval is not None and sim_time >= self.next_sample_time:
+            self.next_sample_time += self.sample_interval
+            rows = np.flatnonzero(alive)
+            self.record(sim_time, 'position', vehicle_id[rows], lane[rows], position[rows], speed[rows])
+
+        for name, array in (('alive', alive), ('vehicle_id', vehicle_id), ('lane', lane), ('position', position),
+                            ('speed', speed), ('crossed', crossed), ('at_stop_line', at_stop_line)):
+            previous[name][:] = array
+
+    def flush(self):
+        """Append the buffered records to the file."""
+        with open(self.filename, 'ab') as file:
+            self.buffer[:self.buffered].tofile(file)
+        self.written += self.buffered
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_events(filename):
+    """
+    Map a file written by an EventRecorder to memory, without reading it.
+
+    Returns:
+    np.memmap: The records (recordType), e.g. events[events['event'] == eventNumbers['cross']].
+    """
+    return np.memmap(filename, dtype=recordType, mode='r')
@@ -0,0 +1,132 @@
+import numpy as np
+import pygame
+
+from simulation import (green_signal_image, intersection_image, noOfSignals, red_signal_image, rotations,
+                        signalCords, vehicleImages, yellow_signal_image)
+
+RENDER_FPS = 50  # Default frame rate of the window, independent of the physics tick rate
+
+
+class Renderer:
+    """
+    Class to draw an intersection in a pygame window, at a small fraction of the cost of the simulation.
+
+    Images are converted to the display format and rotated once, then cached by vehicle type and direction or by
+    signal and state. Text surfaces are only rendered again when their value changes. Each frame, only the parts of
+    the screen that changed since the previous frame are redrawn and pushed to the display.
+    """
+
+    def __init__(self, screen_size=(1400, 1000), caption="SIMULATION"):
+        """Open the window."""
+        pygame.init()
+        self.black = (0, 0, 0)
+        self.white = (255, 255, 255)
+        self.screen = pygame.display.set_mode(screen_size)
+        self.screen_rect = self.screen.get_rect()
+        pygame.display.set_caption(caption)
+        self.font = pygame.font.Font(None, 30)
+        self.background = intersection_image.convert()
+        self.vehicle_images = {}  # Rotated images by (vehicle type, direction)
+        self.signal_images = {}  # Rotated images by (signal number, 'red', 'yellow' or 'green')
+        self.texts = {}  # (text, surface) by slot
+        self.drawn = None  # (image, rect, outlined) of each item drawn on the last frame, None before the first one
+
+    def vehicle_image(self, vehicle_type, direction):
+        """Return the image of a vehicle of the given type going in the given direction."""
+        key = (vehicle_type, direction)
+        if key not in self.vehicle_images:
+            image = vehicleImages[vehicle_type].convert_alpha()
+            self.vehicle_images[key] = pygame.transform.rotate(image, rotations[direction])
+        return self.vehicle_images[key]
+
+    def signal_image(self, signal_number, state):
+        """Return the image of a signal in the given state."""
+        key = (signal_number, state)
+        if key not in self.signal_images:
+            if state == 'yellow':
+                image = pygame.transform.rotate(yellow_signal_image.convert_alpha(), signal_number * 90)
+            else:
+                # Adjust the rotation angle for signals 0 and 2
+                image = {'red': red_signal_image, 'green': green_signal_image}[state].convert_alpha()
+                image = pygame.transform.rotate(image, (signal_number + 2) % noOfSignals * 270)
+            self.signal_images[key] = image
+        return self.signal_images[key]
+
+    def text(self, slot, text):
+        """Return the surface of a text, rendered again only when the text of its slot changed."""
+        cached = self.texts.get(slot)
+        if cached is None or cached[0] != text:
+            cached = (text, self.font.render(text, True, self.white, self.black))
+            self.texts[slot] = cached
+        return cached[1]
+
+    def draw(self, intersection, vehicles, debug_lines=(), debug_mode=False):
+        """
+        Draw a frame.
+
+        Parameters:
+        intersection (Intersection): The intersection, whose signals are drawn.
+        vehicles: Vehicle sprites to draw.
+        debug_lines (list): (position, text) of the debug texts.
+        debug_mode (bool): Whether to label the vehicles with their direction and outline their hit boxes.
+        """
+        # Items of the frame, in drawing order: (image, rect, outlined)
+        items = []
+        for i in range(noOfSignals):
+            if i != intersection.currentGreen:
+                state = 'red'
+            elif intersection.currentYellow == 1:
+                state = 'yellow'
+            else:
+                state = 'green'
+            image = self.signal_image(i, state)
+            items.append((image, image.get_rect(topleft=signalCords[i]), False))
+        vehicles = list(vehicles)
+        if vehicles:
+            # Boxes of all the vehicles at once, from their store, to leave out those queued off the screen
+            left, top, right, bottom = vehicles[0].vehicles.boxes(np.array([vehicle.row for vehicle in vehicles]))
+            visible = ((right > self.screen_rect.left) & (left < self.screen_rect.right)
+                       & (bottom > self.screen_rect.top) & (top < self.screen_rect.bottom))
+            for index in np.flatnonzero(visible).tolist():
+                vehicle = vehicles[index]
+                x, y = left[index], top[index]
+                items.append((vehicle.image, vehicle.image.get_rect(topleft=(x, y)), debug_mode))
+                if debug_mode:
+                    # Display the direction of each vehicle
+                    image = self.text(vehicle.direction, vehicle.direction)
+                    items.append((image, image.get_rect(topleft=(x + 10, y - 20)), False))
+        for position, text in debug_lines:
+            image = self.text(position, text)
+            items.append((image, image.get_rect(topleft=position), False))
+
+        if self.drawn is None:
+            # First frame: draw everything
+            self.screen.blit(self.background, (0, 0))
+            for item in items:
+                self.draw_item(*item)
+            pygame.display.flip()
+        else:
+            self.draw_changes(items)
+        self.drawn = [(image, tuple(rect), outlined) for image, rect, outlined in items]
+
+    def draw_changes(self, items):
+        # Items that appeared, moved or changed image, and items that disappeared, need to be redrawn
+        current = {(image, tuple(rect), outlined) for image, rect, outlined in items}
+        previous = set(self.drawn)
+        dirty = [pygame.Rect(rect) for image, rect, outlined in current.symmetric_difference(previous)]
+        if not dirty:
+            return
+        # Each changed area is drawn again on its own, clipped to it, with the items overlapping it
+        rects = [rect for image, rect, outlined in items]
+        for area in dirty:
+            self.screen.set_clip(area)
+            self.screen.blit(self.background, area, area)
+            for index in area.collidelistall(rects):
+                self.draw_item(*items[index])
+        self.screen.set_clip(None)
+        pygame.display.update(dirty)
+
+    def draw_item(self, image, rect, outlined):
+        self.screen.blit(image, rect)
+        if outlined:
+            pygame.draw.rect(self.screen, (255, 0, 0), rect, 2)
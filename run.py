@@ -1,29 +1,49 @@
+from batch import run_batch, summarize, summarize_differences
 from simulation import RunSimulation
 
+
+def print_summary(summary):
+    # Print the averages and their 95% confidence intervals for all variables
+    for key, value in summary.items():
+        low, high = value['ci']
+        print(f"{key}: {value['mean']} (95% CI: {low} - {high})")
+
+
 if __name__ == "__main__":
     total_vehicles_to_cross = 20  # Number of vehicles to cross in each simulation
     simulation_speed = 10  # Speed factor for the simulation
     traffic_density = 0.3  # Density of traffic (ranges from 0.1 to 1)
     num_simulations = 2  # Number of simulations to run
     direction_priority = [1, 0, 1, 0]  # Direction priority array (0: Down, 1: Left, 2: Up, 3: Right) (0 to 1)
-    simulation_results = []  # List to store results of each simulation
-
-    # Run multiple simulations
-    for _ in range(num_simulations):
-        simulation_instance = RunSimulation(total_vehicles_to_cross, simulation_speed, traffic_density,
-                                            direction_priority, traffic_light_policy="optimal")  # normal or optimal
-        results = simulation_instance.get_results()
-        simulation_results.append(results)
-
-    # Calculate the averages for all variables across simulations
-    total_results_sum = {key: 0 for key in simulation_results[0].keys()}
-    for result in simulation_results:
-        for key, value in result.items():
-            total_results_sum[key] += value  # Accumulate sum for each variable
+    traffic_light_policy = "optimal"  # normal or optimal
+    headless = False  # Run without a window, as fast as possible, in parallel on all the CPU cores
+    seed = 0  # Seed of the first simulation (None for random ones), the next ones use seed + 1, seed + 2...
+    compare_with = None  # Other policy run on the same seeds (the same vehicles), to compare it with, e.g. "normal"
 
-    # Calculate averages from the total sums
-    averages = {key: value / num_simulations for key, value in total_results_sum.items()}
+    policies = [traffic_light_policy] if compare_with is None else [traffic_light_policy, compare_with]
+    seeds = [None if seed is None else seed + i for i in range(num_simulations)]
+    if headless:
+        # Run the simulations in parallel
+        parameter_sets = [{'total_vehicles_to_cross': total_vehicles_to_cross, 'simulation_speed': simulation_speed,
+                           'traffic_density': traffic_density, 'direction_priority': direction_priority,
+                           'traffic_light_policy': policy, 'seed': run_seed}
+                          for policy in policies for run_seed in seeds]
+        results, _ = run_batch(parameter_sets)
+    else:
+        # Run the simulations one after the other in a window
+        results = []  # List to store results of each simulation
+        for policy in policies:
+            for run_seed in seeds:
+                simulation_instance = RunSimulation(total_vehicles_to_cross, simulation_speed, traffic_density,
+                                                    direction_priority, policy, seed=run_seed)
+                results.append(simulation_instance.get_results())
+    simulation_results = results[:num_simulations]
 
-    # Print the averages for all variables
-    for key, value in averages.items():
-        print(f"{key}: {value}")
+    print_summary(summarize(simulation_results))
+    if compare_with is not None:
+        print(f"\n{compare_with}:")
+        print_summary(summarize(results[num_simulations:]))
+        if seed is not None:
+            # Same seeds, so the runs of both policies are paired
+            print(f"\n{traffic_light_policy} - {compare_with}, on the same vehicles:")
+            print_summary(summarize_differences(simulation_results, results[num_simulations:]))
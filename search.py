@@ -0,0 +1,234 @@
+import glob
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+
+import numpy as np
+
+from batch import run_simulation, summarize
+from controllers import load_model
+
+MODELS_FOLDER = 'modele ML'
+BEST_MODEL_FILE = os.path.join(MODELS_FOLDER, 'bestModel.txt')
+CACHE_FILE = os.path.join(MODELS_FOLDER, 'search_cache.json')
+OBJECTIVE = 'average_crossing_time'  # Result of the simulations minimized by the search
+
+# Ranges of the parameters of a model explored by the search, covering those of the model files. The other
+# parameters (learning rate, rewards) don't change how the signals are controlled, so they are kept from the base model.
+SEARCH_SPACE = {'min_green_time': (5, 75), 'max_green_time': (5, 120), 'low': (0, 65), 'high': (1, 95)}
+
+# Parameters of the headless simulations evaluating a model (see batch.DEFAULT_PARAMETERS)
+EVALUATION_PARAMETERS = {'total_vehicles_to_cross': 100, 'simulation_speed': 10, 'traffic_density': 0.3,
+                         'direction_priority': [1, 1, 1, 1]}
+
+
+def load_models(folder=MODELS_FOLDER):
+    """
+    Load the models of a folder.
+
+    Returns:
+    dict: The models, by file name.
+    """
+    return {os.path.basename(filename): load_model(filename)
+            for filename in sorted(glob.glob(os.path.join(folder, '*.txt')))}
+
+
+def model_vector(model):
+    """Return the searched parameters of a model, scaled to [0, 1]."""
+    values = [model['min_green_time'], model['max_green_time'], model['traffic_thresholds']['low'],
+              model['traffic_thresholds']['high']]
+    return np.array([(value - low) / (high - low) for value, (low, high) in zip(values, SEARCH_SPACE.values())])
+
+
+def vector_model(vector, base_model):
+    """Return the model with the searched parameters of a vector (see model_vector), the others of base_model."""
+    min_green_time, max_green_time, low, high = [
+        int(round(low + min(max(value, 0), 1) * (high - low)))
+        for value, (low, high) in zip(vector, SEARCH_SPACE.values())]
+    model = dict(base_model)
+    model['min_green_time'] = min_green_time
+    model['max_green_time'] = max(max_green_time, min_green_time)
+    model['traffic_thresholds'] = {'low': low, 'high': max(high, low + 1)}
+    return model
+
+
+def bayesian_vectors(rng, history, num_vectors, gamma=0.25, bandwidth=0.15, num_samples=64):
+    """
+    Propose the vectors to evaluate next with a tree-structured Parzen estimator: the observed vectors are split
+    into the best gamma of them and the others, each modelled by a mix of gaussians around its vectors, and the
+    samples drawn around the best vectors that are the most likely among them compared to the others are kept.
+
+    Parameters:
+    rng (np.random.Generator): Random generator.
+    history (list): (vector, score) of the evaluated models, lower scores being better.
+    num_vectors (int): Number of vectors to propose.
+
+    Returns:
+    list: The vectors.
+    """
+    history = sorted(history, key=lambda item: item[1])
+    vectors = np.array([vector for vector, score in history])
+    num_good = max(1, int(math.ceil(gamma * len(vectors))))
+    good, bad = vectors[:num_good], vectors[num_good:]
+    samples = good[rng.integers(0, len(good), num_samples)] + rng.normal(0, bandwidth, (num_samples, vectors.shape[1]))
+    samples = np.clip(samples, 0, 1)
+
+    def density(points, centers):
+        # Mean of the gaussians centered on the centers, at each point
+        distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-distances / (2 * bandwidth ** 2)).mean(axis=1) + 1e-12
+
+    ratio = density(samples, good) / (density(samples, bad) if len(bad) else 1)
+    return list(samples[np.argsort(-ratio)[:num_vectors]])
+
+
+class Search:
+    """
+    Class to search the model of the 'modele ML' folder giving the lowest OBJECTIVE, by evaluating models with
+    headless simulations run in parallel.
+
+    Each model runs on the same seeds, round after round of seeds_per_round seeds, and after each round the models
+    clearly worse than the best one (their 95% confidence interval entirely above its own) are dropped. The score of
+    each model on each seed is cached in a JSON file by hash of the model and of the simulation parameters, so a
+    search run again skips the simulations already done.
+    """
+
+    def __init__(self, seeds=10, seeds_per_round=3, processes=None, cache_file=CACHE_FILE,
+                 simulation_parameters=None):
+        """
+        Initialize the search.
+
+        Parameters:
+        seeds (int): Number of seeds a model is evaluated on, unless it is dropped before.
+        seeds_per_round (int): Number of seeds evaluated before dropping the clearly worse models.
+        processes (int): Number of worker processes, all the CPU cores by default.
+        cache_file (str): Name of the cache file, None not to cache the scores.
+        simulation_parameters (dict): Parameters of the simulations, EVALUATION_PARAMETERS by default.
+        """
+        self.seeds = list(range(seeds))
+        self.seeds_per_round = seeds_per_round
+        self.processes = processes
+        self.cache_file = cache_file
+        self.simulation_parameters = EVALUATION_PARAMETERS if simulation_parameters is None else simulation_parameters
+        self.cache = {}  # {'model', 'scores': {seed: score}} by model key
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, 'r') as file:
+                self.cache = json.load(file)
+
+    def model_key(self, model):
+        """Return the hash of a model and of the simulation parameters evaluating it."""
+        description = json.dumps([model, self.simulation_parameters], sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def scores(self, model):
+        """Return the scores of a model on the seeds it was evaluated on so far."""
+        entry = self.cache.get(self.model_key(model), {'scores': {}})
+        return [score for seed, score in entry['scores'].items() if int(seed) in self.seeds]
+
+    def save_cache(self):
+        if self.cache_file is not None:
+            with open(self.cache_file, 'w') as file:
+                json.dump(self.cache, file)
+
+    def evaluate(self, models, pool):
+        """
+        Evaluate models, round after round of seeds, dropping the clearly worse ones after each round.
+
+        Parameters:
+        models (list): The models.
+        pool (multiprocessing.Pool): Pool running the simulations.
+
+        Returns:
+        list: The models evaluated on all the seeds.
+        """
+        remaining = {self.model_key(model): model for model in models}
+        for key, model in remaining.items():
+            self.cache.setdefault(key, {'model': model, 'scores': {}})
+        for start in range(0, len(self.seeds), self.seeds_per_round):
+            seeds = self.seeds[start:start + self.seeds_per_round]
+            jobs = [(key, seed) for key in remaining for seed in seeds
+                    if str(seed) not in self.cache[key]['scores']]
+            parameter_sets = [{**self.simulation_parameters, 'model': remaining[key], 'seed': seed}
+                              for key, seed in jobs]
+            for (key, seed), result in zip(jobs, pool.map(run_simulation, parameter_sets, chunksize=1)):
+                self.cache[key]['scores'][str(seed)] = result[OBJECTIVE]
+            self.save_cache()
+
+            # Drop the models whose confidence interval is entirely above that of the best one
+            intervals = {key: summarize([{OBJECTIVE: score} for score in self.scores(model)])[OBJECTIVE]['ci']
+                         for key, model in remaining.items()}
+            best_high = min((high for low, high in intervals.values() if not math.isnan(high)), default=math.inf)
+            remaining = {key: model for key, model in remaining.items() if not intervals[key][0] > best_high}
+        return list(remaining.values())
+
+    def best(self):
+        """
+        Return the best model evaluated on all the seeds so far.
+
+        Returns:
+        dict: The model, None if there is none.
+        float: Its mean score.
+        """
+        best_model, best_score = None, math.inf
+        for entry in self.cache.values():
+            scores = self.scores(entry['model'])
+            if len(scores) == len(self.seeds):
+                score = sum(scores) / len(scores)
+                if score < best_score:
+                    best_model, best_score = entry['model'], score
+        return best_model, best_score
+
+    def run(self, method='bayesian', num_candidates=20, batch_size=4, include_files=True, seed=0,
+            best_file=BEST_MODEL_FILE):
+        """
+        Run the search and write the best model to best_file.
+
+        Parameters:
+        method (str): 'random' to draw the candidates at random, 'bayesian' to draw each batch of candidates from
+                      the results of the previous ones (see bayesian_vectors).
+        num_candidates (int): Number of new models drawn.
+        batch_size (int): Number of models drawn and evaluated together.
+        include_files (bool): Whether to evaluate the models of the 'modele ML' folder first.
+        seed: Seed of the random generator drawing the models.
+        best_file (str): File the best model is written to, None not to write it.
+
+        Returns:
+        dict: The best model.
+        float: Its mean score.
+        """
+        rng = np.random.default_rng(seed)
+        base_model = load_model(BEST_MODEL_FILE)
+        with multiprocessing.Pool(self.processes) as pool:
+            if include_files:
+                self.evaluate(list(load_models().values()), pool)
+            drawn = 0
+            while drawn < num_candidates:
+                count = min(batch_size, num_candidates - drawn)
+                history = [(model_vector(entry['model']), sum(scores) / len(scores))
+                           for entry in self.cache.values() for scores in [self.scores(entry['model'])] if scores]
+                if method == 'bayesian' and len(history) >= 2 * batch_size:
+                    vectors = bayesian_vectors(rng, history, count)
+                else:
+                    vectors = list(rng.random((count, len(SEARCH_SPACE))))
+                self.evaluate([vector_model(vector, base_model) for vector in vectors], pool)
+                drawn += count
+
+        best_model, best_score = self.best()
+        if best_model is not None and best_file is not None:
+            with open(best_file, 'w') as file:
+                file.write(repr(best_model))
+        return best_model, best_score
+
+
+if __name__ == "__main__":
+    method = "bayesian"  # random or bayesian
+    num_candidates = 20  # Number of new models drawn
+    seeds = 10  # Number of seeds each model is evaluated on
+
+    search = Search(seeds=seeds)
+    model, score = search.run(method=method, num_candidates=num_candidates, seed=random.randrange(2 ** 32))
+    print(f"Best model: {model}")
+    print(f"{OBJECTIVE}: {score}")
@@ -0,0 +1,60 @@
+import asyncio
+import random
+import time
+
+from server import CounterServer
+
+
+async def camera(host, port, camera_id, num_messages, interval, rng):
+    """
+    Simulate a camera: connect to the server and send num_messages counts, one every interval seconds on average.
+    """
+    _, writer = await asyncio.open_connection(host, port)
+    count = 0
+    for _ in range(num_messages):
+        count = max(0, count + rng.choice((-1, 0, 1)))
+        writer.write(f"{camera_id} {time.time():.3f} {count}\n".encode())
+        if interval:
+            await asyncio.sleep(rng.uniform(0, 2 * interval))
+        else:
+            await writer.drain()
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_load(num_cameras, num_messages, interval=0, num_intersections=None, seed=0):
+    """
+    Start a CounterServer on a local port and connect num_cameras cameras to it, in the same event loop, each
+    sending num_messages counts for an approach of one of num_intersections intersections.
+
+    Returns:
+    dict: The number of 'messages' received by the server, the 'seconds' it took and the 'messages_per_second'.
+    """
+    rng = random.Random(seed)
+    server = CounterServer('127.0.0.1', 0)
+    server_task = asyncio.create_task(server.serve())
+    while not server.ready.is_set():
+        await asyncio.sleep(0)
+    if num_intersections is None:
+        num_intersections = max(1, num_cameras // 4)
+
+    start = time.perf_counter()
+    total = num_cameras * num_messages
+    await asyncio.gather(*(camera('127.0.0.1', server.port, f"{i // 4 % num_intersections}:{i % 4}", num_messages,
+                                  interval, rng) for i in range(num_cameras)))
+    while server.messages < total and server.connections > 0:
+        await asyncio.sleep(0.001)
+    seconds = time.perf_counter() - start
+    server_task.cancel()
+    return {'messages': server.messages, 'seconds': seconds, 'messages_per_second': server.messages / seconds}
+
+
+if __name__ == "__main__":
+    num_cameras = 2000  # Number of cameras connected at once
+    num_messages = 50  # Number of counts sent by each camera
+    interval = 0.01  # Average seconds between two counts of a camera (0 to send as fast as possible)
+
+    results = asyncio.run(run_load(num_cameras, num_messages, interval))
+    print(f"{results['messages']} messages in {results['seconds']:.2f} seconds: "
+          f"{results['messages_per_second']:.0f} messages per second")
@@ -1,33 +1,208 @@
-import socket
+import argparse
+import asyncio
 import threading
+import time
 
-def handle_client(clientsocket, address):
+PORT = 5000
+DIRECTIONS = {'down': 0, 'left': 1, 'up': 2, 'right': 3}  # Direction numbers of the simulation
+MAX_LINE_LENGTH = 256  # Longer lines are dropped, as well as the connection sending them
+
+
+class CameraState:
+    """State of a camera: its last count, the time it was counted at (sent by the camera) and received at."""
+    __slots__ = ('count', 'timestamp', 'received', 'messages')
+
+    def __init__(self):
+        self.count = 0
+        self.timestamp = 0.0
+        self.received = 0.0
+        self.messages = 0
+
+
+class CounterProtocol(asyncio.Protocol):
+    """
+    Protocol of a camera connection: newline-delimited messages "camera_id timestamp count", e.g.
+    "A:right 1718000000.25 4\\n". A message with only a count (sent by older clients) is the count of a camera named
+    after the address of the connection, counted when it is received.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.buffer = b''
+        self.peer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        host, port = transport.get_extra_info('peername')[:2]
+        self.peer = f"{host}:{port}"
+        self.server.transports.add(transport)
+        self.server.connections += 1
+
+    def connection_lost(self, exc):
+        # Older clients send a single count without a newline, then close the connection
+        if self.buffer:
+            self.handle_line(self.buffer, time.time())
+        self.server.transports.discard(self.transport)
+        self.server.connections -= 1
+
+    def data_received(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        if len(self.buffer) > MAX_LINE_LENGTH:
+            self.buffer = b''
+            self.transport.close()
+            return
+        received = time.time()
+        for line in lines:
+            self.handle_line(line, received)
+
+    def handle_line(self, line, received):
+        fields = line.split()
+        try:
+            if len(fields) == 3:
+                self.server.update(fields[0].decode(), float(fields[1]), int(fields[2]), received)
+            elif len(fields) == 1:
+                self.server.update(self.peer, received, int(fields[0]), received)
+            else:
+                self.server.invalid_messages += 1
+        except ValueError:
+            self.server.invalid_messages += 1
+
+
+class CounterServer:
+    """
+    Server receiving the vehicle counts of the cameras (see CounterProtocol), on one asyncio event loop so that
+    thousands of cameras can stay connected at once.
+
+    It keeps the last count of each camera, and of each approach of each intersection: a camera named
+    "intersection:direction" (e.g. "A:right", or "A:3") counts the vehicles of that approach, other cameras can be
+    mapped to an approach with the cameras parameter. A signal controller reads them with approach_counts, while the
+    server runs in a thread of its own (see start).
+    """
+
+    def __init__(self, host='', port=PORT, cameras=None, record=None):
+        """
+        Initialize the server.
+
+        Parameters:
+        host (str): Address to listen on, all the interfaces by default.
+        port (int): Port to listen on, 0 for any free port.
+        cameras (dict): (intersection, direction number) by camera id, for the cameras not named after their approach.
+        record (str): File to record the counts to, one message per line as received, to replay them later (see
+                      bridge.replay_counts).
+        """
+        self.host = host
+        self.port = port
+        self.cameras = {} if cameras is None else dict(cameras)
+        self.camera_states = {}  # CameraState by camera id
+        self.approaches = {}  # Last count of each direction number, by intersection
+        self.approach_times = {}  # Time each of these counts was counted at, by intersection
+        self.approach_received = {}  # Time each of these counts was received at, by intersection
+        self.transports = set()  # Transports of the open connections
+        self.connections = 0
+        self.messages = 0
+        self.invalid_messages = 0
+        self.record = None if record is None else open(record, 'a', buffering=1)  # Line buffered, not to lose counts
+        self.server = None
+        self.loop = None
+        self.ready = threading.Event()
+
+    def approach_of(self, camera_id):
+        """Return the (intersection, direction number) counted by a camera, None if it is unknown."""
+        if camera_id not in self.cameras:
+            intersection, _, direction = camera_id.rpartition(':')
+            number = DIRECTIONS.get(direction, int(direction) if direction.isdigit() else None)
+            valid = intersection and number is not None and number < len(DIRECTIONS)
+            self.cameras[camera_id] = (intersection, number) if valid else None
+        return self.cameras[camera_id]
+
+    def update(self, camera_id, timestamp, count, received):
+        """Store a count sent by a camera, unless it is older than the last one."""
+        self.messages += 1
+        state = self.camera_states.get(camera_id)
+        if state is None:
+            state = self.camera_states[camera_id] = CameraState()
+        state.messages += 1
+        if timestamp < state.timestamp:
+            return
+        state.count = count
+        state.timestamp = timestamp
+        state.received = received
+        if self.record is not None:
+            self.record.write(f"{camera_id} {timestamp} {count}\n")
+        approach = self.approach_of(camera_id)
+        if approach is not None:
+            intersection, direction_number = approach
+            if intersection not in self.approaches:
+                self.approaches[intersection] = [0] * len(DIRECTIONS)
+                self.approach_times[intersection] = [0.0] * len(DIRECTIONS)
+                self.approach_received[intersection] = [0.0] * len(DIRECTIONS)
+            self.approaches[intersection][direction_number] = count
+            self.approach_times[intersection][direction_number] = timestamp
+            self.approach_received[intersection][direction_number] = received
+
+    def approach_counts(self, intersection):
+        """Return the last count of each direction number of an intersection (0 for those not counted yet)."""
+        return list(self.approaches.get(intersection, [0] * len(DIRECTIONS)))
+
+    async def serve(self):
+        """Listen and handle the connections until the server is closed (see stop) or the task is cancelled."""
+        self.loop = asyncio.get_running_loop()
+        self.server = await self.loop.create_server(lambda: CounterProtocol(self), self.host, self.port,
+                                                    backlog=4096)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass  # Stopped
+
+    def start(self):
+        """Run the server in a daemon thread, and return once it listens."""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), daemon=True)
+        thread.start()
+        self.ready.wait()
+        return thread
+
+    def close(self):
+        """Stop listening and close the open connections."""
+        self.server.close()
+        for transport in list(self.transports):
+            transport.close()
+        if self.record is not None:
+            self.record.flush()
+
+    def stop(self):
+        """Stop a server started with start."""
+        if self.server is not None:
+            self.loop.call_soon_threadsafe(self.close)
+
+
+def start_server(verbose=False):
     '''
-    Displays data received from the client.
+    Starts the counter server and prints a summary of the traffic every second: cameras, connections and messages
+    received. With thousands of cameras, printing every count would flood the output.
 
     Parameters:
-    clientsocket (socket.socket): The client socket object.
-    address (tuple): The client address (host, port).
+    verbose (bool): Whether to also print the count of every camera every second.
     '''
+    server = CounterServer()
+    server.start()
+    print(f'Server is now running on port {server.port}...')
+    messages = 0
     while True:
-        data = clientsocket.recv(1024).decode("utf-8")
-        if not data:
-            break
-        print(f"{data}")
+        time.sleep(1)
+        if verbose:
+            for camera_id, state in list(server.camera_states.items()):
+                print(f"{camera_id}: {state.count}")
+        print(f"{len(server.camera_states)} cameras, {server.connections} connections, "
+              f"{server.messages - messages} messages per second")
+        messages = server.messages
 
-def start_server():
-    '''
-    Starts a TCP server by creating a socket connection.
-    '''
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind(('', 5000))
-    server_socket.listen(5)
-    print('Server is now running...')
-
-    while True:
-        clientsocket, address = server_socket.accept()       
-        client_thread = threading.Thread(target=handle_client, args=(clientsocket, address))
-        client_thread.start()
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Receive the counts of the cameras.")
+    parser.add_argument('--verbose', action='store_true', help="print the count of every camera every second")
+    args = parser.parse_args()
+    start_server(args.verbose)
@@ -1,24 +1,24 @@
-import random
-import time
-import threading
+import numpy as np
 import pygame
 import pickle
 import sys
 
+from arrivals import ArrivalStream, load_arrivals
+from collisions import ConflictDetector
+from metrics import QUANTILES, CrossingMetrics
+
 # Constants
 FPS = 500
+DT = 1 / FPS  # Default tick length of the engine (wall-clock seconds one frame stands for)
 DELAY_TIME = 1000
 MIN_GREEN_TIME = 5  # Minimum green time for each signal
 YELLOW_TIME = 3  # Yellow time for each signal after green
 SWITCH_DELAY = 2  # Delay before switching to the next green light (all signals are red)
 TRAFFIC_DENSITY = 0.3  # Default traffic density
+BRAKING_DISTANCE = 150  # Distance to the vehicle in front under which a vehicle slows down
+STOPPING_DISTANCE = 10  # Distance to the vehicle in front under which a vehicle stops
 
 # Global Variables
-signals = []  # List to store traffic signals
-laneGroups = {}  # Dictionary to store vehicles in each lane
-currentGreen = 0  # Index indicating which signal is currently green
-nextGreen = 0  # Index indicating which signal will turn green next
-currentYellow = 0  # Indicates whether yellow signal is on or off
 vehicleTypes = {0: 'car', 1: 'truck', 2: 'taxi', 3: 'bike'}  # Types of vehicles
 directionNumbers = {0: 'down', 1: 'left', 2: 'up', 3: 'right'}  # Directions of vehicles
 acceleration = {'car': 0.0005, 'truck': 0.0003, 'taxi': 0.0005, 'bike': 0.0008}  # Acceleration of vehicles
@@ -27,10 +27,8 @@ y = {'right': [510], 'down': [-400], 'left': [420], 'up': [1400]}  # Y-coordinat
 speeds = {'car': 0.3, 'truck': 0.29, 'taxi': 0.32, 'bike': 0.35}  # speeds of vehicles
 stopLines = {'right': 480, 'down': 280, 'left': 920, 'up': 720}  # Stop lines for vehicles
 defaultStop = {'right': 570, 'down': 360, 'left': 840, 'up': 638}  # Threshold for vehicles to cross the intersection
-total_crossed_vehicles = 0  # Total number of crossed vehicles
-vehicle_counter = 0  # Counter for total spawned vehicles
-vehicle_spawned_counter = 0  # Counter for vehicles spawned in the simulation
-vehicle_kill_counter = 0  # Counter for vehicles kill in the simulation
+limits = {'right': 1600, 'down': 1600, 'left': -200, 'up': -200}  # Coordinates past which vehicles are killed
+rotations = {'right': 0, 'down': 270, 'left': 180, 'up': 90}  # Rotation of the vehicles' images
 noOfSignals = 4  # Number of traffic signals
 signalCords = [(572, 340), (770, 375), (795, 535), (535, 590)]  # Coordinates for signals
 
@@ -43,6 +41,30 @@ red_signal_image = pygame.image.load('images/signals/red.png')
 yellow_signal_image = pygame.image.load('images/signals/yellow.png')
 green_signal_image = pygame.image.load('images/signals/green.png')
 intersection_image = pygame.image.load('images/intersection.png')
+vehicleImages = {'car': car_image, 'truck': truck_image, 'taxi': taxi_image, 'bike': bike_image}
+
+# Per-direction lane geometry, indexed by direction number. A vehicle's position is the coordinate of the top-left
+# corner of its sprite along its direction of travel (x for 'right', -x for 'left', y for 'down', -y for 'up'), so it
+# always increases as the vehicle moves forward.
+laneSigns = np.array([1, -1, -1, 1])
+laneAxes = np.array([1, 0, 1, 0])  # 0 when the lane runs along x, 1 along y
+frontOffsets = np.array([1, 0, 0, 1])  # Vehicle lengths between the position and the front of the vehicle
+startPositions = np.array([laneSigns[i] * (x, y)[laneAxes[i]][directionNumbers[i]][0] for i in directionNumbers])
+stopPositions = np.array([laneSigns[i] * stopLines[directionNumbers[i]] for i in directionNumbers])
+crossPositions = np.array([laneSigns[i] * defaultStop[directionNumbers[i]] for i in directionNumbers])
+limitPositions = np.array([laneSigns[i] * limits[directionNumbers[i]] for i in directionNumbers])
+laneOffsets = np.array([(x, y)[1 - laneAxes[i]][directionNumbers[i]][0] for i in directionNumbers])  # Across the lane
+# Junction box between the stop lines of the four approaches, left by a vehicle at the stop line of the opposite one
+exitPositions = np.array([laneSigns[i] * stopLines[directionNumbers[(i + 2) % noOfSignals]] for i in directionNumbers])
+# Points of the leader and the follower used to measure the distance between them (in vehicle lengths)
+leaderOffsets = np.array([0, 0.5, 0.5, 0])
+followerOffsets = np.array([0.5, 0, 0, 0.5])
+
+# Per-type vehicle parameters, indexed by type number
+typeSpeeds = np.array([speeds[vehicleTypes[i]] for i in vehicleTypes])
+typeAccelerations = np.array([acceleration[vehicleTypes[i]] for i in vehicleTypes])
+typeLengths = np.array([vehicleImages[vehicleTypes[i]].get_width() for i in vehicleTypes])
+typeWidths = np.array([vehicleImages[vehicleTypes[i]].get_height() for i in vehicleTypes])
 
 
 class TrafficSignal:
@@ -63,427 +85,562 @@ class TrafficSignal:
         self.vehicles_in_front = 0
 
 
-class Vehicle(pygame.sprite.Sprite):
-    """Class to represent a vehicle."""
-
-    def __init__(self, vehicle_type, direction_number, direction, simulation_speed, simulation_instance):
-        """Initialize the vehicle."""
-        super().__init__()
-        self.simulation_instance = simulation_instance
-        self.flag = False
-        self.simulation_speed = simulation_speed
-        self.cross_time = None
-        self.spawn_time = time.time()
-        self.hit_box = None
-        self.direction_number = direction_number
-        self.vehicle_type = vehicle_type
-        self.crossed = False
-        self.acceleration = acceleration[vehicle_type]
-        self.vehicle_in_front = None
-
-        # Load vehicle image based on the type
-        if vehicle_type == 'car':
-            self.image = pygame.image.load('images/vehicles/car.png')
-        elif vehicle_type == 'truck':
-            self.image = pygame.image.load('images/vehicles/truck.png')
-        elif vehicle_type == 'taxi':
-            self.image = pygame.image.load('images/vehicles/taxi.png')
-        elif vehicle_type == 'bike':
-            self.image = pygame.image.load('images/vehicles/bike.png')
-
-        self.original_image = self.image  # Store the original image for rotation
-        self.rect = self.image.get_rect()
-
-        # Set the initial position based on the direction
-        if direction == 'right':
-            self.x = x['right'][0]
-            self.y = y['right'][0]
-            self.rotation = 0
-        elif direction == 'down':
-            self.x = x['down'][0]
-            self.y = y['down'][0]
-            self.rotation = 270
-        elif direction == 'left':
-            self.x = x['left'][0]
-            self.y = y['left'][0]
-            self.rotation = 180
-        elif direction == 'up':
-            self.x = x['up'][0]
-            self.y = y['up'][0]
-            self.rotation = 90
-
-        self.image = pygame.transform.rotate(self.original_image, self.rotation)
-        self.direction = direction
-        self.speed = speeds[vehicle_type]
-        self.stop = stopLines[direction]
-        self.defaultStop = defaultStop[direction]
-        self.colliding = False  # Flag to indicate if a collision occurred
-        self._create_hit_box()
-
-        # Add the vehicle to the appropriate lane group
-        laneGroups[self.direction].add(self)
-
-    def _create_hit_box(self):
-        # Create a hit_box based on the rotated image
-        self.hit_box = self.image.get_rect()
-        self.hit_box.x = self.x
-        self.hit_box.y = self.y
-
-    # return the vehicle which is in front of the current vehicle
-    def check_collision_with_vehicles(self):
-        # Check for collision with other vehicles
-        for vehicle in laneGroups[self.direction]:
-            if vehicle != self:
-                if self.hit_box.colliderect(vehicle.hit_box):
-                    if self.get_collision_direction(vehicle) == 'front':
-                        self.vehicle_in_front = vehicle
-                        return True
-                    else:
-                        pass
-        return False
-
-    def check_reach_stop_line(self):
-        # Determine if the vehicle has reached the stop line:
-        if self.direction == 'right' and self.x + self.hit_box.width >= stopLines[self.direction]:
-            return True
-        elif self.direction == 'down' and self.y + self.hit_box.height >= stopLines[self.direction]:
-            return True
-        elif self.direction == 'left' and self.x <= stopLines[self.direction]:
-            return True
-        elif self.direction == 'up' and self.y <= stopLines[self.direction]:
-            return True
-
-    def check_crossed(self):
-        # Determine if the vehicle has crossed the intersection (default stop line):
-        if self.direction == 'right' and self.x + self.hit_box.width > defaultStop[self.direction]:
-            return True
-        elif self.direction == 'down' and self.y + self.hit_box.height > defaultStop[self.direction]:
-            return True
-        elif self.direction == 'left' and self.x < defaultStop[self.direction]:
-            return True
-        elif self.direction == 'up' and self.y < defaultStop[self.direction]:
-            return True
-
-    def update(self):
-        global total_crossed_vehicles
-
-        if self.check_reach_stop_line() and self.crossed is False:
-            if self.direction_number != currentGreen:
-                # Harsh braking when reaching a red signal at the stop line
-                self.speed *= 0.99
-                # If the signal is red, stop the vehicle just before the default stop line
-                if self.direction == 'right' and self.x + self.hit_box.width > defaultStop[self.direction]:
-                    self.x = defaultStop[self.direction] - self.hit_box.width
-                elif self.direction == 'down' and self.y + self.hit_box.height > defaultStop[self.direction]:
-                    self.y = defaultStop[self.direction] - self.hit_box.height
-                elif self.direction == 'left' and self.x < defaultStop[self.direction]:
-                    self.x = defaultStop[self.direction]
-                elif self.direction == 'up' and self.y < defaultStop[self.direction]:
-                    self.y = defaultStop[self.direction]
-            else:
-                # Adjust the speed based on acceleration
-                if self.speed < speeds[self.vehicle_type]:
-                    self.speed += self.acceleration * 2 * self.simulation_speed
+class VehicleStore:
+    """Struct-of-arrays state of all the vehicles of a simulation, updated in batch every tick."""
+
+    def __init__(self, capacity=64, lanes=noOfSignals):
+        """
+        Initialize an empty store; rows of killed vehicles are reused by the next spawned ones.
+
+        Lane l runs in the direction number l % noOfSignals, so one store can hold the lanes of several
+        intersections.
+        """
+        self.capacity = 0
+        self.size = 0  # Number of rows in use, dead ones included
+        self.lanes = lanes
+        self.free_rows = []
+        self.position = np.zeros(0)
+        self.speed = np.zeros(0)
+        self.max_speed = np.zeros(0)
+        self.acceleration = np.zeros(0)
+        self.length = np.zeros(0)
+        self.width = np.zeros(0)
+        self.vehicle_id = np.zeros(0, dtype=np.int64)  # Number of the vehicle in the order of spawning
+        self.lane = np.zeros(0, dtype=np.int32)
+        self.direction = np.zeros(0, dtype=np.int8)
+        self.vehicle_type = np.zeros(0, dtype=np.int8)
+        self.crossed = np.zeros(0, dtype=bool)
+        self.alive = np.zeros(0, dtype=bool)
+        self.spawn_time = np.zeros(0)  # Time the vehicle entered the intersection
+        self.origin_time = np.zeros(0)  # Time the vehicle entered the simulation (differs in a network)
+        self.cross_time = np.zeros(0)
+        # Lane geometry of each row, looked up once when the vehicle is added
+        self.stop_position = np.zeros(0)
+        self.cross_position = np.zeros(0)
+        self.limit_position = np.zeros(0)
+        self.exit_position = np.zeros(0)
+        self.front_offset = np.zeros(0)  # From the position to the front of the vehicle
+        self.leader_offset = np.zeros(0)  # From the position to the point measured when the vehicle is a leader
+        self.follower_offset = np.zeros(0)  # From the position to the point measured when the vehicle is a follower
+        # Each lane is a queue ordered by position, linked through the rows of the vehicles in front and behind
+        self.leader = np.zeros(0, dtype=np.int64)
+        self.follower = np.zeros(0, dtype=np.int64)
+        self.lane_front = np.full(lanes, -1)  # Row of the first vehicle of each lane, -1 if the lane is empty
+        self.lane_rear = np.full(lanes, -1)  # Row of the last vehicle of each lane, -1 if the lane is empty
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        # Resize every array to the new capacity, keeping the existing rows
+        for name in ('position', 'speed', 'max_speed', 'acceleration', 'length', 'width', 'vehicle_id', 'lane',
+                     'direction', 'vehicle_type', 'crossed', 'alive', 'spawn_time', 'origin_time', 'cross_time',
+                     'stop_position', 'cross_position', 'limit_position', 'exit_position', 'front_offset', 'leader_offset',
+                     'follower_offset', 'leader', 'follower'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.size - len(self.free_rows)
+
+    def add(self, vehicle_id, type_number, lane, position, spawn_time, origin_time=None, speed=None):
+        """
+        Add a vehicle at the given position of a lane, at its maximum speed unless speed is given.
+
+        Returns:
+        int: The row of the vehicle in the store.
+        """
+        if self.free_rows:
+            row = self.free_rows.pop()
         else:
-            # If not at the stop line or the signal is green, keep moving
-            # Adjust the speed based on acceleration
-            if self.speed < speeds[self.vehicle_type]:
-                self.speed += self.acceleration * 2 * self.simulation_speed
-
-            self.get_vehicle_in_front()
-
-            # If a vehicle is in front of the current vehicle, reduce the speed to avoid collision
-            if self.vehicle_in_front:
-                distance_to_front_vehicle = self.get_distance_to_front_vehicle()
-                braking_distance = 150  # Tweak this value for smoother braking
-
-                if distance_to_front_vehicle < 10:
-                    # Harsh braking when very close to the front vehicle
-                    self.speed = 0
-                elif distance_to_front_vehicle < braking_distance:
-                    # Gradual deceleration when approaching the front vehicle
-                    self.speed *= 0.99
-
-        # Check if the vehicle has crossed the intersection
-        if self.check_crossed() and self.crossed is False:
-            self.crossed = True
-            self.simulation_instance.total_crossed_vehicles += 1
-
-            self.cross_time = time.time()
-            # Check for collision with other vehicles
-        if self.check_collision_with_vehicles():
-            self.speed = 0
-
-        # Move the vehicle based on the direction
-        self.move()
-
-        # Update rotated hit_box
-        self._create_hit_box()
-
-    def get_distance_to_front_vehicle(self):
-        # Get the distance to the vehicle in front of the current vehicle
-        if self.vehicle_in_front:
-            if self.direction in ['right']:
-                # Calculate distance considering hit_box dimensions
-                return abs(self.vehicle_in_front.x - (self.x + self.hit_box.width / 2))
-            elif self.direction in ['down']:
-                # Calculate distance considering hit_box dimensions
-                return abs(self.vehicle_in_front.y - (self.y + self.hit_box.height / 2))
-            elif self.direction in ['left']:
-                # Calculate distance considering hit_box dimensions
-                return abs(self.x - (self.vehicle_in_front.x + self.vehicle_in_front.hit_box.width / 2))
-            elif self.direction in ['up']:
-                # Calculate distance considering hit_box dimensions
-                return abs(self.y - (self.vehicle_in_front.y + self.vehicle_in_front.hit_box.height / 2))
-        return float('inf')  # Return infinity if there is no vehicle in front
-
-    def move(self):
-        # Move the vehicle based on the direction
-        if self.direction == 'right':
-            self.x += (self.speed * 2 * self.simulation_speed)
-        elif self.direction == 'down':
-            self.y += (self.speed * 2 * self.simulation_speed)
-        elif self.direction == 'left':
-            self.x -= (self.speed * 2 * self.simulation_speed)
-        elif self.direction == 'up':
-            self.y -= (self.speed * 2 * self.simulation_speed)
-
-        # Update the rect attribute for collision detection
-        self.rect.x = self.x
-        self.rect.y = self.y
-
-    def get_collision_direction(self, other_vehicle):
-        # Get the direction of the collision with another vehicle
-        if self.direction == 'right':
-            if other_vehicle.x > self.x:
-                return 'front'
-            elif other_vehicle.x < self.x:
-                return 'back'
-            else:
-                return 'side'
-        elif self.direction == 'down':
-            if other_vehicle.y > self.y:
-                return 'front'
-            elif other_vehicle.y < self.y:
-                return 'back'
-            else:
-                return 'side'
-        elif self.direction == 'left':
-            if other_vehicle.x < self.x:
-                return 'front'
-            elif other_vehicle.x > self.x:
-                return 'back'
-            else:
-                return 'side'
-        elif self.direction == 'up':
-            if other_vehicle.y < self.y:
-                return 'front'
-            elif other_vehicle.y > self.y:
-                return 'back'
-            else:
-                return 'side'
-
-    def check_limit(self):
-        # Check if the vehicle has reached the limit
-        if self.direction == 'right' and self.x > 1600:
-            return True
-        elif self.direction == 'down' and self.y > 1600:
-            return True
-        elif self.direction == 'left' and self.x < -200:
-            return True
-        elif self.direction == 'up' and self.y < -200:
-            return True
+            if self.size == self.capacity:
+                self._grow(2 * self.capacity)
+            row = self.size
+            self.size += 1
+        direction_number = lane % noOfSignals
+        length = typeLengths[type_number]
+        self.position[row] = position
+        self.speed[row] = typeSpeeds[type_number] if speed is None else speed
+        self.max_speed[row] = typeSpeeds[type_number]
+        self.acceleration[row] = typeAccelerations[type_number]
+        self.length[row] = length
+        self.width[row] = typeWidths[type_number]
+        self.vehicle_id[row] = vehicle_id
+        self.lane[row] = lane
+        self.direction[row] = direction_number
+        self.vehicle_type[row] = type_number
+        self.crossed[row] = False
+        self.alive[row] = True
+        self.spawn_time[row] = spawn_time
+        self.origin_time[row] = spawn_time if origin_time is None else origin_time
+        self.cross_time[row] = np.nan
+        self.stop_position[row] = stopPositions[direction_number]
+        self.cross_position[row] = crossPositions[direction_number]
+        self.limit_position[row] = limitPositions[direction_number]
+        self.exit_position[row] = exitPositions[direction_number]
+        self.front_offset[row] = frontOffsets[direction_number] * length
+        self.leader_offset[row] = leaderOffsets[direction_number] * length
+        self.follower_offset[row] = followerOffsets[direction_number] * length
+        self._insert(row)
+        return row
+
+    def _insert(self, row):
+        # Insert the row in its lane's queue. New vehicles spawn around the rear of the lane, so walking from the
+        # rear only passes the few vehicles spawned just before it.
+        lane = self.lane[row]
+        position = self.position[row]
+        behind = -1
+        ahead = self.lane_rear[lane]
+        while ahead != -1 and self.position[ahead] < position:
+            behind = ahead
+            ahead = self.leader[ahead]
+        self.leader[row] = ahead
+        self.follower[row] = behind
+        if ahead != -1:
+            self.follower[ahead] = row
         else:
-            return False
-
-    def get_vehicle_in_front(self):
-        # Get the vehicle in front of the current vehicle (closest one)
-        if self.direction == 'right':
-            vehicles_in_front = [vehicle for vehicle in laneGroups[self.direction] if vehicle.x > self.x]
-            if vehicles_in_front:
-                self.vehicle_in_front = min(vehicles_in_front, key=lambda x: x.x)
-            else:
-                self.vehicle_in_front = None
-        elif self.direction == 'down':
-            vehicles_in_front = [vehicle for vehicle in laneGroups[self.direction] if vehicle.y > self.y]
-            if vehicles_in_front:
-                self.vehicle_in_front = min(vehicles_in_front, key=lambda x: x.y)
-            else:
-                self.vehicle_in_front = None
-        elif self.direction == 'left':
-            vehicles_in_front = [vehicle for vehicle in laneGroups[self.direction] if vehicle.x < self.x]
-            if vehicles_in_front:
-                self.vehicle_in_front = max(vehicles_in_front, key=lambda x: x.x)
+            self.lane_front[lane] = row
+        if behind != -1:
+            self.leader[behind] = row
+        else:
+            self.lane_rear[lane] = row
+
+    def remove(self, rows):
+        """Remove the vehicles of the given rows."""
+        rows = np.atleast_1d(rows).tolist()
+        for row in rows:
+            # Unlink the row from its lane's queue
+            lane = self.lane[row]
+            leader = self.leader[row]
+            follower = self.follower[row]
+            if follower != -1:
+                self.leader[follower] = leader
             else:
-                self.vehicle_in_front = None
-        elif self.direction == 'up':
-            vehicles_in_front = [vehicle for vehicle in laneGroups[self.direction] if vehicle.y < self.y]
-            if vehicles_in_front:
-                self.vehicle_in_front = max(vehicles_in_front, key=lambda x: x.y)
+                self.lane_rear[lane] = leader
+            if leader != -1:
+                self.follower[leader] = follower
             else:
-                self.vehicle_in_front = None
-
-
-def repeat(simulation_instance, simulation_speed):
-    global currentGreen, nextGreen, currentYellow
-    last_time = pygame.time.get_ticks()
-
-    while not simulation_instance.exit_event.is_set():
-        dt = pygame.time.get_ticks() - last_time
-        dt_seconds = dt / 1000  # Convert milliseconds to seconds
-        last_time = pygame.time.get_ticks()
-
-        signals[currentGreen].remaining_green_time -= simulation_speed * dt_seconds
-
-        if simulation_instance.traffic_light_policy == "optimal":
-            nextGreen = signals.index(max(signals, key=lambda x: x.vehicles_in_front))
-        else:  # Random traffic light policy
-            nextGreen = (currentGreen + 1) % noOfSignals
-
-        if signals[currentGreen].remaining_green_time < 0 and currentYellow == 0:
-            signals[currentGreen].remaining_green_time = 0
-            currentYellow = 1
-            signals[currentGreen].remaining_yellow_time = YELLOW_TIME  # Reset yellow time
-
-        if currentYellow == 1:
-            signals[currentGreen].remaining_yellow_time -= simulation_speed * dt_seconds
-
-        if signals[currentGreen].remaining_yellow_time < 0 and currentYellow == 1:
-            currentYellow = 0
-            signals[currentGreen].remaining_yellow_time = 0
-
-            currentGreen = -1
-            pygame.time.delay(int(DELAY_TIME / simulation_speed))
-
-            currentGreen = nextGreen
-
-            if simulation_instance.traffic_light_policy == "optimal":
-                signals[currentGreen].remaining_green_time = max(MIN_GREEN_TIME + 1,
-                                                                 signals[currentGreen].vehicles_in_front / 2)
-            else:  # Random traffic light policy
-                signals[currentGreen].remaining_green_time = MIN_GREEN_TIME + 1
+                self.lane_front[lane] = follower
+            self.leader[row] = -1
+            self.follower[row] = -1
+        self.alive[rows] = False
+        self.speed[rows] = 0
+        self.free_rows.extend(rows)
+
+    def lane_counts(self, uncrossed_only=False):
+        """Return the number of vehicles in each lane, optionally only those that did not cross yet."""
+        n = self.size
+        mask = self.alive[:n] & ~self.crossed[:n] if uncrossed_only else self.alive[:n]
+        return np.bincount(self.lane[:n][mask], minlength=self.lanes)
+
+    def out_of_bounds(self):
+        """Return the rows of the vehicles that left the screen."""
+        n = self.size
+        return np.flatnonzero(self.alive[:n] & (self.position[:n] > self.limit_position[:n]))
+
+    def in_junction(self):
+        """Return the rows of the vehicles inside the junction box, between the stop lines of the four approaches."""
+        n = self.size
+        front = self.position[:n] + self.front_offset[:n]
+        return np.flatnonzero(self.alive[:n] & (front > self.stop_position[:n])
+                              & (front - self.length[:n] < self.exit_position[:n]))
+
+    def boxes(self, rows):
+        """Return the left, top, right and bottom coordinates of the boxes of the given rows on the screen."""
+        direction = self.direction[rows]
+        along_x = laneAxes[direction] == 0
+        along = laneSigns[direction] * self.position[rows]
+        across = laneOffsets[direction]
+        length = self.length[rows]
+        width = self.width[rows]
+        left = np.where(along_x, along, across)
+        top = np.where(along_x, across, along)
+        return left, top, left + np.where(along_x, length, width), top + np.where(along_x, width, length)
+
+    def update(self, green_lanes, sim_time, step_factor, braking_factor):
+        """
+        Advance every vehicle by one tick.
+
+        Parameters:
+        green_lanes (np.ndarray): For each lane, whether its light is green.
+        sim_time (float): Current simulated time, recorded as the crossing time.
+        step_factor (float): Distance travelled during the tick for a unit speed.
+        braking_factor (float): Part of the speed kept during the tick when braking.
+
+        Returns:
+        np.ndarray: The rows of the vehicles that crossed the intersection during the tick.
+        """
+        n = self.size
+        alive = self.alive[:n]
+        position = self.position[:n]
+        speed = self.speed[:n]
+        crossed = self.crossed[:n]
+        front_offset = self.front_offset[:n]
+        cross_position = self.cross_position[:n]
+        front = position + front_offset
+
+        # Vehicles at the stop line of a red light brake and wait just before the intersection
+        at_stop_line = alive & ~crossed & (front >= self.stop_position[:n])
+        waiting = at_stop_line & ~green_lanes[self.lane[:n]]
+        speed[waiting] *= braking_factor
+        clamped = waiting & (front > cross_position)
+        position[clamped] = cross_position[clamped] - front_offset[clamped]
+        front[clamped] = cross_position[clamped]
+
+        # The others accelerate up to their maximum speed
+        accelerating = alive & ~waiting & (speed < self.max_speed[:n])
+        speed[accelerating] += self.acceleration[:n][accelerating] * step_factor
+
+        # Away from the stop line, vehicles slow down behind the vehicle in front of them. Vehicles of a lane never
+        # overtake each other, so the lane queues stay ordered and give the vehicle in front directly.
+        leaders = self.leader[:n]
+        has_leader = leaders >= 0
+        leaders = np.where(has_leader, leaders, 0)
+        distance = np.abs((position - self.leader_offset[:n])[leaders] - position - self.follower_offset[:n])
+        following = alive & ~at_stop_line & has_leader
+        speed[following & (distance < STOPPING_DISTANCE)] = 0
+        speed[following & (distance >= STOPPING_DISTANCE) & (distance < BRAKING_DISTANCE)] *= braking_factor
+
+        # Vehicles past the default stop line crossed the intersection
+        crossing = alive & ~crossed & (front > cross_position)
+        crossed[crossing] = True
+        self.cross_time[:n][crossing] = sim_time
+
+        # Vehicles overlapping the vehicle in front of them stop
+        leader_rear = (front - self.length[:n])[leaders]
+        speed[has_leader & (front > leader_rear)] = 0
+
+        # Move the vehicles along their lane
+        position += speed * step_factor
+        return np.flatnonzero(crossing)
 
-        pygame.time.delay(int(DELAY_TIME / simulation_speed))
 
+class Vehicle(pygame.sprite.Sprite):
+    """Class to represent a vehicle, as a view over its row of the simulation's VehicleStore used for rendering."""
 
-def generateVehicles(simulation_instance, simulation_speed, trafficDensity, direction_priority):
-    global vehicle_counter, vehicle_spawned_counter
-    while not simulation_instance.exit_event.is_set():
-        # Randomly select a vehicle type and direction
-        vehicle_type = vehicleTypes[random.randint(0, 3)]
+    def __init__(self, row, vehicles, image=None):
+        """Initialize the vehicle, with its rotated image if it is already known."""
+        super().__init__()
+        self.row = row
+        self.vehicles = vehicles
+        self.vehicle_id = int(vehicles.vehicle_id[row])
+        self.direction_number = int(self.vehicles.direction[row])
+        self.direction = directionNumbers[self.direction_number]
+        self.vehicle_type = vehicleTypes[int(self.vehicles.vehicle_type[row])]
+        self.rotation = rotations[self.direction]
+        if image is None:
+            image = pygame.transform.rotate(vehicleImages[self.vehicle_type], self.rotation)
+        self.image = image
+
+    @property
+    def x(self):
+        if laneAxes[self.direction_number] == 0:
+            return laneSigns[self.direction_number] * self.vehicles.position[self.row]
+        return x[self.direction][0]
+
+    @property
+    def y(self):
+        if laneAxes[self.direction_number] == 1:
+            return laneSigns[self.direction_number] * self.vehicles.position[self.row]
+        return y[self.direction][0]
+
+    @property
+    def speed(self):
+        return self.vehicles.speed[self.row]
+
+    @property
+    def crossed(self):
+        return bool(self.vehicles.crossed[self.row])
+
+    @property
+    def hit_box(self):
+        # Create a hit_box based on the rotated image
+        hit_box = self.image.get_rect()
+        hit_box.x = self.x
+        hit_box.y = self.y
+        return hit_box
+
+    @property
+    def rect(self):
+        return self.hit_box
+
+
+def repeat(intersection, dt):
+    """Advance the traffic signal cycle of the intersection by dt simulated seconds, as decided by its controller."""
+    signals = intersection.signals
+    controller = intersection.controller
+    state = intersection.queue_state
+    state.sim_time = intersection.sim_time
+
+    # All signals are red while switching to the next green light
+    if intersection.currentGreen == -1:
+        intersection.remainingAllRedTime -= dt
+        if intersection.remainingAllRedTime <= 0:
+            intersection.remainingAllRedTime = 0
+            intersection.currentGreen = intersection.nextGreen
+            state.current_green = intersection.currentGreen
+            state.green_time = 0
+            signals[intersection.currentGreen].remaining_green_time = controller.green_time(
+                state, intersection.currentGreen)
+        return
+
+    signal = signals[intersection.currentGreen]
+    signal.remaining_green_time -= dt
+    state.green_time += dt
+
+    if signal.remaining_green_time < 0 and intersection.currentYellow == 0:
+        extension = controller.extend_green(state)
+        if extension > 0:
+            signal.remaining_green_time += extension
+        else:
+            signal.remaining_green_time = 0
+            intersection.currentYellow = 1
+            signal.remaining_yellow_time = YELLOW_TIME  # Reset yellow time
+
+    if intersection.currentYellow == 1:
+        signal.remaining_yellow_time -= dt
+
+    if signal.remaining_yellow_time < 0 and intersection.currentYellow == 1:
+        intersection.currentYellow = 0
+        signal.remaining_yellow_time = 0
+
+        intersection.nextGreen = controller.next_green(state)
+        intersection.currentGreen = -1
+        intersection.remainingAllRedTime = DELAY_TIME / 1000
+
+
+def generateVehicles(intersection):
+    """Spawn every vehicle due at the intersection by the current simulated time."""
+    arrivals = intersection.arrivals
+    while arrivals.next_time <= intersection.sim_time:
+        type_number, direction_number, gap = arrivals.pop()
+
+        # The new vehicle is the last one of its lane, so it spawns its own length and a random distance behind the
+        # start of the lane
+        position = startPositions[direction_number] - typeLengths[type_number] - gap
+        intersection.vehicles.add(intersection.id_base + intersection.vehicle_counter, type_number,
+                                  intersection.lane_base + direction_number, position, intersection.sim_time)
+        intersection.vehicle_arrived(direction_number)
+        intersection.vehicle_counter += 1
+        intersection.vehicle_spawned_counter += 1
+
+
+def destroy_vehicle(intersection):
+    """Kill the vehicles that left the intersection's screen, once per simulated second."""
+    if intersection.sim_time < intersection.next_destroy_time:
+        return
+    intersection.next_destroy_time += 1
+    rows = intersection.vehicles.out_of_bounds()
+    if len(rows) > 0:
+        intersection.vehicles.remove(rows)
+        intersection.vehicle_kill_counter += len(rows)
+
+
+class Intersection:
+    """Class to represent a four-way intersection with its own signals, lanes, vehicles, counters and arrival
+    stream, so that any number of intersections can be stepped independently in one process."""
+
+    def __init__(self, simulation_speed, trafficDensity, direction_priority, traffic_light_policy, dt=DT, seed=None,
+                 vehicles=None, lane_base=0, arrivals=None):
+        """
+        Initialize the intersection.
+
+        Parameters:
+        simulation_speed (float): Speed factor of the simulation.
+        trafficDensity (float): Density of traffic (ranges from 0.1 to 1).
+        direction_priority (list): Weight of each direction (0: Down, 1: Left, 2: Up, 3: Right) for new vehicles.
+        traffic_light_policy (str or Controller): Name of a controller of the signals ("normal", "optimal",
+                                                  "max_pressure", "actuated"..., see controllers.py), or a
+                                                  controller.
+        dt (float): Wall-clock seconds one tick stands for, scaled by simulation_speed to simulated seconds.
+        seed: Seed of the random generator drawing the arriving vehicles.
+        vehicles (VehicleStore): Store shared with other intersections, whose lanes lane_base to
+                                 lane_base + noOfSignals - 1 belong to this one. Its owner updates the vehicles and
+                                 kills those leaving the screen (see network.Network).
+        arrivals (np.ndarray): Arrival schedule to replay instead of drawing the vehicles (see arrivals.py).
+        """
+        self.simulation_speed = simulation_speed
+        self.trafficDensity = trafficDensity
+        self.direction_priority = direction_priority
+        self.traffic_light_policy = traffic_light_policy
 
-        # Randomly select a vehicle type based on the direction priority
-        direction_number = random.choices(population=[0, 1, 2, 3], weights=direction_priority, k=1)[0]
-        direction = directionNumbers[direction_number]
+        # Fixed timestep engine: one tick stands for dt wall-clock seconds, i.e. dt * FPS reference frames
+        self.dt = dt
+        self.step_factor = 2 * simulation_speed * dt * FPS  # Pixels travelled per tick for a unit speed
+        self.braking_factor = 0.99 ** (dt * FPS)  # Speed kept per tick when braking
+        self.shared_vehicles = vehicles
+        self.lane_base = lane_base
+        self.id_base = 0  # Added to the vehicle ids, to keep them unique across intersections
+        self.schedule = arrivals
+        self.recorder = None  # recorder.EventRecorder of the vehicles' events, if any
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        """Put the intersection back in its initial state, with no vehicle and its arrivals from the start."""
+        self.arrivals = ArrivalStream(self.trafficDensity, self.direction_priority, seed=seed, schedule=self.schedule)
+        from controllers import QueueState, make_controller
+        self.signals = [TrafficSignal(10, 3, 5) for _ in range(noOfSignals)]
+        self.controller = make_controller(self.traffic_light_policy)
+        self.queue_state = QueueState()
+        self.vehicles = VehicleStore() if self.shared_vehicles is None else self.shared_vehicles
+        self.currentGreen = 0  # Index indicating which signal is currently green
+        self.nextGreen = 0  # Index indicating which signal will turn green next
+        self.currentYellow = 0  # Indicates whether yellow signal is on or off
+        self.remainingAllRedTime = 0  # Remaining all-red time before nextGreen turns green (currentGreen is -1)
+        self.ticks = 0  # Number of ticks run so far
+        self.sim_time = 0  # Simulated clock, in simulated seconds
+        self.next_destroy_time = 0
+        self.total_crossed_vehicles = 0  # Total number of crossed vehicles
+        self.vehicle_counter = 0  # Counter for total spawned vehicles
+        self.vehicle_spawned_counter = 0  # Counter for vehicles spawned in the simulation
+        self.vehicle_kill_counter = 0  # Counter for vehicles kill in the simulation
+        self.metrics = CrossingMetrics()  # Statistics of the crossing times and queues
+        self.total_crossing_time = 0  # Sum of the crossing times
+        self.conflict_detector = ConflictDetector(laneAxes, typeLengths.max())
+
+    @property
+    def drained(self):
+        """Whether the arrivals are exhausted and every vehicle that arrived crossed the intersection."""
+        return self.arrivals.exhausted and self.total_crossed_vehicles >= self.vehicle_counter
+
+    def rows(self):
+        """Return the rows of the intersection's vehicles in its store."""
+        n = self.vehicles.size
+        lane = self.vehicles.lane[:n]
+        return np.flatnonzero(self.vehicles.alive[:n] & (lane >= self.lane_base)
+                              & (lane < self.lane_base + noOfSignals))
+
+    def lane_counts(self, uncrossed_only=False):
+        """Return the number of vehicles in each lane of the intersection (see VehicleStore.lane_counts)."""
+        return self.vehicles.lane_counts(uncrossed_only)[self.lane_base:self.lane_base + noOfSignals]
+
+    def green_lanes(self):
+        """Return, for each lane of the intersection, whether its light is green."""
+        return np.arange(noOfSignals) == self.currentGreen
+
+    def step_signals(self):
+        """Spawn the new vehicles and advance the traffic signal cycle by one tick."""
+        generateVehicles(self)
+        repeat(self, self.dt * self.simulation_speed)
+
+    def vehicle_arrived(self, direction_number):
+        """Count a vehicle entering the lane of a direction, in front of its signal."""
+        self.metrics.update_queues(self.queue_state.queues, self.sim_time)
+        self.queue_state.queues[direction_number] += 1
+        self.signals[direction_number].vehicles_in_front += 1
+
+    def record_crossings(self, rows):
+        """Count the vehicles of the given rows, which just crossed the intersection."""
+        if len(rows) == 0:
+            return
+        self.metrics.update_queues(self.queue_state.queues, self.sim_time)
+        direction_numbers = self.vehicles.direction[rows]
+        for direction_number in direction_numbers.tolist():
+            self.queue_state.queues[direction_number] -= 1
+            self.signals[direction_number].vehicles_in_front -= 1
+        self.total_crossed_vehicles += len(rows)
+        crossing_times = self.vehicles.cross_time[rows] - self.vehicles.spawn_time[rows]
+        self.metrics.add_crossings(crossing_times, direction_numbers, self.vehicles.vehicle_type[rows])
+        self.total_crossing_time += crossing_times.sum()
+
+    def advance_clock(self):
+        self.ticks += 1
+        self.sim_time = self.ticks * self.dt * self.simulation_speed
+
+    def step(self):
+        """Advance the intersection by one tick of dt."""
+        self.step_signals()
+        destroy_vehicle(self)
+        crossed_rows = self.vehicles.update(self.green_lanes(), self.sim_time, self.step_factor,
+                                            self.braking_factor)
+        self.record_crossings(crossed_rows)
+        self.conflict_detector.update(self.vehicles, self.sim_time)
+        if self.recorder is not None:
+            self.recorder.observe(self.vehicles, self.sim_time)
+        self.advance_clock()
 
-        # Create a vehicle object
-        new_vehicle = Vehicle(vehicle_type, direction_number, direction, simulation_speed, simulation_instance)
 
-        # Check if there are existing vehicles on the lane
-        if len(laneGroups[direction]) > 0:
-            # Get the last vehicle on the lane based on his direction and current coords
-            last_vehicle = laneGroups[direction].sprites()[-1]
+class RunSimulation:
+    def __init__(self, total_vehicles_to_cross, simulation_speed, trafficDensity, direction_priority,
+                 traffic_light_policy, headless=False, dt=DT, seed=None, network=None, render_fps=None,
+                 arrivals=None, model=None, recorder=None, paced=True):
+        """
+        Run a simulation until total_vehicles_to_cross vehicles crossed the intersection.
 
-            # Set the spawn position behind the last vehicle based on the direction with a distance
-            if direction == 'right':
-                new_vehicle.x = last_vehicle.x - new_vehicle.hit_box.width - random.randint(100, 200)
-            elif direction == 'down':
-                new_vehicle.y = last_vehicle.y - new_vehicle.hit_box.height - random.randint(100, 200)
-            elif direction == 'left':
-                new_vehicle.x = last_vehicle.x + last_vehicle.hit_box.width + random.randint(100, 200)
-            elif direction == 'up':
-                new_vehicle.y = last_vehicle.y + last_vehicle.hit_box.height + random.randint(100, 200)
+        The simulation advances a simulated clock in fixed steps of dt (wall-clock seconds of a frame, scaled by
+        simulation_speed). In headless mode nothing is drawn and the loop runs as fast as possible; runs with the
+        same seed give the same results, and draw the same vehicles whatever the traffic light policy.
 
-        simulation_instance.add(new_vehicle)
-        vehicle_counter += 1
-        vehicle_spawned_counter += 1
-        time.sleep(1 / (simulation_speed * 3 * trafficDensity))  # Adjusted delay based on simulation speed
+        With arrivals (an arrival schedule, or the name of a .npy file saved by arrivals.save_arrivals), the vehicles
+        of the schedule are replayed instead of being drawn, and the simulation also stops once they all crossed.
 
+        With a model (a dict, or the name of a file of the 'modele ML' folder such as 'modele ML/bestModel.txt'), the
+        signals are controlled by a controllers.ModelController of the model instead of traffic_light_policy.
 
-def destroy_vehicle(simulation_speed, simulation_instance):
-    global vehicle_kill_counter
-    while not simulation_instance.exit_event.is_set():
-        for vehicle in simulation_instance.simulation:
-            if vehicle.check_limit():
-                vehicle.kill()
-                vehicle_kill_counter += 1
-        time.sleep(1 / simulation_speed)
+        With a network (a network.Network or the name of a JSON file for network.load_network), the simulation runs
+        until total_vehicles_to_cross vehicles left the network, and the window shows its first intersection.
 
+        With a recorder (a recorder.EventRecorder, or the name of its file), the events of the vehicles are recorded
+        to its file, closed at the end of the run (see recorder.load_events to read it).
 
-class RunSimulation:
-    def __init__(self, total_vehicles_to_cross, simulation_speed, trafficDensity, direction_priority,
-                 traffic_light_policy):
-        global total_crossed_vehicles
-        pygame.init()  # Initialize pygame
-        self.traffic_light_policy = traffic_light_policy
-        self.direction_priority = direction_priority
+        In windowed mode, the window is drawn render_fps times per second (renderer.RENDER_FPS by default), every
+        1 / (dt * render_fps) ticks of the simulation, which keeps running in real time (as fast as possible if paced
+        is False, e.g. to measure the cost of drawing).
+        """
         self.simulation = pygame.sprite.Group()
+        self.vehicle_views = {}  # Vehicle sprites drawn in windowed mode, by row of the store
         self.total_time = 0
         self.average_waiting_time = 0
         self.min_waiting_time = 0
         self.max_waiting_time = 0
+        self.metrics = None  # metrics.CrossingMetrics of the run
+        self.safety_results = {}
+        self.total_rewards = 0
 
         # Flag to toggle debug mode
         self.debug_mode = False
 
-        self.exit_event = threading.Event()
+        self.headless = headless
+        self.paced = paced
         self.total_vehicles_to_cross = total_vehicles_to_cross
         self.simulation_speed = simulation_speed
-        # Initialize a clock object to control the frame rate
-        self.clock = pygame.time.Clock()
-        self.crossing_times = []  # Initialize crossing times list
-
-        self.total_crossed_vehicles = 0
-        self.crossing_times = []  # Initialize crossing times list
-
-        # Variable to track the total number of crossed vehicles
-        self.total_crossed_vehicles = 0
-        def load_values_from_file(filename):
-            with open(filename, 'r') as file:  # 'r' pour le mode lecture (read mode)
-                values = [line.strip() for line in
-                          file.readlines()]
-            return values
-
-            # Utilisation de la fonction pour charger les données de 'bestModel.txt'
-            filename = "bestModel.txt"  # Assurez-vous que le chemin est correct
-            model_values = load_values_from_file(filename)
-        self.initialize()
-
-        self.thread1 = threading.Thread(name="generate_vehicles", target=generateVehicles,
-                                        args=(self, self.simulation_speed, trafficDensity, self.direction_priority))
-        self.thread1.daemon = True
-        self.thread1.start()
-
-        self.thread2 = threading.Thread(name="kill_and_replace", target=destroy_vehicle,
-                                        args=(self.simulation_speed, self,))
-        self.thread2.daemon = True
-        self.thread2.start()
-
-        self.thread3 = threading.Thread(name="repeat", target=repeat, args=(self, simulation_speed))
-        self.thread3.daemon = True
-        self.thread3.start()
-
-        # Set up pygame
-        pygame.init()
-
-        # Define colors and screen size
-        self.black = (0, 0, 0)
-        self.white = (255, 255, 255)
-        self.screenWidth = 1400
-        self.screenHeight = 1000
-        self.screenSize = (self.screenWidth, self.screenHeight)
-
-        # Load background image and set up display
-        self.background = pygame.image.load('images/intersection.png')
-        self.screen = pygame.display.set_mode(self.screenSize)
-        pygame.display.set_caption("SIMULATION")
-
-        # Set up font
-        self.font = pygame.font.Font(None, 30)
+        if model is not None:
+            # The signals are controlled by the model instead of the traffic light policy
+            from controllers import ModelController, load_model
+            traffic_light_policy = ModelController(load_model(model) if isinstance(model, str) else model)
+        if network is None:
+            self.network = None
+            if isinstance(arrivals, str):
+                arrivals = load_arrivals(arrivals)
+            self.intersection = Intersection(simulation_speed, trafficDensity, direction_priority,
+                                             traffic_light_policy, dt=dt, seed=seed, arrivals=arrivals)
+        else:
+            from network import Network, load_network
+            if not isinstance(network, Network):
+                network = load_network(network, simulation_speed, trafficDensity, direction_priority,
+                                       traffic_light_policy, dt=dt, seed=seed)
+            self.network = network
+            self.intersection = next(iter(network.intersections.values()))
+        if isinstance(recorder, str):
+            from recorder import EventRecorder
+            recorder = EventRecorder(recorder)
+        self.recorder = recorder
+        (self.intersection if self.network is None else self.network).recorder = recorder
+
+        if not self.headless:
+            from renderer import RENDER_FPS, Renderer
+            self.render_fps = RENDER_FPS if render_fps is None else render_fps
+            self.ticks_per_frame = max(1, round(1 / (dt * self.render_fps)))
+
+            # Initialize a clock object to control the frame rate
+            self.clock = pygame.time.Clock()
+            self.renderer = Renderer()
         self.run()
 
     def add(self, vehicle):
         self.simulation.add(vehicle)
+        self.vehicle_views[vehicle.row] = vehicle
 
     def add_reward(self):
         self.total_rewards += 1
@@ -492,168 +649,110 @@ class RunSimulation:
         self.total_rewards -= 3
 
     def reset_simulation(self):
-        global total_crossed_vehicles, signals, vehicle_counter, vehicle_spawned_counter, vehicle_kill_counter
-        # kill all threads
-        # Set the exit event to signal threads to exit
-        self.exit_event.set()
-
-        # Wait for threads to finish
-        self.thread1.join()
-        self.thread2.join()
-        self.thread3.join()
-
-        # Reset the exit event
-        self.exit_event.clear()
-
-        total_crossed_vehicles = 0
         self.simulation.empty()
-        signals.clear()
-        vehicle_counter = 0
-        vehicle_spawned_counter = 0
-        vehicle_kill_counter = 0
-        self.initialize()  # Reinitialize signals
-        for direction in laneGroups:
-            laneGroups[direction].empty()
-        # Recreate laneGroups for each direction
-        laneGroups['right'] = pygame.sprite.Group()
-        laneGroups['down'] = pygame.sprite.Group()
-        laneGroups['left'] = pygame.sprite.Group()
-        laneGroups['up'] = pygame.sprite.Group()
-        # Recreate signals with initial values
-        for i in range(0, noOfSignals):
-            signals.append(TrafficSignal(10, 3, 5))
-        self.exit_event.clear()
-        pygame.quit()
+        self.vehicle_views.clear()
+        if not self.headless:
+            pygame.quit()
 
     def toggle_debug_mode(self):
         self.debug_mode = not self.debug_mode
 
+    def update_vehicle_views(self):
+        """Create the sprites of the new vehicles of the intersection and kill those of the removed ones."""
+        vehicles = self.intersection.vehicles
+        rows = self.intersection.rows().tolist()
+        for row, vehicle in list(self.vehicle_views.items()):
+            if not vehicles.alive[row] or vehicles.vehicle_id[row] != vehicle.vehicle_id:
+                vehicle.kill()
+                del self.vehicle_views[row]
+        for row in rows:
+            if row not in self.vehicle_views:
+                image = self.renderer.vehicle_image(vehicleTypes[int(vehicles.vehicle_type[row])],
+                                                    directionNumbers[int(vehicles.direction[row])])
+                self.add(Vehicle(row, vehicles, image))
+
+    def debug_lines(self):
+        """Return the (position, text) of the debug texts."""
+        intersection = self.intersection
+        lane_counts = intersection.lane_counts()
+        lines = [
+            ((10, 10), "DEBUG SIMULATION"),
+            # Display total crossed vehicles in the top left corner
+            ((10, 40), f"Crossed: {intersection.total_crossed_vehicles}"),
+            # display the elapsed time in the simulation
+            ((10, 60), f"Elapsed time: {intersection.sim_time:.1f} seconds"),
+            # display the total vehicles spawned and killed
+            ((10, 100), f"Spawned: {intersection.vehicle_spawned_counter} vehicles"),
+            ((10, 120), f"Killed: {intersection.vehicle_kill_counter} vehicles"),
+            # display the total vehicles currently in the simulation, and for each direction
+            ((10, 160), f"Current vehicles: {lane_counts.sum()}"),
+            ((10, 180), f"Right: {lane_counts[3]}"),
+            ((10, 200), f"Down: {lane_counts[0]}"),
+            ((10, 220), f"Left: {lane_counts[1]}"),
+            ((10, 240), f"Up: {lane_counts[2]}"),
+        ]
+        for i in range(noOfSignals):
+            # Display the number of vehicles in front of the stop line
+            lines.append(((10, 260 + i * 20), f"Vehicles in front ({directionNumbers[i]}): "
+                                              f"{intersection.signals[i].vehicles_in_front}"))
+        return lines
+
+    def render(self):
+        """Draw the current state of the simulation on the screen."""
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F10:
+                    self.toggle_debug_mode()
+
+        self.update_vehicle_views()
+        self.renderer.draw(self.intersection, self.simulation, self.debug_lines() if self.debug_mode else (),
+                           self.debug_mode)
+
+        # Use clock.tick() to control the frame rate, one frame standing for several ticks of the simulation
+        self.clock.tick(self.render_fps if self.paced else 0)
+
     def run(self):
-        while self.total_crossed_vehicles < self.total_vehicles_to_cross:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    sys.exit()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_F10:
-                        self.toggle_debug_mode()
-
-            self.screen.blit(self.background, (0, 0))
-
-            if self.debug_mode:
-                # Display total crossed vehicles in the top left corner
-                crossed_text = f"DEBUG SIMULATION"
-                crossed_text_surface = self.font.render(crossed_text, True, self.white, self.black)
-                self.screen.blit(crossed_text_surface, (10, 10))
-                # Display total crossed vehicles in the top left corner
-                crossed_text = f"Crossed: {self.total_crossed_vehicles}"
-                crossed_text_surface = self.font.render(crossed_text, True, self.white, self.black)
-                self.screen.blit(crossed_text_surface, (10, 40))
-                # display the elapsed time in the simulation
-                elapsed_time = f"Elapsed time: {pygame.time.get_ticks() * self.simulation_speed / 1000} seconds"
-                elapsed_time_surface = self.font.render(elapsed_time, True, self.white, self.black)
-                self.screen.blit(elapsed_time_surface, (10, 60))
-                # display the total vehicles spawned
-                vehicle_text = f"Spawned: {vehicle_spawned_counter} vehicles"
-                vehicle_text_surface = self.font.render(vehicle_text, True, self.white, self.black)
-                self.screen.blit(vehicle_text_surface, (10, 100))
-                # display the total vehicles killed
-                killed_vehicles = f"Killed: {vehicle_kill_counter} vehicles"
-                killed_vehicles_surface = self.font.render(killed_vehicles, True, self.white, self.black)
-                self.screen.blit(killed_vehicles_surface, (10, 120))
-                # display the total vehicles currently in the simulation
-                current_vehicles = f"Current vehicles: {len(self.simulation)}"
-                current_vehicles_surface = self.font.render(current_vehicles, True, self.white, self.black)
-                self.screen.blit(current_vehicles_surface, (10, 160))
-                # display the total vehicles for each direction
-                vehicles_right = f"Right: {len(laneGroups['right'])}"
-                vehicles_right_surface = self.font.render(vehicles_right, True, self.white, self.black)
-                self.screen.blit(vehicles_right_surface, (10, 180))
-                vehicles_down = f"Down: {len(laneGroups['down'])}"
-                vehicles_down_surface = self.font.render(vehicles_down, True, self.white, self.black)
-                self.screen.blit(vehicles_down_surface, (10, 200))
-                vehicles_left = f"Left: {len(laneGroups['left'])}"
-                vehicles_left_surface = self.font.render(vehicles_left, True, self.white, self.black)
-                self.screen.blit(vehicles_left_surface, (10, 220))
-                vehicles_up = f"Up: {len(laneGroups['up'])}"
-                vehicles_up_surface = self.font.render(vehicles_up, True, self.white, self.black)
-                self.screen.blit(vehicles_up_surface, (10, 240))
-
-            # Display signals
-            for i in range(0, noOfSignals):
-                rotated_signal = pygame.transform.rotate(red_signal_image, i * 90)
-                if i == currentGreen:
-                    if currentYellow == 1:
-                        rotated_signal = pygame.transform.rotate(yellow_signal_image, i * 90)
-                    else:
-                        # Adjust the rotation angle for signals 0 and 2
-                        rotated_signal = pygame.transform.rotate(green_signal_image, (i + 2) % noOfSignals * 270)
-                else:
-                    # Adjust the rotation angle for signals 0 and 2
-                    rotated_signal = pygame.transform.rotate(red_signal_image, (i + 2) % noOfSignals * 270)
-
-                self.screen.blit(rotated_signal, signalCords[i])
-
-                # Update the number of vehicles in front of the stop line for each signal
-                signals[i].vehicles_in_front = 0
-
-                for vehicle in laneGroups[directionNumbers[i]]:
-                    if vehicle.crossed is False:
-                        signals[i].vehicles_in_front += 1
-
-                if self.debug_mode:
-                    # Display the number of vehicles in front of the stop line
-                    vehicles_in_front_text = f"Vehicles in front ({directionNumbers[i]}): {signals[i].vehicles_in_front}"
-                    vehicles_in_front_surface = self.font.render(vehicles_in_front_text, True, self.white, self.black)
-                    self.screen.blit(vehicles_in_front_surface, (10, 260 + i * 20))
-
-            # Display vehicles
-            for vehicle in self.simulation:
-                self.screen.blit(vehicle.image, [vehicle.x, vehicle.y])
-                if self.debug_mode:
-                    # Display the direction of each vehicle
-                    direction_text = f"{vehicle.direction}"
-                    direction_surface = self.font.render(direction_text, True, self.white, self.black)
-                    self.screen.blit(direction_surface, (vehicle.x + 10, vehicle.y - 20))
-                    pygame.draw.rect(self.screen, (255, 0, 0), vehicle.hit_box, 2)
-
-                vehicle.update()
-                if vehicle.cross_time is not None and vehicle.flag is False:
-                    spawn_to_cross_time = vehicle.cross_time - vehicle.spawn_time
-                    self.crossing_times.append(spawn_to_cross_time * self.simulation_speed)
-                    vehicle.flag = True
-
-            pygame.display.update()
-
-            # Use clock.tick() to control the frame rate
-            self.clock.tick(FPS)  # Adjust to the desired frame rate
-
-        self.total_time = pygame.time.get_ticks() * self.simulation_speed / 1000
+        if self.network is None:
+            simulation, progress = self.intersection, lambda: self.intersection.total_crossed_vehicles
+        else:
+            simulation, progress = self.network, lambda: self.network.exited_vehicles
+        while progress() < self.total_vehicles_to_cross and not simulation.drained:
+            if not self.headless and simulation.ticks % self.ticks_per_frame == 0:
+                self.render()
+            simulation.step()
+
+        self.total_time = simulation.sim_time
         print(f"Simulation completed. Total time: {self.total_time} seconds.")
-        self.average_waiting_time = sum(self.crossing_times) / len(self.crossing_times)
-        self.min_waiting_time = min(self.crossing_times)
-        self.max_waiting_time = max(self.crossing_times)
+        if self.network is None:
+            # Integrate the queues up to the end of the run
+            simulation.metrics.update_queues(simulation.queue_state.queues, simulation.sim_time)
+        self.metrics = simulation.metrics
+        self.average_waiting_time = float(self.metrics.crossing.mean)
+        self.min_waiting_time = float(self.metrics.crossing.min)
+        self.max_waiting_time = float(self.metrics.crossing.max)
+        self.safety_results = simulation.conflict_detector.get_results()
+        if self.recorder is not None:
+            self.recorder.close()
 
         # Reset the simulation after completion
         self.reset_simulation()
 
-    def initialize(self):
-        global signals, laneGroups
-        signals = []  # Clear existing signals
-        self.crossing_times = []  # Clear existing crossing times
-        for i in range(0, noOfSignals):
-            signals.append(TrafficSignal(10, 3, 5))
-
-        laneGroups = {'right': pygame.sprite.Group(), 'down': pygame.sprite.Group(), 'left': pygame.sprite.Group(),
-                      'up': pygame.sprite.Group()}
-
     def get_results(self):
-        return {
+        results = {
             'Total time': self.total_time,
             'average_crossing_time': self.average_waiting_time,
             'max_crossing_time': self.max_waiting_time,
-            'min_crossing_time': self.min_waiting_time
+            'min_crossing_time': self.min_waiting_time,
+            **{f'{name}_crossing_time': value for name, value in self.metrics.crossing.summary().items()
+               if name in QUANTILES},
+            **self.safety_results
         }
+        if self.network is not None:
+            results.update(self.network.get_results())
+        return results
 
     def save_model(model, filename):
         with open(filename, 'wb') as f:
-            pickle.dump(model, f)
\ No newline at end of file
+            pickle.dump(model, f)